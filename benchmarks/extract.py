@@ -0,0 +1,82 @@
+from __future__ import annotations
+import argparse
+import time
+from typing import List, Tuple
+
+from .fixtures import recorded_document
+
+from treecare.docai import Block, PARAGRAPH, LINE, TABLE, FIGURE
+from treecare.pipeline import extract_blocks
+
+# Micro-benchmark of block extraction on the recorded test_output.json pages: the pipeline's
+# raw-protobuf extract_blocks against the previous proto-plus implementation, kept below as
+# the reference. Both must produce identical blocks.
+
+
+def _proto_xyxy(layout) -> Tuple[float, float, float, float]:
+    poly = layout.bounding_poly
+    vertices = poly.normalized_vertices if poly and len(poly.normalized_vertices) else (poly.vertices if poly else [])
+    if not vertices:
+        return (0.0, 0.0, 0.0, 0.0)
+    xs = [v.x or 0.0 for v in vertices]
+    ys = [v.y or 0.0 for v in vertices]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _proto_block(text: str, layout, page_index: int, type: str) -> Block:
+    anchor = layout.text_anchor
+    segs = anchor.text_segments if anchor else []
+    bbox = _proto_xyxy(layout)
+    if len(segs) == 1:
+        seg = segs[0]
+        start = int(seg.start_index) if seg.start_index is not None else 0
+        end = int(seg.end_index) if seg.end_index is not None else start
+        return Block(page_index, bbox, type, text, start, end)
+    joined = "".join(text[int(sg.start_index):int(sg.end_index)] for sg in segs)
+    return Block(page_index, bbox, type, joined, 0, len(joined))
+
+
+def extract_blocks_proto(doc, offset: int = 0) -> List[Block]:
+    # extract_blocks before the raw-protobuf walk: proto-plus attribute access throughout
+    blocks: List[Block] = []
+    text = doc.text
+    for p_idx, page in enumerate(doc.pages, start=offset):
+        for para in page.paragraphs:
+            blocks.append(_proto_block(text, para.layout, p_idx, PARAGRAPH))
+        for line in getattr(page, 'lines', []):
+            blocks.append(_proto_block(text, line.layout, p_idx, LINE))
+        for table in getattr(page, 'tables', []):
+            blocks.append(Block(p_idx, _proto_xyxy(table.layout), TABLE))
+        for figure in getattr(page, 'figures', []):
+            blocks.append(Block(p_idx, _proto_xyxy(figure.layout), FIGURE))
+    return blocks
+
+
+def best_of(fn, doc, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(doc)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Block extraction: raw protobuf vs proto-plus")
+    ap.add_argument("--repeat", type=int, default=20, help="Timed runs per implementation; the best is reported")
+    args = ap.parse_args()
+
+    doc = recorded_document()
+    n_pages = len(doc.pages)
+    fast, slow = extract_blocks(doc), extract_blocks_proto(doc)
+    key = lambda b: (b.page_index, b.bbox, b.type, b.text)
+    if list(map(key, fast)) != list(map(key, slow)):
+        raise SystemExit("extract_blocks and the proto-plus reference disagree")
+    results = {name: best_of(fn, doc, args.repeat) for name, fn in (("proto-plus", extract_blocks_proto), ("raw protobuf", extract_blocks))}
+    for name, seconds in results.items():
+        print(f"{name:<13} {seconds / n_pages * 1000:8.3f} ms/page")
+    print(f"{len(fast)} identical blocks from {n_pages} pages; speedup x{results['proto-plus'] / results['raw protobuf']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import sys
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT / "src") not in sys.path:
+    sys.path.insert(0, str(ROOT / "src"))  # run from a checkout without installing
+
+import fitz  # PyMuPDF
+from google.cloud import documentai_v1 as documentai
+
+from treecare.backends import tile_document
+from treecare.chunks import MAX_SYNC_PAGES
+from treecare.config import settings
+from treecare.db import BulkWriter, init_db, get_conn
+from treecare.docai import Block
+from treecare.ingest import plan_pdf
+from treecare.pipeline import commit_job, pages_from_doc, segment_pages
+
+# test_quick records the first pages of the first sample PDF into test_output.json,
+# so those pages and that response describe the same geometry
+RECORDED = ROOT / "test_output.json"
+SAMPLES = ROOT / "pdfs" / "raw"
+
+
+def recorded_document() -> documentai.Document:
+    return documentai.Document.from_json(RECORDED.read_text(encoding="utf-8"), ignore_unknown_fields=True)
+
+
+def sample_pdf() -> Path:
+    return sorted(SAMPLES.glob("*.pdf"))[0]
+
+
+def synthetic_pdf(path: Path, n_pages: int, source: Path, source_pages: int) -> Path:
+    # The first source_pages pages repeated to n_pages. Repeats share the original page's
+    # content stream and resources and the page tree is written once, so 10k pages take ~1 s.
+    out = fitz.open()
+    with fitz.open(str(source)) as src:
+        out.insert_pdf(src, from_page=0, to_page=source_pages - 1)
+    pages_xref = int(out.xref_get_key(out.pdf_catalog(), "Pages")[1].split()[0])
+    kids = [out[i].xref for i in range(source_pages)]
+    for i in range(source_pages, n_pages):
+        xref = out.get_new_xref()
+        out.update_object(xref, out.xref_object(kids[i % source_pages], compressed=True))
+        kids.append(xref)
+    out.xref_set_key(pages_xref, "Kids", "[" + " ".join(f"{x} 0 R" for x in kids) + "]")
+    out.xref_set_key(pages_xref, "Count", str(n_pages))
+    out.save(str(path))
+    out.close()
+    return path
+
+
+def write_db(db_path: str, pdf_path: Path, n_pages: int, segmented: List[tuple[int, List[Dict[str, Any]]]],
+             dedup: bool = True) -> int:
+    # The pipeline's write path: one transaction per MAX_SYNC_PAGES chunk through commit_job.
+    # dedup=False skips duplicate linking (synthetic pages are all repeats of each other).
+    threshold = settings.dedup_threshold
+    if not dedup:
+        settings.dedup_threshold = 0
+    init_db(db_path)
+    with get_conn(db_path) as conn:
+        pdf_id, _, revision = plan_pdf(conn, pdf_path, n_pages)
+    by_page = dict(segmented)
+    writer = BulkWriter(db_path)
+    try:
+        for start in range(0, n_pages, MAX_SYNC_PAGES):
+            todo = list(range(start, min(start + MAX_SYNC_PAGES, n_pages)))
+            commit_job(pdf_id, todo, [(p, by_page[p]) for p in todo if p in by_page], revision=revision)(writer)
+            writer.commit()
+    finally:
+        writer.close()
+        settings.dedup_threshold = threshold
+    return sum(len(problems) for _, problems in segmented)
+
+
+class Fixtures:
+    # Everything is derived from the recorded response and built lazily under workdir
+    # (the synthetic PDF is reused across runs with the same page count)
+
+    def __init__(self, n_pages: int, workdir: Path, forced_columns: int = 2):
+        self.n_pages = n_pages
+        self.workdir = workdir
+        self.forced_columns = forced_columns
+        workdir.mkdir(parents=True, exist_ok=True)
+
+    @cached_property
+    def recorded(self) -> documentai.Document:
+        return recorded_document()
+
+    @cached_property
+    def document(self) -> documentai.Document:
+        return tile_document(self.recorded, self.n_pages)
+
+    @cached_property
+    def pages(self) -> Dict[int, List[Block]]:
+        return pages_from_doc(self.document, 0)
+
+    @cached_property
+    def segmented(self) -> List[tuple[int, List[Dict[str, Any]]]]:
+        return segment_pages(self.pages, self.forced_columns, set())
+
+    @cached_property
+    def pdf(self) -> Path:
+        path = self.workdir / f"synthetic_{self.n_pages}.pdf"
+        if not path.exists():
+            synthetic_pdf(path, self.n_pages, sample_pdf(), len(self.recorded.pages))
+        return path
+
+    def fresh_db(self, name: str) -> str:
+        path = self.workdir / f"{name}.sqlite"
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+        return str(path)
+
+    @cached_property
+    def db(self) -> str:
+        # Populated database shared by the export and API benchmarks; without duplicate
+        # links every synthetic page is exported and served
+        db = self.fresh_db(f"fixture_{self.n_pages}")
+        write_db(db, self.pdf, self.n_pages, self.segmented, dedup=False)
+        return db
+
+    def problem_ids(self) -> List[int]:
+        with get_conn(self.db) as conn:
+            return [r[0] for r in conn.execute("SELECT id FROM problems ORDER BY id")]
@@ -0,0 +1,284 @@
+from __future__ import annotations
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from .fixtures import ROOT, Fixtures, write_db
+
+from treecare.chunks import MAX_SYNC_PAGES
+from treecare.config import settings
+from treecare.export import export_crops
+from treecare.parallel import SegmentPool
+from treecare.pipeline import pages_from_doc, segment_pages
+from treecare.segment import classify_columns, resolve_columns
+
+# Each benchmark gets the fixtures, the parsed arguments and a timer. Only the code inside
+# `with timer(section):` is measured; the benchmark returns {section: {"units": n, "unit": ...,
+# plus any extra metrics}}. Sections are reported as "<bench>" or "<bench>/<section>".
+
+
+class Timer:
+
+    def __init__(self):
+        self.elapsed: Dict[str, float] = {}
+
+    @contextmanager
+    def __call__(self, section: str = ""):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed[section] = time.perf_counter() - start
+
+
+def bench_extract_blocks(fx: Fixtures, args, timer: Timer):
+    doc = fx.document
+    with timer():
+        pages_from_doc(doc, 0)
+    return {"": {"units": fx.n_pages, "unit": "page"}}
+
+
+def bench_resolve_columns(fx: Fixtures, args, timer: Timer):
+    pages = list(fx.pages.values())
+    with timer():
+        for blocks in pages:
+            resolve_columns(blocks, forced_columns=fx.forced_columns)
+    return {"": {"units": fx.n_pages, "unit": "page"}}
+
+
+def bench_classify_columns(fx: Fixtures, args, timer: Timer):
+    # The automatic single/double decision made for every page without a forced layout
+    pages = list(fx.pages.values())
+    with timer():
+        for blocks in pages:
+            classify_columns(blocks)
+    return {"": {"units": fx.n_pages, "unit": "page"}}
+
+
+def bench_segment_page(fx: Fixtures, args, timer: Timer):
+    pages = fx.pages
+    with timer():
+        segmented = segment_pages(pages, fx.forced_columns, set())
+    return {"": {"units": fx.n_pages, "unit": "page", "problems": sum(len(p) for _, p in segmented)}}
+
+
+def bench_segment_pool(fx: Fixtures, args, timer: Timer):
+    # The pipeline's segmentation path: 30-page chunks fanned out to --jobs worker processes
+    pages = fx.pages
+    chunks = [{p: pages[p] for p in range(start, min(start + MAX_SYNC_PAGES, fx.n_pages))} for start in range(0, fx.n_pages, MAX_SYNC_PAGES)]
+    pool = SegmentPool(args.jobs)
+    try:
+        pool.segment(chunks[0], fx.forced_columns, set())  # start the workers
+        with timer():
+            problems = sum(len(p) for chunk in chunks for _, p in pool.segment(chunk, fx.forced_columns, set())[0])
+    finally:
+        pool.close()
+    return {"": {"units": fx.n_pages, "unit": "page", "problems": problems, "jobs": pool.jobs}}
+
+
+def bench_db_write(fx: Fixtures, args, timer: Timer):
+    # Problems, choices, figures, FTS index and duplicate linking, chunk by chunk
+    segmented, pdf = fx.segmented, fx.pdf
+    db = fx.fresh_db("db_write")
+    with timer():
+        problems = write_db(db, pdf, fx.n_pages, segmented)
+    return {"": {"units": fx.n_pages, "unit": "page", "problems": problems, "db_mb": round(os.path.getsize(db) / 1e6, 2)}}
+
+
+def bench_export_crops(fx: Fixtures, args, timer: Timer):
+    db = fx.db
+    out = fx.workdir / "crops"
+    shutil.rmtree(out, ignore_errors=True)
+    with timer():
+        export_crops(db, str(out), 2.0, jobs=args.jobs)
+    return {"": {"units": len(os.listdir(out)), "unit": "crop"}}
+
+
+@contextmanager
+def serve(app):
+    # uvicorn on a free local port in a background thread
+    import uvicorn
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("API server did not start")
+        time.sleep(0.01)
+    try:
+        yield port
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def load(port: int, paths: List[str], concurrency: int) -> List[tuple[float, int]]:
+    # (latency, status) per request; one keep-alive connection per client thread
+    local = threading.local()
+
+    def get(path: str) -> tuple[float, int]:
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        start = time.perf_counter()
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        resp.read()
+        return time.perf_counter() - start, resp.status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(get, paths))
+
+
+def latency_stats(results: List[tuple[float, int]], seconds: float) -> Dict[str, Any]:
+    lat = sorted(r[0] for r in results)
+    return {
+        "units": len(results), "unit": "request",
+        "rps": round(len(results) / seconds, 1),
+        "p50_ms": round(lat[len(lat) // 2] * 1000, 2),
+        "p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000, 2),
+        "statuses": {str(code): sum(1 for _, status in results if status == code) for code in sorted({r[1] for r in results})},
+    }
+
+
+def bench_crop_api(fx: Fixtures, args, timer: Timer):
+    # GET /problems/{id}/image under `concurrency` clients: cold renders, then cache hits
+    db, pdf, ids = fx.db, fx.pdf, fx.problem_ids()
+    settings.db_path = db
+    settings.tiles_path = str(fx.workdir / "absent.tiles")  # always render
+    settings.crop_cache_dir = ""
+    from treecare import api
+    paths = [f"/problems/{ids[i % len(ids)]}/image?format=png" for i in range(args.requests)]
+    # A new mtime changes every crop key, so the first pass renders everything again
+    os.utime(pdf)
+    # By default as many clients as the render queue admits; more measure 503 shedding
+    concurrency = args.concurrency or api.renderer.max_pending
+    out = {}
+    with serve(api.app) as port:
+        load(port, [f"/problems/{ids[0]}/image?format=png&scale=1"], 1)  # start the render workers
+        for section in ("cold", "warm"):
+            with timer(section):
+                results = load(port, paths, concurrency)
+            out[section] = {**latency_stats(results, timer.elapsed[section]), "concurrency": concurrency}
+    return out
+
+
+BENCHES: Dict[str, Callable] = {
+    "extract_blocks": bench_extract_blocks,
+    "resolve_columns": bench_resolve_columns,
+    "classify_columns": bench_classify_columns,
+    "segment_page": bench_segment_page,
+    "segment_pool": bench_segment_pool,
+    "db_write": bench_db_write,
+    "export_crops": bench_export_crops,
+    "crop_api": bench_crop_api,
+}
+
+
+def git_commit() -> str:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(names: List[str], fx: Fixtures, args) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        runs: Dict[str, List[float]] = {}
+        info: Dict[str, Dict[str, Any]] = {}
+        for _ in range(args.repeat):
+            timer = Timer()
+            info = BENCHES[name](fx, args, timer)
+            for section, seconds in timer.elapsed.items():
+                runs.setdefault(section, []).append(seconds)
+        for section, times in runs.items():
+            key = f"{name}/{section}" if section else name
+            extra = dict(info.get(section, {}))
+            units = extra.pop("units", 1) or 1
+            median = statistics.median(times)
+            results[key] = {
+                "unit": extra.pop("unit", "run"), "units": units,
+                "runs_s": [round(t, 4) for t in times], "min_s": round(min(times), 4), "median_s": round(median, 4),
+                "per_unit_ms": round(median / units * 1000, 4), **extra,
+            }
+            r = results[key]
+            print(f"{key:<24} {r['median_s']:>9.3f} s  {r['per_unit_ms']:>9.3f} ms/{r['unit']}  ({units} {r['unit']}s)", flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline_path: str, tolerance: float, pages: int) -> List[str]:
+    # Benchmarks whose median time per unit grew by more than `tolerance`
+    baseline = json.loads(Path(baseline_path).read_text())
+    if baseline["meta"].get("pages") != pages:
+        print(f"note: baseline ran with {baseline['meta'].get('pages')} pages")
+    regressions = []
+    print(f"\nvs {baseline['meta'].get('commit')} ({baseline_path}):")
+    for key, r in results.items():
+        old = baseline["results"].get(key)
+        if not old:
+            continue
+        ratio = r["per_unit_ms"] / old["per_unit_ms"] if old["per_unit_ms"] else 1.0
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"  {key:<24} {old['per_unit_ms']:>9.3f} -> {r['per_unit_ms']:>9.3f} ms/{r['unit']}  x{ratio:.2f} {flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="TreeCare end-to-end benchmarks (results as JSON)")
+    ap.add_argument("--pages", type=int, default=300, help="Synthetic pages: the recorded test_output.json pages repeated (e.g. 10000)")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the median is reported")
+    ap.add_argument("--bench", action="append", choices=list(BENCHES), help="Run only these (repeatable; default: all)")
+    ap.add_argument("--jobs", type=int, default=None, help="export_crops and segment_pool worker processes (default: CPU count)")
+    ap.add_argument("--concurrency", type=int, default=None, help="crop_api concurrent clients (default: the API's render queue limit)")
+    ap.add_argument("--requests", type=int, default=200, help="crop_api requests per pass")
+    ap.add_argument("--workdir", default=str(ROOT / "benchmarks" / ".work"), help="Fixture files (synthetic PDF, databases, crops)")
+    ap.add_argument("--out", help="Results JSON (default: benchmarks/results/<commit>.json)")
+    ap.add_argument("--compare", metavar="BASELINE", help="Earlier results JSON; exit 1 if any benchmark regressed")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown per unit before --compare fails (0.2 = 20%%)")
+    args = ap.parse_args()
+
+    fx = Fixtures(args.pages, Path(args.workdir))
+    commit = git_commit()
+    results = run(args.bench or list(BENCHES), fx, args)
+    report = {
+        "meta": {
+            "commit": commit, "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "pages": args.pages, "repeat": args.repeat, "jobs": args.jobs,
+            "concurrency": args.concurrency, "requests": args.requests,
+        },
+        "results": results,
+    }
+    out = Path(args.out or ROOT / "benchmarks" / "results" / f"{commit}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {out}")
+    if args.compare and compare(results, args.compare, args.tolerance, args.pages):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -50,56 +50,23 @@ set -euo pipefail
 
 
 
-# Batch runner for treecare.visualize_one across full PDFs.
-# - Shows progress: "page X of N completed".
-# - After each file, asks whether to continue.
+# Batch runner for `treecare visualize` across full PDFs.
+# - One Python process: each PDF is OCR'd in 30-page requests (not one request per page),
+#   every page is segmented in-process, and a progress bar reports pages done.
 # - Uses the user's Python path and outputs to data/crops_quick by default.
 
 PY="/usr/local/bin/python3.13"
 OUT_DIR="data/crops_quick"
 
 # You can edit this list to add/remove PDFs.
-# Format: <pdf_filename>:<columns s|d>:<pages>
+# Format: <pdf_filename>:<columns s|d>:<pages, e.g. 1-41>
 ITEMS=(
-  "EX_Adm_UNI_2025_2_AAH.pdf:d:41"
-  "EX_Adm_UNI_2025_2_MAT.pdf:s:43"
-  "EX_Adm_UNI_2025_2_SCI.pdf:s:34"
+  "EX_Adm_UNI_2025_2_AAH.pdf:d:1-41"
+  "EX_Adm_UNI_2025_2_MAT.pdf:s:1-43"
+  "EX_Adm_UNI_2025_2_SCI.pdf:s:1-33"
 )
 
-format_columns() {
-  if [[ "$1" == "d" ]]; then echo "double"; else echo "single"; fi
-}
-
-trap 'echo; echo "Interrupted. Exiting."; exit 130' INT
-
 echo "Output directory: $OUT_DIR"
-mkdir -p "$OUT_DIR"
-
-for item in "${ITEMS[@]}"; do
-  IFS=":" read -r PDF_FILE COL TOTAL_PAGES <<< "$item"
-  TITLE="${PDF_FILE%.pdf}"
-
-  echo "\n==== Processing $TITLE ===="
-  echo "Columns: $(format_columns "$COL")  |  Pages: $TOTAL_PAGES"
-
-  for ((p=1; p<=TOTAL_PAGES; p++)); do
-    echo "-> $TITLE: page $p of $TOTAL_PAGES..."
-    "$PY" -m treecare.visualize_one \
-      --pdf "$PDF_FILE" \
-      --page "$p" \
-      --columns "$COL" \
-      --out "$OUT_DIR"
-    echo "   $TITLE: page $p of $TOTAL_PAGES completed."
-  done
-
-  # Prompt to continue after finishing this PDF
-  echo
-  read -r -p "Finished $TITLE. Continue to next? [Y/n]: " ans
-  ans=${ans:-Y}
-  case "$ans" in
-    [Nn]*) echo "Stopping as requested."; exit 0;;
-    *)     echo "Continuing...";;
-  esac
-done
+"$PY" -m treecare.cli visualize "${ITEMS[@]}" --out "$OUT_DIR" "$@"
 
-echo "\nAll PDFs processed. ✅"
+echo "All PDFs processed. ✅"
@@ -1,19 +1,95 @@
 from __future__ import annotations
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from pathlib import Path
-import fitz  # PyMuPDF
-from typing import Tuple
+from typing import Dict, List, Tuple
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
 import base64
+import io
+import json
+import os
+import threading
+import zipfile
+from .config import settings
+from .crops import DEFAULT_ZOOM, MAX_FIT_ZOOM, MEDIA_TYPES, Crop, CropSpec, Overloaded, PageJob, RenderPool, crop_key, default_crop_cache, normalize_format
+from .db import connect, init_db
+from .search import search_problems
+from .tiles import TileReader, find_tile
+import sqlite3
+
+# Shared across requests: rendered crops, and the worker processes that render them
+# (each worker keeps its own pool of open PDFs)
+crop_cache = default_crop_cache()
+render_workers = settings.render_workers or os.cpu_count() or 1
+# Queue wait is roughly max_pending / workers renders, so the limit scales with the pool
+renderer = RenderPool(
+    render_workers,
+    settings.render_max_pending or render_workers * 4,
+    settings.render_timeout,
+    cache=crop_cache,
+)
+# Precomputed crops from `treecare export --tiles`, served without touching the PDF
+tiles = TileReader(settings.tiles_path)
+RETRY_AFTER = "1"
+MAX_BATCH_IDS = 500
+
+# Read connections, one per worker thread (handlers query through asyncio.to_thread), so
+# the pragmas in db.connect run once per thread instead of once per request
+_conns: Dict[Tuple[int, str], sqlite3.Connection] = {}
+_conns_lock = threading.Lock()
+
+
+def db() -> sqlite3.Connection:
+    key = (threading.get_ident(), settings.db_path)
+    with _conns_lock:
+        conn = _conns.get(key)
+        if conn is None:
+            conn = _conns[key] = connect(settings.db_path, check_same_thread=False)
+    return conn
+
+
+def close_db():
+    with _conns_lock:
+        for conn in _conns.values():
+            conn.close()
+        _conns.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # An older database is migrated once here rather than failing queries later
+    await asyncio.to_thread(init_db, settings.db_path)
+    yield
+    renderer.close()
+    tiles.close()
+    close_db()
+
+
+app = FastAPI(title="TreeCare Crop API", lifespan=lifespan)
 
-app = FastAPI(title="TreeCare Crop API")
 
 class CropRequest(BaseModel):
     pdf_path: str
     page_index: int
     bbox_norm: tuple[float, float, float, float]  # x0,y0,x1,y1 in [0,1]
     scale: float | None = None  # optional DPI scale
-    format: str | None = None  # 'png' or 'jpeg'
+    format: str | None = None  # 'png', 'jpeg', 'webp' or 'avif'
+    quality: int | None = None  # jpeg/webp/avif quality (1-100)
+    max_width: int | None = None  # server picks the zoom to fit these
+    max_height: int | None = None
+
+
+class ImagesBatchRequest(BaseModel):
+    ids: list[int] = []  # problem IDs
+    choice_ids: list[int] = []
+    format: str | None = None
+    quality: int | None = None
+    scale: float | None = None
+    max_width: int | None = None
+    max_height: int | None = None
 
 
 def clamp01(v: float) -> float:
@@ -30,37 +106,223 @@ def to_pixels(rect: Tuple[float, float, float, float], width: int, height: int):
     )
 
 
-@app.post("/crop")
-def crop(req: CropRequest):
-    pdf_path = Path(req.pdf_path)
-    if not pdf_path.exists():
-        raise HTTPException(404, detail="PDF not found")
-    doc = fitz.open(pdf_path)
-    if req.page_index < 0 or req.page_index >= len(doc):
-        raise HTTPException(400, detail="Invalid page index")
-    page = doc[req.page_index]
-    # Rasterize page
-    zoom = req.scale if req.scale else 2.0
-    mat = fitz.Matrix(zoom, zoom)
-    # Compute clip rect in page coordinates
-    x0n, y0n, x1n, y1n = req.bbox_norm
-    rect = fitz.Rect(
-        x0n * page.rect.width,
-        y0n * page.rect.height,
-        x1n * page.rect.width,
-        y1n * page.rect.height,
+def make_spec(bbox, scale, fmt, quality, max_width, max_height) -> CropSpec:
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(400, detail="quality must be between 1 and 100")
+    # Pixmap size grows with the square of the zoom; one request must not bypass admission
+    # control with a huge render, so explicit scales share the fit-to-size cap
+    if scale is not None and not 0 <= scale <= MAX_FIT_ZOOM:
+        raise HTTPException(400, detail=f"scale must be between 0 and {MAX_FIT_ZOOM:g}")
+    return CropSpec(
+        bbox=tuple(clamp01(v) for v in bbox),
+        scale=scale or None,
+        max_width=max_width or None,
+        max_height=max_height or None,
+        format=normalize_format(fmt),
+        quality=quality,
     )
-    # Rasterize with clip
-    cropped = page.get_pixmap(matrix=mat, clip=rect, alpha=False)
-    # Return as WebP bytes
-    fmt = (req.format or "png").lower()
-    if fmt not in ("png", "jpeg", "jpg"):
-        fmt = "png"
-    fmt = "jpeg" if fmt == "jpg" else fmt
-    data = cropped.tobytes(fmt)
-    return {
-        "width": cropped.width,
-        "height": cropped.height,
-        "format": fmt,
-        "data_base64": base64.b64encode(data).decode("ascii"),
-    }
+
+
+def cache_headers(etag: str) -> dict:
+    # Body depends on Accept (binary vs legacy base64 JSON)
+    return {"ETag": etag, "Cache-Control": f"private, max-age={settings.crop_max_age}", "Vary": "Accept"}
+
+
+def wants_json(accept: str | None) -> bool:
+    # Only an Accept of exactly application/json (parameters aside) opts into the legacy
+    # base64 body; lists like axios's "application/json, text/plain, */*" get the image
+    if not accept or "," in accept:
+        return False
+    return accept.split(";", 1)[0].strip().lower() == "application/json"
+
+
+def locate_crop(pdf_path: str, page_index: int, spec: CropSpec) -> str | None:
+    # Crop key, or None if the PDF is gone; stats the file, so keep it off the event loop
+    try:
+        return crop_key(pdf_path, page_index, spec)
+    except FileNotFoundError:
+        return None
+
+
+async def serve_crop(pdf_path: Path, page_index: int, spec: CropSpec, if_none_match: str | None, accept: str | None):
+    # Same file, page and spec always render the same bytes
+    key = await asyncio.to_thread(locate_crop, str(pdf_path), page_index, spec)
+    if key is None:
+        raise HTTPException(404, detail="PDF not found")
+    etag = f'"{key[:32]}"'
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=cache_headers(etag))
+    cropped = (await crop_cache.fetch_many([key])).get(key)
+    if cropped is None:
+        try:
+            cropped = await renderer.render(key, str(pdf_path), page_index, spec)
+        except (Overloaded, BrokenProcessPool):
+            raise HTTPException(503, detail="Renderer busy", headers={"Retry-After": RETRY_AFTER})
+        except asyncio.TimeoutError:
+            raise HTTPException(504, detail="Render timed out")
+        except FileNotFoundError:
+            raise HTTPException(404, detail="PDF not found")
+        except ValueError as e:
+            raise HTTPException(400, detail=str(e))
+    return crop_response(cropped, etag, accept)
+
+
+def crop_response(cropped: Crop, etag: str, accept: str | None):
+    headers = cache_headers(etag)
+    if wants_json(accept):
+        return JSONResponse({
+            "width": cropped.width,
+            "height": cropped.height,
+            "format": cropped.format,
+            "data_base64": base64.b64encode(cropped.data).decode("ascii"),
+        }, headers=headers)
+    headers["X-Image-Width"] = str(cropped.width)
+    headers["X-Image-Height"] = str(cropped.height)
+    return Response(cropped.data, media_type=MEDIA_TYPES[cropped.format], headers=headers)
+
+
+@app.post("/crop")
+async def crop(req: CropRequest, if_none_match: str | None = Header(None), accept: str | None = Header(None)):
+    spec = make_spec(req.bbox_norm, req.scale, req.format, req.quality, req.max_width, req.max_height)
+    return await serve_crop(Path(req.pdf_path), req.page_index, spec, if_none_match, accept)
+
+
+PROBLEM_BOXES = (
+    "SELECT p.id, f.path, p.page_index, p.x0, p.y0, p.x1, p.y1 FROM problems p "
+    "JOIN pdfs f ON f.id = p.pdf_id WHERE p.id IN ({})"
+)
+CHOICE_BOXES = (
+    "SELECT c.id, f.path, p.page_index, c.x0, c.y0, c.x1, c.y1 FROM choices c "
+    "JOIN problems p ON p.id = c.problem_id JOIN pdfs f ON f.id = p.pdf_id WHERE c.id IN ({})"
+)
+
+
+def lookup_boxes(sql: str, ids: List[int]) -> Dict[int, tuple]:
+    # id -> (pdf_path, page_index, x0, y0, x1, y1)
+    if not ids:
+        return {}
+    rows = db().execute(sql.format(",".join("?" * len(ids))), ids).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+
+def problem_box(problem_id: int):
+    return lookup_boxes(PROBLEM_BOXES, [problem_id]).get(problem_id)
+
+
+def batch_crops(ids: List[int], choice_ids: List[int], spec_args: tuple) -> List[tuple]:
+    # (kind, id, pdf_path, page_index, spec, key) per requested ID; key is None when the box
+    # or its PDF is missing
+    problems = lookup_boxes(PROBLEM_BOXES, ids)
+    choices = lookup_boxes(CHOICE_BOXES, choice_ids)
+    wanted = [("problem", i, problems.get(i)) for i in ids] + [("choice", i, choices.get(i)) for i in choice_ids]
+    out = []
+    for kind, item_id, box in wanted:
+        if box is None:
+            out.append((kind, item_id, None, None, None, None))
+            continue
+        pdf_path, page_index, *bbox = box
+        spec = make_spec(bbox, *spec_args)
+        out.append((kind, item_id, pdf_path, page_index, spec, locate_crop(pdf_path, page_index, spec)))
+    return out
+
+
+def problem_tile(problem_id: int, zoom: float, fmt: str):
+    # A linked duplicate is served from its canonical problem's tile
+    conn = db()
+    row = conn.execute("SELECT COALESCE(canonical_id, id) FROM problems WHERE id=?", (problem_id,)).fetchone()
+    return find_tile(conn, row[0], zoom, fmt) if row else None
+
+
+@app.get("/problems/{problem_id}/image")
+@app.get("/crop/{problem_id}")
+async def crop_problem(
+    problem_id: int,
+    format: str | None = None,
+    quality: int | None = None,
+    scale: float | None = None,
+    max_width: int | None = Query(None, gt=0),
+    max_height: int | None = Query(None, gt=0),
+    if_none_match: str | None = Header(None),
+    accept: str | None = Header(None),
+):
+    spec = make_spec((0, 0, 1, 1), scale, format, quality, max_width, max_height)
+    if quality is None and spec.max_width is None and spec.max_height is None:
+        # Plain zoom/format requests can come straight from the tile file
+        tile = await asyncio.to_thread(problem_tile, problem_id, scale or DEFAULT_ZOOM, spec.format)
+        if tile is not None:
+            offset, length, width, height = tile
+            # Tiles are append-only, so the offset identifies the bytes
+            etag = f'"tile-{problem_id}-{offset}-{length}"'
+            if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+                return Response(status_code=304, headers=cache_headers(etag))
+            # mmap reads (and the remap when the tile file grew) can fault in pages from disk
+            data = await asyncio.to_thread(tiles.read, offset, length)
+            if data is not None:
+                return crop_response(Crop(data, width, height, spec.format), etag, accept)
+    row = await asyncio.to_thread(problem_box, problem_id)
+    if row is None:
+        raise HTTPException(404, detail="Problem not found")
+    pdf_path, page_index, *bbox = row
+    spec = make_spec(bbox, scale, format, quality, max_width, max_height)
+    return await serve_crop(Path(pdf_path), page_index, spec, if_none_match, accept)
+
+
+@app.post("/problems/images:batch")
+async def problem_images(req: ImagesBatchRequest):
+    # One round trip for a whole problem set: boxes are grouped by PDF page so each page is
+    # loaded once, and the crops come back as a zip with a manifest.json
+    ids = list(dict.fromkeys(req.ids))
+    choice_ids = list(dict.fromkeys(req.choice_ids))
+    if len(ids) + len(choice_ids) > MAX_BATCH_IDS:
+        raise HTTPException(400, detail=f"At most {MAX_BATCH_IDS} IDs per batch")
+    spec_args = (req.scale, req.format, req.quality, req.max_width, req.max_height)
+    make_spec((0, 0, 1, 1), *spec_args)  # validate options before touching the DB
+    wanted = await asyncio.to_thread(batch_crops, ids, choice_ids, spec_args)
+
+    entries = [(kind, item_id, key) for kind, item_id, _, _, _, key in wanted]  # key is None if missing
+    found: Dict[str, Crop] = await crop_cache.fetch_many([key for _, _, key in entries if key is not None])
+    pages: Dict[tuple, PageJob] = {}
+    for _, _, pdf_path, page_index, spec, key in wanted:
+        if key is not None and key not in found:
+            pages.setdefault((pdf_path, page_index), (pdf_path, page_index, []))[2].append((key, spec))
+    try:
+        found.update(await renderer.render_pages(list(pages.values()), timeout=settings.render_timeout * 4))
+    except (Overloaded, BrokenProcessPool):
+        raise HTTPException(503, detail="Renderer busy", headers={"Retry-After": RETRY_AFTER})
+    except asyncio.TimeoutError:
+        raise HTTPException(504, detail="Render timed out")
+
+    buf = io.BytesIO()
+    manifest = {"items": [], "missing": []}
+    # Images are already compressed; storing them skips a pointless deflate pass
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for kind, item_id, key in entries:
+            cropped = found.get(key) if key else None
+            if cropped is None:
+                manifest["missing"].append({"kind": kind, "id": item_id})
+                continue
+            name = f"{kind}_{item_id}.{cropped.format}"
+            zf.writestr(name, cropped.data)
+            manifest["items"].append({"kind": kind, "id": item_id, "file": name,
+                                      "width": cropped.width, "height": cropped.height})
+        zf.writestr("manifest.json", json.dumps(manifest))
+    return Response(buf.getvalue(), media_type="application/zip",
+                    headers={"Content-Disposition": 'attachment; filename="problems.zip"'})
+
+
+def run_search(q: str, limit: int):
+    return search_problems(db(), q, limit=limit, mark=("<mark>", "</mark>"))
+
+
+@app.get("/search")
+async def search(q: str, limit: int = Query(20, ge=1, le=200)):
+    try:
+        hits = await asyncio.to_thread(run_search, q, limit)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(400, detail=f"Bad search query: {e}")
+    return {"query": q, "results": hits}
+
+
+@app.get("/health")
+async def health():
+    return {"render_queue": renderer.depth(), "render_max_pending": renderer.max_pending}
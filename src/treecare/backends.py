@@ -0,0 +1,120 @@
+from __future__ import annotations
+import hashlib
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+import fitz  # PyMuPDF
+from google.api_core import exceptions as gexc
+from google.cloud import documentai_v1 as documentai
+
+from .config import settings
+from .docai import DocAIBackend
+from .textlayer import TextLayerBackend
+
+BACKENDS = ("docai", "replay", "textlayer")
+
+
+def tile_document(doc: documentai.Document, n_pages: int) -> documentai.Document:
+    # doc's pages repeated to n_pages; repeated pages keep anchoring into the same
+    # text, so the copy stays valid
+    rec = doc._pb
+    out = type(rec)()
+    out.text = rec.text
+    for i in range(n_pages if rec.pages else 0):
+        page = out.pages.add()
+        page.CopyFrom(rec.pages[i % len(rec.pages)])
+        page.page_number = i + 1
+    return documentai.Document.wrap(out)
+
+
+class ReplayBackend:
+    # Serves recorded Document JSON (e.g. test_output.json) instead of calling GCP, with
+    # injectable latency and errors for load-testing concurrency, retries and caching.
+    # `recordings` is a JSON file or a directory of them; a file named <sha256 of the chunk
+    # bytes>.json answers that exact chunk, any other chunk gets a recording picked by its
+    # hash with pages repeated to match the chunk's page count.
+    # Injected faults are drawn from (seed, chunk hash, attempt number), so a run
+    # replays identically whatever the thread interleaving.
+    name = "replay"
+    cacheable = True
+    version = ""
+
+    def __init__(self, recordings: str, latency: float = 0.0, page_latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, fail_rate: float = 0.0, seed: int = 0, qpm: int = 0):
+        root = Path(recordings)
+        paths = sorted(root.glob("*.json")) if root.is_dir() else [root]
+        if not paths:
+            raise FileNotFoundError(f"No recorded documents in {recordings}")
+        self.latency = latency
+        self.page_latency = page_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_rate = fail_rate
+        self.seed = seed
+        self.qpm = qpm
+        h = hashlib.sha256()
+        self._exact: Dict[str, documentai.Document] = {}
+        self._recordings: List[documentai.Document] = []
+        for path in paths:
+            raw = path.read_bytes()
+            h.update(raw)
+            doc = documentai.Document.from_json(raw.decode("utf-8"), ignore_unknown_fields=True)
+            if len(path.stem) == 64:
+                self._exact[path.stem] = doc
+            else:
+                self._recordings.append(doc)
+        if not self._recordings:
+            self._recordings = list(self._exact.values())
+        # Responses from different recordings never share cache entries
+        self.cache_id = f"replay-{h.hexdigest()[:16]}"
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        self.calls = 0
+        self.errors = 0
+
+    def process(self, content: bytes) -> documentai.Document:
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            attempt = self._attempts[digest] = self._attempts.get(digest, 0) + 1
+            self.calls += 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        with fitz.open(stream=content, filetype="pdf") as src:
+            n_pages = len(src)
+        delay = (self.latency + self.page_latency * n_pages) * (1 + rng.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            time.sleep(delay)
+        roll = rng.random()
+        if roll < self.fail_rate + self.error_rate:
+            with self._lock:
+                self.errors += 1
+            if roll < self.fail_rate:
+                raise gexc.InvalidArgument("replay: injected permanent failure")
+            raise rng.choice((gexc.ServiceUnavailable, gexc.TooManyRequests))("replay: injected transient error")
+        return self._document(digest, n_pages)
+
+    def _document(self, digest: str, n_pages: int) -> documentai.Document:
+        exact = self._exact.get(digest)
+        if exact is not None:
+            return documentai.Document.wrap(type(exact._pb).FromString(exact._pb.SerializeToString()))
+        return tile_document(self._recordings[int(digest[:8], 16) % len(self._recordings)], n_pages)
+
+    def check(self) -> str:
+        return f"Replay backend: {len(self._recordings) + len(self._exact)} recorded documents ({self.cache_id})"
+
+
+def make_backend(name: str | None = None):
+    # The OCR backend named by --backend / TREECARE_OCR_BACKEND
+    name = name or settings.ocr_backend
+    if name == "docai":
+        return DocAIBackend(settings.project_id, settings.location, settings.processor_id, settings.processor_version)
+    if name == "replay":
+        return ReplayBackend(
+            settings.replay_path, latency=settings.replay_latency, page_latency=settings.replay_page_latency,
+            jitter=settings.replay_jitter, error_rate=settings.replay_error_rate, fail_rate=settings.replay_fail_rate,
+            seed=settings.replay_seed, qpm=settings.replay_qpm,
+        )
+    if name == "textlayer":
+        return TextLayerBackend()
+    raise ValueError(f"Unknown OCR backend {name!r}; expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,198 @@
+from __future__ import annotations
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import fitz  # PyMuPDF
+from google.cloud import documentai_v1 as documentai
+
+from .docai import get_client, call_with_retry
+from .chunks import iter_chunks
+from .config import settings
+
+
+def split_uri(uri: str) -> Tuple[str, str]:
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Expected a gs:// URI, got {uri}")
+    bucket, _, name = uri[len("gs://"):].partition("/")
+    return bucket, name
+
+
+class GcsStore:
+    # Thin wrapper over google-cloud-storage (optional dependency)
+
+    def __init__(self):
+        try:
+            from google.cloud import storage
+        except ImportError as e:
+            raise RuntimeError("Batch mode against GCS needs google-cloud-storage: pip install google-cloud-storage") from e
+        self.client = storage.Client()
+
+    def upload(self, uri: str, data: bytes, content_type: str = "application/pdf"):
+        bucket, name = split_uri(uri)
+        self.client.bucket(bucket).blob(name).upload_from_string(data, content_type=content_type)
+
+    def list(self, prefix_uri: str) -> List[str]:
+        bucket, prefix = split_uri(prefix_uri)
+        return sorted(f"gs://{bucket}/{b.name}" for b in self.client.list_blobs(bucket, prefix=prefix))
+
+    def download(self, uri: str) -> bytes:
+        bucket, name = split_uri(uri)
+        return self.client.bucket(bucket).blob(name).download_as_bytes()
+
+
+class LocalStore:
+    # Offline stand-in for GCS: gs://bucket/name lives at <root>/bucket/name
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path(self, uri: str) -> Path:
+        bucket, name = split_uri(uri)
+        return self.root / bucket / name
+
+    def upload(self, uri: str, data: bytes, content_type: str = "application/pdf"):
+        p = self.path(uri)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(data)
+
+    def list(self, prefix_uri: str) -> List[str]:
+        bucket, prefix = split_uri(prefix_uri)
+        base = self.root / bucket
+        if not base.exists():
+            return []
+        uris = []
+        for p in base.rglob("*"):
+            name = p.relative_to(base).as_posix()
+            if p.is_file() and name.startswith(prefix):
+                uris.append(f"gs://{bucket}/{name}")
+        return sorted(uris)
+
+    def download(self, uri: str) -> bytes:
+        return self.path(uri).read_bytes()
+
+
+class DocAIBatchRunner:
+    # Submits batch_process_documents and returns the long-running operation
+
+    def submit(self, input_uris: List[str], output_uri: str):
+        client = get_client()
+        if settings.processor_version:
+            name = client.processor_version_path(settings.project_id, settings.location, settings.processor_id, settings.processor_version)
+        else:
+            name = client.processor_path(settings.project_id, settings.location, settings.processor_id)
+        request = documentai.BatchProcessRequest(
+            name=name,
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(
+                    documents=[documentai.GcsDocument(gcs_uri=u, mime_type="application/pdf") for u in input_uris]
+                )
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=output_uri)
+            ),
+        )
+        return call_with_retry(lambda: client.batch_process_documents(request=request), attempts=settings.docai_max_attempts)
+
+
+class LocalOperation:
+    # Mimics the parts of api_core's Operation used by wait_for_operation
+
+    def __init__(self, metadata: documentai.BatchProcessMetadata):
+        self.metadata = metadata
+
+    def done(self) -> bool:
+        return True
+
+    def exception(self):
+        return None
+
+
+class LocalBatchRunner:
+    # Emulates the batch LRO against a LocalStore by running the sync processor
+    # on shard-sized page ranges and writing shard JSON the way Document AI does.
+
+    def __init__(self, store: LocalStore, process: Callable[[bytes], documentai.Document], pages_per_shard: int = 30):
+        self.store = store
+        self.process = process
+        self.pages_per_shard = pages_per_shard
+        self._ops = 0
+
+    def submit(self, input_uris: List[str], output_uri: str) -> LocalOperation:
+        self._ops += 1
+        op_id = f"local-{int(time.time())}-{self._ops}"
+        statuses = []
+        for doc_idx, uri in enumerate(input_uris):
+            dest = f"{output_uri.rstrip('/')}/{op_id}/{doc_idx}"
+            src_path = self.store.path(uri)
+            with fitz.open(str(src_path)) as src:
+                shard_count = max(1, -(-len(src) // self.pages_per_shard))
+                text_offset = 0
+                for shard_idx, (content, start, _) in enumerate(iter_chunks(src, self.pages_per_shard)):
+                    doc = self.process(content)
+                    # Shards carry global 1-based page numbers and their place in the whole text
+                    for i, page in enumerate(doc.pages):
+                        page.page_number = start + i + 1
+                    doc.shard_info = documentai.Document.ShardInfo(
+                        shard_index=shard_idx, shard_count=shard_count, text_offset=text_offset
+                    )
+                    text_offset += len(doc.text)
+                    name = f"{Path(src_path).stem}-{shard_idx}.json"
+                    self.store.upload(f"{dest}/{name}", documentai.Document.to_json(doc).encode("utf-8"), "application/json")
+            statuses.append(documentai.BatchProcessMetadata.IndividualProcessStatus(
+                input_gcs_source=uri, output_gcs_destination=dest
+            ))
+        return LocalOperation(documentai.BatchProcessMetadata(
+            state=documentai.BatchProcessMetadata.State.SUCCEEDED,
+            individual_process_statuses=statuses,
+        ))
+
+
+def wait_for_operation(operation, poll_interval: float = 10.0, timeout: float = 3600.0):
+    deadline = time.monotonic() + timeout
+    while not operation.done():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Document AI batch operation did not finish in time")
+        time.sleep(poll_interval)
+    err = operation.exception()
+    if err is not None:
+        raise err
+    return operation.metadata
+
+
+def load_shards(store, dest_uri: str) -> List[Tuple[documentai.Document, int]]:
+    # Returns (shard, page offset) pairs ordered by shard index
+    shards = []
+    for uri in store.list(dest_uri.rstrip("/") + "/"):
+        if not uri.endswith(".json"):
+            continue
+        shards.append(documentai.Document.from_json(store.download(uri).decode("utf-8"), ignore_unknown_fields=True))
+    shards.sort(key=lambda d: int(d.shard_info.shard_index))
+    out = []
+    seen = 0
+    for shard in shards:
+        # page_number is 1-based across the whole input; fall back to running count
+        offset = int(shard.pages[0].page_number) - 1 if shard.pages and shard.pages[0].page_number else seen
+        out.append((shard, offset))
+        seen = offset + len(shard.pages)
+    return out
+
+
+def run_batch(store, runner, pdf_paths: List[Path], input_prefix: str, output_prefix: str,
+              poll_interval: float = 10.0, timeout: float = 3600.0) -> Dict[Path, List[Tuple[documentai.Document, int]]]:
+    uris = {}
+    for i, pdf_path in enumerate(pdf_paths):
+        uri = f"{input_prefix.rstrip('/')}/{i:05d}_{pdf_path.name}"
+        store.upload(uri, pdf_path.read_bytes())
+        uris[uri] = pdf_path
+    operation = runner.submit(list(uris), output_prefix)
+    metadata = wait_for_operation(operation, poll_interval=poll_interval, timeout=timeout)
+    results: Dict[Path, List[Tuple[documentai.Document, int]]] = {}
+    for status in metadata.individual_process_statuses:
+        pdf_path = uris.get(status.input_gcs_source)
+        if pdf_path is None:
+            continue
+        if status.status and status.status.code:
+            print(f"Batch failed for {pdf_path}: {status.status.message}")
+            continue
+        results[pdf_path] = load_shards(store, status.output_gcs_destination)
+    return results
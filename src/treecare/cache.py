@@ -0,0 +1,109 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from google.cloud import documentai_v1 as documentai
+
+from .config import settings
+
+
+def cache_key(content: bytes, processor_id: str, processor_version: str = "") -> str:
+    # Same bytes sent to the same processor (and version) always yield the same response
+    h = hashlib.sha256()
+    h.update(content)
+    h.update(b"\0" + processor_id.encode("utf-8"))
+    h.update(b"\0" + processor_version.encode("utf-8"))
+    return h.hexdigest()
+
+
+class DiskLRU:
+    # Byte store sharded as <root>/<key[:2]>/<key><suffix>, bounded by max_bytes.
+    # The directory is scanned once (in mtime order) into an in-memory LRU index of sizes;
+    # after that eviction pops from the index instead of rescanning. Files are still touched
+    # on every hit so the next process starts from the same LRU order. Entries written by
+    # other processes sharing the directory are only counted after a restart.
+
+    def __init__(self, root: str, max_bytes: int, suffix: str = ".bin"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._index: "Optional[OrderedDict[str, int]]" = None  # key -> size, least recent first
+        self._total = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}{self.suffix}"
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index.move_to_end(key)
+        return data
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so readers never see a partial entry
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        with self._lock:
+            index = self._load_index()
+            os.replace(tmp, path)
+            self._total += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+            self._evict()
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            entries = []
+            for path in self.root.glob(f"*/*{self.suffix}"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, path.name[:-len(self.suffix)], st.st_size))
+            entries.sort()
+            self._index = OrderedDict((key, size) for _, key, size in entries)
+            self._total = sum(self._index.values())
+        return self._index
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+
+class DocumentCache(DiskLRU):
+    # Content-addressed store of serialized documentai.Document responses
+
+    def __init__(self, root: str, max_bytes: int):
+        super().__init__(root, max_bytes, suffix=".pb")
+
+    def get(self, key: str) -> Optional[documentai.Document]:
+        data = self.get_bytes(key)
+        return None if data is None else documentai.Document.deserialize(data)
+
+    def put(self, key: str, doc: documentai.Document) -> None:
+        self.put_bytes(key, documentai.Document.serialize(doc))
+
+
+def default_cache(enabled: bool = True) -> Optional[DocumentCache]:
+    if not enabled or not settings.cache_dir:
+        return None
+    return DocumentCache(settings.cache_dir, settings.cache_max_mb * 1024 * 1024)
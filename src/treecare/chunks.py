@@ -0,0 +1,23 @@
+from __future__ import annotations
+from typing import Iterator, Tuple
+import fitz  # PyMuPDF
+
+# Document AI sync requests accept at most 30 pages
+MAX_SYNC_PAGES = 30
+
+
+def range_bytes(src: fitz.Document, start: int, end: int, garbage: int = 0) -> bytes:
+    # Serialize pages [start, end) of an open document as a standalone PDF, in memory.
+    # garbage>0 drops objects the selected pages don't reference (smaller payloads).
+    # no_new_id keeps the bytes identical across runs so the response cache keeps hitting.
+    with fitz.open() as part:
+        part.insert_pdf(src, from_page=start, to_page=end - 1)
+        return part.tobytes(garbage=garbage, deflate=garbage > 0, no_new_id=True)
+
+
+def iter_chunks(src: fitz.Document, max_pages: int = MAX_SYNC_PAGES, garbage: int = 0) -> Iterator[Tuple[bytes, int, int]]:
+    # Yields (pdf_bytes, start_page_index, page_count)
+    total = len(src)
+    for start in range(0, total, max_pages):
+        end = min(start + max_pages, total)
+        yield range_bytes(src, start, end, garbage=garbage), start, end - start
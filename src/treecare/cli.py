@@ -2,9 +2,18 @@ from __future__ import annotations
 import argparse
 from .pipeline import run_pipeline
 from .config import settings
-from .export import export_crops
-from google.cloud import documentai_v1 as documentai
+from .export import export_crops, export_tiles
+from .cache import default_cache
+from .db import init_db, get_conn
+from .search import search_problems
+from .dedup import duplicate_clusters, rebuild as rebuild_dedup
+from .backends import make_backend, BACKENDS
+from .docai import DocAIBackend
+from .visualize import visualize, load_items, parse_item
+from .manifest import load_manifest
+from pathlib import Path
 import os
+import sys
 
 
 def main():
@@ -14,29 +23,71 @@ def main():
     p = sub.add_parser("process", help="Process PDFs and persist to SQLite")
     p.add_argument("--input", default="pdfs/raw", help="Input directory of PDFs")
     p.add_argument("--db", default=settings.db_path, help="SQLite DB path")
-    p.add_argument("--columns", choices=["s","d"], help="Force single (s) or double (d) column layout for this batch")
-    p.add_argument("--exceptions", help="Comma-separated page numbers that use the opposite layout (1-based)")
+    p.add_argument("--columns", choices=["s","d","auto"], help="Force single (s) or double (d) column layout for this batch, or detect it per page (auto)")
+    p.add_argument("--exceptions", help="Comma-separated page numbers that use the opposite layout (1-based; forced layouts only)")
+    p.add_argument("--manifest", help="YAML/JSON file with per-PDF layouts (s, d or auto); replaces --columns/--exceptions and never prompts")
+    p.add_argument("--no-cache", action="store_true", help="Do not read or write the Document AI response cache")
+    p.add_argument("--refresh", action="store_true", help="Ignore cached responses and re-OCR (results are re-cached)")
+    p.add_argument("--mode", choices=["sync","batch"], default="sync", help="sync: <=30-page process_document chunks; batch: batch_process_documents LRO")
+    p.add_argument("--local-gcs", help="Directory standing in for GCS in batch mode (offline testing)")
+    p.add_argument("--concurrency", type=int, default=4, help="Document AI chunk requests kept in flight across all PDFs")
+    p.add_argument("--jobs", type=int, default=None, help="Segmentation worker processes (default: CPU count; 1 segments in-process)")
+    p.add_argument("--backend", choices=BACKENDS, default=settings.ocr_backend, help="OCR backend: docai (live), replay (recorded responses, see TREECARE_REPLAY_*) or textlayer (local PDF text)")
+    p.add_argument("--text-layer", choices=["auto","off"], default=settings.text_layer, help="auto: read born-digital pages from the PDF text layer and OCR only the rest; off: OCR every page")
 
     e = sub.add_parser("export", help="Export problem crops as WebP for QA")
     e.add_argument("--db", default=settings.db_path, help="SQLite DB path")
     e.add_argument("--out", default="data/crops", help="Output directory")
     e.add_argument("--zoom", type=float, default=2.0, help="Rasterization zoom")
+    e.add_argument("--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    e.add_argument("--page-reuse", type=int, default=0, metavar="N", help="Rasterize the full page once when it has at least N crops (0: off)")
+    e.add_argument("--tiles", nargs="?", const=settings.tiles_path, help=f"Append crops to a packed tile file served by the API instead of writing PNGs (default: {settings.tiles_path})")
+    e.add_argument("--format", default="png", help="Tile image format: png, jpeg, webp or avif")
+
+    v = sub.add_parser("visualize", help="Segment selected pages of several PDFs and write problem crops, in one process")
+    v.add_argument("items", nargs="*", help="<pdf>:<s|d|a>[:<pages>[:<exceptions>]], e.g. EX_Adm_UNI_2025_2_AAH.pdf:d:1-41 (a: detect per page)")
+    v.add_argument("--manifest", help="File of items, one per line (same format), or a JSON/YAML list of {pdf, columns, pages, exceptions}")
+    v.add_argument("--out", default="data/crops_quick", help="Output directory for PNG crops")
+    v.add_argument("--zoom", type=float, default=2.0, help="Rasterization zoom")
+    v.add_argument("--no-cache", action="store_true", help="Do not read or write the Document AI response cache")
+    v.add_argument("--refresh", action="store_true", help="Ignore cached responses and re-OCR")
+    v.add_argument("--concurrency", type=int, default=4, help="OCR requests kept in flight")
+    v.add_argument("--backend", choices=BACKENDS, default=settings.ocr_backend, help="OCR backend")
+    v.add_argument("--text-layer", choices=["auto","off"], default=settings.text_layer, help="auto: skip OCR for born-digital pages")
+
+    q = sub.add_parser("search", help="Full-text search over stored problems")
+    q.add_argument("query", help="Words to find (accents optional); the last word matches as a prefix")
+    q.add_argument("--db", default=settings.db_path, help="SQLite DB path")
+    q.add_argument("--limit", type=int, default=20)
+    q.add_argument("--raw", action="store_true", help="Pass the query to FTS5 as-is (OR, NEAR, header:term, ...)")
+
+    d = sub.add_parser("dedup", help="Report near-duplicate problem clusters")
+    d.add_argument("--db", default=settings.db_path, help="SQLite DB path")
+    d.add_argument("--rebuild", action="store_true", help="Re-fingerprint every problem and relink duplicates first")
+    d.add_argument("--threshold", type=float, default=settings.dedup_threshold or 0.8, help="MinHash similarity needed to link (with --rebuild)")
+    d.add_argument("--min-size", type=int, default=2, help="Smallest cluster to list")
+    d.add_argument("--limit", type=int, default=50, help="Clusters to list")
 
     c = sub.add_parser("check", help="Validate GCP credentials and Document AI processor access")
     c.add_argument("--project", default=settings.project_id)
     c.add_argument("--location", default=settings.location)
     c.add_argument("--processor", default=settings.processor_id)
+    c.add_argument("--backend", choices=BACKENDS, default=settings.ocr_backend, help="Backend to check (offline backends need no credentials)")
 
     args = parser.parse_args()
     if args.cmd == "process":
-        # Interactive prompts if not provided
-        cols = args.columns
-        if not cols:
-            cols = input("Column layout? Single (s) or Double (d): ").strip().lower()
-            while cols not in ("s","d"):
-                cols = input("Please enter 's' for Single or 'd' for Double: ").strip().lower()
+        # Interactive prompts only when run from a terminal without --manifest (the layout
+        # prompt also needs no --columns); headless runs (cron, CI, pipes) detect per page
+        manifest = load_manifest(args.manifest) if args.manifest else None
+        interactive = manifest is None and sys.stdin.isatty()
+        cols = args.columns or "auto"
+        if interactive and not args.columns:
+            cols = input("Column layout? Single (s), Double (d) or detect per page (a): ").strip().lower()
+            while cols not in ("s","d","a"):
+                cols = input("Please enter 's' for Single, 'd' for Double or 'a' for auto: ").strip().lower()
+        cols = {"s": 1, "d": 2}.get(cols)
         ex = args.exceptions
-        if ex is None:
+        if ex is None and interactive and cols:
             yn = input("Are there any exceptions (pages using the opposite layout)? (y/n): ").strip().lower()
             if yn == 'y':
                 while True:
@@ -50,20 +101,60 @@ def main():
                         print("Invalid input. Please enter only numbers separated by commas.")
             else:
                 ex = ""
-        run_pipeline(args.input, args.db, forced_columns=1 if cols=='s' else 2, exception_pages=ex)
+        run_pipeline(
+            args.input, args.db, forced_columns=cols, exception_pages=ex, manifest=manifest,
+            cache=default_cache(not args.no_cache), refresh=args.refresh, concurrency=args.concurrency,
+            mode=args.mode, batch_local_dir=args.local_gcs, text_layer=args.text_layer,
+            backend=make_backend(args.backend), jobs=args.jobs,
+        )
     elif args.cmd == "export":
-        export_crops(args.db, args.out, args.zoom)
+        if args.tiles:
+            n = export_tiles(args.db, args.tiles, args.zoom, args.format, jobs=args.jobs, full_page_min=args.page_reuse)
+            print(f"Added {n} tiles to {args.tiles}")
+        else:
+            export_crops(args.db, args.out, args.zoom, jobs=args.jobs, full_page_min=args.page_reuse)
+    elif args.cmd == "visualize":
+        items = (load_items(args.manifest) if args.manifest else []) + [parse_item(s) for s in args.items]
+        if not items:
+            parser.error("visualize needs items or --manifest")
+        visualize(
+            items, args.out, cache=default_cache(not args.no_cache), refresh=args.refresh, concurrency=args.concurrency,
+            backend=make_backend(args.backend), text_layer=args.text_layer, zoom=args.zoom,
+        )
+    elif args.cmd == "search":
+        init_db(args.db)
+        with get_conn(args.db) as conn:
+            hits = search_problems(conn, args.query, limit=args.limit, raw=args.raw)
+        for h in hits:
+            print(f"{h['id']:>7}  {h['score']:7.2f}  {Path(h['pdf_path']).stem} p{h['page_index'] + 1}  {' '.join(h['snippet'].split())}")
+        if not hits:
+            print("No matches")
+    elif args.cmd == "dedup":
+        init_db(args.db)
+        with get_conn(args.db) as conn:
+            if args.rebuild:
+                print(f"Linked {rebuild_dedup(conn, args.threshold)} duplicates")
+            clusters = duplicate_clusters(conn, args.min_size)
+        dups = sum(len(members) - 1 for _, members in clusters)
+        print(f"{len(clusters)} clusters, {dups} duplicate problems")
+        for root, members in clusters[:args.limit]:
+            print(f"\ncanonical {root} ({len(members)} occurrences)")
+            for pid, path, page, header in members:
+                print(f"  {pid:>7}  {Path(path).stem} p{page + 1}  {header or ''}")
     elif args.cmd == "check":
+        if args.backend != "docai":
+            try:
+                print(make_backend(args.backend).check())
+            except (OSError, ValueError) as e:
+                print(f"Backend {args.backend} unavailable: {e}")
+            return
         sa = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
         if not sa or not os.path.exists(sa):
             print("GOOGLE_APPLICATION_CREDENTIALS not set or file not found. Set it to your Service Account JSON path.")
             return
         print(f"Using Service Account JSON: {sa}")
-        client = documentai.DocumentProcessorServiceClient()
-        name = client.processor_path(args.project, args.location, args.processor)
         try:
-            proc = client.get_processor(name=name)
-            print(f"Processor OK: {proc.display_name} (state={proc.state.name})")
+            print(DocAIBackend(args.project, args.location, args.processor).check())
         except Exception as e:
             msg = str(e)
             if "NotFound" in msg or "404" in msg:
@@ -9,6 +9,37 @@ class Settings:
     project_id: str = os.getenv("GCP_PROJECT_ID", "")
     location: str = os.getenv("GCP_LOCATION", "us")
     processor_id: str = os.getenv("DOCAI_PROCESSOR_ID", "")
+    processor_version: str = os.getenv("DOCAI_PROCESSOR_VERSION", "")
+    docai_qpm: int = int(os.getenv("DOCAI_QPM", "120"))
+    docai_max_attempts: int = int(os.getenv("DOCAI_MAX_ATTEMPTS", "6"))
+    ocr_backend: str = os.getenv("TREECARE_OCR_BACKEND", "docai")  # docai, replay or textlayer
+    replay_path: str = os.getenv("TREECARE_REPLAY_PATH", "test_output.json")  # recorded Document JSON file or directory
+    replay_latency: float = float(os.getenv("TREECARE_REPLAY_LATENCY", "0"))  # seconds per request
+    replay_page_latency: float = float(os.getenv("TREECARE_REPLAY_PAGE_LATENCY", "0"))  # seconds per page
+    replay_jitter: float = float(os.getenv("TREECARE_REPLAY_JITTER", "0"))  # +/- fraction of the latency
+    replay_error_rate: float = float(os.getenv("TREECARE_REPLAY_ERROR_RATE", "0"))  # transient 429/503
+    replay_fail_rate: float = float(os.getenv("TREECARE_REPLAY_FAIL_RATE", "0"))  # permanent 400
+    replay_seed: int = int(os.getenv("TREECARE_REPLAY_SEED", "0"))
+    replay_qpm: int = int(os.getenv("TREECARE_REPLAY_QPM", "0"))  # 0: no rate limit
+    batch_input_uri: str = os.getenv("DOCAI_BATCH_INPUT_URI", "gs://treecare/input")
+    batch_output_uri: str = os.getenv("DOCAI_BATCH_OUTPUT_URI", "gs://treecare/output")
+    batch_poll_seconds: float = float(os.getenv("DOCAI_BATCH_POLL_SECONDS", "10"))
+    chunk_garbage: int = int(os.getenv("TREECARE_CHUNK_GARBAGE", "0"))
+    queue_size: int = int(os.getenv("TREECARE_QUEUE_SIZE", "4"))  # items waiting between pipeline stages
     db_path: str = os.getenv("TREECARE_DB", "data/treecare.sqlite")
+    cache_dir: str = os.getenv("TREECARE_CACHE_DIR", "data/docai_cache")
+    cache_max_mb: int = int(os.getenv("TREECARE_CACHE_MAX_MB", "2048"))
+    open_docs: int = int(os.getenv("TREECARE_OPEN_DOCS", "16"))
+    crop_cache_mb: int = int(os.getenv("TREECARE_CROP_CACHE_MB", "256"))
+    crop_cache_dir: str = os.getenv("TREECARE_CROP_CACHE_DIR", "")
+    crop_disk_max_mb: int = int(os.getenv("TREECARE_CROP_DISK_MAX_MB", "1024"))
+    crop_max_age: int = int(os.getenv("TREECARE_CROP_MAX_AGE", "3600"))
+    text_layer: str = os.getenv("TREECARE_TEXT_LAYER", "auto")  # auto: skip OCR for born-digital pages; off
+    textlayer_min_chars: int = int(os.getenv("TREECARE_TEXTLAYER_MIN_CHARS", "100"))
+    dedup_threshold: float = float(os.getenv("TREECARE_DEDUP_THRESHOLD", "0.8"))  # 0 disables
+    tiles_path: str = os.getenv("TREECARE_TILES_PATH", "data/crops.tiles")
+    render_workers: int = int(os.getenv("TREECARE_RENDER_WORKERS", "0"))  # 0: CPU count
+    render_max_pending: int = int(os.getenv("TREECARE_RENDER_MAX_PENDING", "0"))  # 0: 4 per worker
+    render_timeout: float = float(os.getenv("TREECARE_RENDER_TIMEOUT", "15"))
 
 settings = Settings()
@@ -0,0 +1,341 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import io
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import fitz  # PyMuPDF
+from PIL import Image, features
+
+from .cache import DiskLRU
+from .config import settings
+
+
+class DocPool:
+    # Bounded LRU of open fitz documents keyed by path. A handle is reopened when the
+    # file's mtime/size change and closed when it falls out of the pool.
+    # PyMuPDF is not thread-safe, so callers hold `lock` while using a document.
+
+    def __init__(self, max_open: int):
+        self.max_open = max(1, max_open)
+        self.lock = threading.RLock()
+        self._docs: "OrderedDict[str, Tuple[fitz.Document, int, int]]" = OrderedDict()
+
+    def get(self, path: str) -> fitz.Document:
+        st = os.stat(path)
+        with self.lock:
+            entry = self._docs.get(path)
+            if entry is not None:
+                doc, mtime_ns, size = entry
+                if (mtime_ns, size) == (st.st_mtime_ns, st.st_size):
+                    self._docs.move_to_end(path)
+                    return doc
+                del self._docs[path]
+                doc.close()
+            doc = fitz.open(path)
+            self._docs[path] = (doc, st.st_mtime_ns, st.st_size)
+            while len(self._docs) > self.max_open:
+                _, (old, _, _) = self._docs.popitem(last=False)
+                old.close()
+            return doc
+
+    def close_all(self):
+        with self.lock:
+            while self._docs:
+                self._docs.popitem()[1][0].close()
+
+
+DEFAULT_ZOOM = 2.0
+MAX_FIT_ZOOM = 8.0  # upper bound for any zoom, explicit or picked from max_width/max_height
+
+MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+# PNG/JPEG come from MuPDF; WebP/AVIF need a Pillow build with those codecs
+FORMATS = {"png", "jpeg"} | {f for f in ("webp", "avif") if features.check(f)}
+
+
+def normalize_format(fmt: Optional[str]) -> str:
+    fmt = (fmt or "png").lower()
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    return fmt if fmt in FORMATS else "png"
+
+
+@dataclass(frozen=True)
+class CropSpec:
+    # What to render for one box; bbox is normalized to [0,1]
+    bbox: Tuple[float, float, float, float]
+    scale: Optional[float] = None
+    max_width: Optional[int] = None
+    max_height: Optional[int] = None
+    format: str = "png"
+    quality: Optional[int] = None
+
+    def token(self) -> str:
+        box = ",".join(f"{v:.6f}" for v in self.bbox)
+        return f"{box}|{self.scale}|{self.max_width}|{self.max_height}|{self.format}|{self.quality}"
+
+
+@dataclass(frozen=True)
+class Crop:
+    data: bytes
+    width: int
+    height: int
+    format: str
+
+
+def crop_key(pdf_path: str, page_index: int, spec: CropSpec) -> str:
+    # The file's mtime/size are part of the key, so a replaced PDF never serves stale crops
+    st = os.stat(pdf_path)
+    h = hashlib.sha256()
+    h.update(os.path.abspath(pdf_path).encode("utf-8"))
+    h.update(f"\0{st.st_mtime_ns}\0{st.st_size}\0{page_index}\0{spec.token()}".encode("ascii"))
+    return h.hexdigest()
+
+
+_HEADER = struct.Struct("<IIB")
+
+
+class CropCache:
+    # Rendered crops: in-memory LRU bounded by bytes, backed by an optional DiskLRU tier.
+    # Disk entries are width, height (uint32), the format name and then the encoded image.
+    # get/put may touch the disk; on the event loop use fetch_many/store, which only do
+    # memory lookups inline and move disk reads and writes to threads.
+
+    def __init__(self, max_bytes: int, disk: Optional[DiskLRU] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Crop]" = OrderedDict()
+        self._total = 0
+
+    def _recall(self, key: str) -> Optional[Crop]:
+        with self._lock:
+            crop = self._items.get(key)
+            if crop is not None:
+                self._items.move_to_end(key)
+            return crop
+
+    def get(self, key: str) -> Optional[Crop]:
+        crop = self._recall(key)
+        if crop is not None or self.disk is None:
+            return crop
+        raw = self.disk.get_bytes(key)
+        if raw is None or len(raw) < _HEADER.size:
+            return None
+        width, height, n = _HEADER.unpack_from(raw)
+        start = _HEADER.size + n
+        crop = Crop(raw[start:], width, height, raw[_HEADER.size:start].decode("ascii"))
+        self._remember(key, crop)
+        return crop
+
+    def put(self, key: str, crop: Crop) -> None:
+        self._remember(key, crop)
+        if self.disk is not None:
+            self._write(key, crop)
+
+    def _write(self, key: str, crop: Crop) -> None:
+        fmt = crop.format.encode("ascii")
+        self.disk.put_bytes(key, _HEADER.pack(crop.width, crop.height, len(fmt)) + fmt + crop.data)
+
+    async def fetch_many(self, keys: List[str]) -> Dict[str, Crop]:
+        # Memory hits inline; the rest are read from the disk tier in one thread hop
+        found = {}
+        for key in keys:
+            crop = self._recall(key)
+            if crop is not None:
+                found[key] = crop
+        misses = [key for key in keys if key not in found]
+        if misses and self.disk is not None:
+            loaded = await asyncio.to_thread(lambda: {key: self.get(key) for key in misses})
+            found.update((key, crop) for key, crop in loaded.items() if crop is not None)
+        return found
+
+    def store(self, key: str, crop: Crop) -> None:
+        # put() for the event loop: the disk write runs on the default executor
+        self._remember(key, crop)
+        if self.disk is not None:
+            asyncio.get_running_loop().run_in_executor(None, self._write, key, crop)
+
+    def _remember(self, key: str, crop: Crop) -> None:
+        size = len(crop.data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._total -= len(old.data)
+            self._items[key] = crop
+            self._total += size
+            while self._total > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._total -= len(evicted.data)
+
+
+def pick_zoom(clip: fitz.Rect, spec: CropSpec) -> float:
+    # Largest zoom that keeps the crop within max_width/max_height (never above an explicit scale).
+    # One pixel of slack covers MuPDF rounding the clip outwards to whole pixels.
+    fits = [(m - 1) / d for m, d in ((spec.max_width, clip.width), (spec.max_height, clip.height)) if m and d > 0]
+    if not fits:
+        return spec.scale or DEFAULT_ZOOM
+    zoom = min(min(fits), MAX_FIT_ZOOM)
+    if spec.scale:
+        zoom = min(zoom, spec.scale)
+    return max(zoom, 0.05)
+
+
+def encode(pix: fitz.Pixmap, fmt: str, quality: Optional[int] = None) -> bytes:
+    if fmt == "png":
+        return pix.tobytes("png")
+    if fmt == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality or 85)
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    buf = io.BytesIO()
+    img.save(buf, fmt.upper(), quality=quality or 80)
+    return buf.getvalue()
+
+
+def render_clip(page: fitz.Page, spec: CropSpec) -> Crop:
+    w, h = page.rect.width, page.rect.height
+    x0, y0, x1, y1 = spec.bbox
+    rect = fitz.Rect(x0 * w, y0 * h, x1 * w, y1 * h)
+    zoom = pick_zoom(rect, spec)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, alpha=False)
+    return Crop(encode(pix, spec.format, spec.quality), pix.width, pix.height, spec.format)
+
+
+# Per-process document pool for render workers
+_worker_docs: Optional[DocPool] = None
+
+
+# (pdf_path, page_index, [(key, spec), ...]): every crop wanted from one page
+PageJob = Tuple[str, int, List[Tuple[str, CropSpec]]]
+
+
+def _worker_doc(pdf_path: str) -> fitz.Document:
+    global _worker_docs
+    if _worker_docs is None:
+        _worker_docs = DocPool(settings.open_docs)
+    return _worker_docs.get(pdf_path)
+
+
+def render_in_worker(pdf_path: str, page_index: int, spec: CropSpec) -> Crop:
+    # Runs inside a RenderPool worker process. MuPDF errors (not a PDF, damaged page, pixmap
+    # too large) become ValueError: some of them can't be pickled back to the caller, and
+    # all of them are caused by the request's file or options.
+    try:
+        doc = _worker_doc(pdf_path)
+        if page_index < 0 or page_index >= len(doc):
+            raise ValueError("Invalid page index")
+        return render_clip(doc[page_index], spec)
+    except (FileNotFoundError, ValueError):
+        raise
+    except Exception as e:
+        raise ValueError(f"Cannot render page {page_index} of {os.path.basename(pdf_path)}: {e}") from None
+
+
+def render_pages_in_worker(jobs: List[PageJob]) -> List[Tuple[str, Crop]]:
+    # Each page is loaded once for all of its crops; pages that don't exist or fail to
+    # render are skipped (the caller reports their crops as missing)
+    out = []
+    for pdf_path, page_index, items in jobs:
+        try:
+            doc = _worker_doc(pdf_path)
+            if page_index < 0 or page_index >= len(doc):
+                continue
+            page = doc[page_index]
+            out.extend([(key, render_clip(page, spec)) for key, spec in items])
+        except Exception:
+            continue
+    return out
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+class RenderPool:
+    # Renders crops in worker processes so rasterization never blocks the event loop.
+    # Identical in-flight requests share one render; new renders are refused once
+    # max_pending are queued or running.
+
+    def __init__(self, workers: int, max_pending: int, timeout: float, cache: Optional[CropCache] = None):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self.cache = cache
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending = 0
+
+    def depth(self) -> int:
+        return self._pending
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _start(self, fn, *args) -> asyncio.Future:
+        fut = asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+        self._pending += 1
+        fut.add_done_callback(self._finished)
+        return fut
+
+    def _finished(self, fut: asyncio.Future):
+        self._pending -= 1
+        if fut.cancelled():
+            return
+        if isinstance(fut.exception(), BrokenProcessPool) and self._executor is not None:
+            # A worker died (e.g. a PDF crashed MuPDF); start a fresh pool for later requests
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _cache_result(self, key: str, fut: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not fut.cancelled() and fut.exception() is None and self.cache is not None:
+            self.cache.store(key, fut.result())
+
+    async def render(self, key: str, pdf_path: str, page_index: int, spec: CropSpec) -> Crop:
+        fut = self._inflight.get(key)
+        if fut is None:
+            if self._pending >= self.max_pending:
+                raise Overloaded("Render queue is full")
+            fut = self._start(render_in_worker, pdf_path, page_index, spec)
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._cache_result(key, f))
+        # shield: a waiter timing out must not cancel the render other waiters share
+        return await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+
+    async def render_pages(self, jobs: List[PageJob], timeout: Optional[float] = None) -> Dict[str, Crop]:
+        # Spreads whole pages over the workers (one task each) and admits the batch all or nothing
+        if not jobs:
+            return {}
+        groups = [jobs[i::self.workers] for i in range(min(self.workers, len(jobs)))]
+        if self._pending + len(groups) > self.max_pending:
+            raise Overloaded("Render queue is full")
+        futs = [asyncio.shield(self._start(render_pages_in_worker, g)) for g in groups]
+        results = await asyncio.wait_for(asyncio.gather(*futs), timeout or self.timeout)
+        out: Dict[str, Crop] = {}
+        for part in results:
+            for key, crop in part:
+                out[key] = crop
+                if self.cache is not None:
+                    self.cache.store(key, crop)
+        return out
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def default_crop_cache() -> CropCache:
+    disk = None
+    if settings.crop_cache_dir:
+        disk = DiskLRU(settings.crop_cache_dir, settings.crop_disk_max_mb * 1024 * 1024, suffix=".img")
+    return CropCache(settings.crop_cache_mb * 1024 * 1024, disk)
@@ -1,8 +1,56 @@
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
+# Full-text index over problem text, rowid = problems.id. It is an external-content
+# table (the text lives only in problems) with accents folded, so "ecuacion" finds
+# "ecuación". Triggers on problems keep it in step; choices_text is the problem's
+# distinct choice texts, written together with the problem by BulkWriter.
+FTS_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS problems_fts USING fts5(
+        header_text, body_text, choices_text,
+        content = 'problems', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS problems_fts_ai AFTER INSERT ON problems BEGIN
+        INSERT INTO problems_fts(rowid, header_text, body_text, choices_text)
+        VALUES (new.id, new.header_text, new.body_text, new.choices_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS problems_fts_ad AFTER DELETE ON problems BEGIN
+        INSERT INTO problems_fts(problems_fts, rowid, header_text, body_text, choices_text)
+        VALUES ('delete', old.id, old.header_text, old.body_text, old.choices_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS problems_fts_au AFTER UPDATE OF header_text, body_text, choices_text ON problems BEGIN
+        INSERT INTO problems_fts(problems_fts, rowid, header_text, body_text, choices_text)
+        VALUES ('delete', old.id, old.header_text, old.body_text, old.choices_text);
+        INSERT INTO problems_fts(rowid, header_text, body_text, choices_text)
+        VALUES (new.id, new.header_text, new.body_text, new.choices_text);
+    END""",
+]
+
+# Near-duplicate detection (dedup.py): one MinHash signature per problem plus its LSH
+# band buckets. Duplicates point at the first-seen problem through problems.canonical_id.
+DEDUP_STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS problem_minhash (
+        problem_id INTEGER PRIMARY KEY REFERENCES problems(id) ON DELETE CASCADE,
+        signature BLOB NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS problem_lsh (
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+        PRIMARY KEY (band, bucket, problem_id)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_problem_lsh_problem ON problem_lsh(problem_id)",
+    "CREATE INDEX IF NOT EXISTS idx_problems_canonical ON problems(canonical_id)",
+]
+
+# Current schema. Fresh databases are created from it directly; existing ones are
+# brought up to SCHEMA_VERSION by MIGRATIONS (tracked in PRAGMA user_version).
+SCHEMA_VERSION = 6
 SCHEMA = """
 PRAGMA foreign_keys = ON;
 CREATE TABLE IF NOT EXISTS pdfs (
@@ -10,51 +58,396 @@ CREATE TABLE IF NOT EXISTS pdfs (
     path TEXT NOT NULL UNIQUE,
     pages INTEGER,
     processed_at TEXT,
-    processor_id TEXT
+    processor_id TEXT,
+    file_hash TEXT,
+    mtime REAL,
+    size INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE TABLE IF NOT EXISTS pdf_pages (
+    pdf_id INTEGER NOT NULL REFERENCES pdfs(id) ON DELETE CASCADE,
+    page_index INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    updated_at TEXT,
+    layout_columns INTEGER,
+    layout_confidence REAL,
+    layout_source TEXT,
+    PRIMARY KEY (pdf_id, page_index)
 );
 CREATE TABLE IF NOT EXISTS problems (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    pdf_path TEXT NOT NULL,
+    pdf_id INTEGER NOT NULL REFERENCES pdfs(id) ON DELETE CASCADE,
     page_index INTEGER NOT NULL,
-    bbox_norm TEXT NOT NULL,
+    x0 REAL NOT NULL,
+    y0 REAL NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL,
     header_text TEXT,
     sample_text TEXT,
-    needs_review INTEGER NOT NULL DEFAULT 0
+    needs_review INTEGER NOT NULL DEFAULT 0,
+    body_text TEXT,
+    choices_text TEXT,
+    canonical_id INTEGER REFERENCES problems(id) ON DELETE SET NULL
 );
 CREATE TABLE IF NOT EXISTS choices (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
     label TEXT NOT NULL,
     text TEXT,
-    bbox_norm TEXT NOT NULL
+    x0 REAL NOT NULL,
+    y0 REAL NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL
 );
 CREATE TABLE IF NOT EXISTS figures (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
-    bbox_norm TEXT NOT NULL,
+    x0 REAL NOT NULL,
+    y0 REAL NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL,
     caption_text TEXT
 );
-"""
+CREATE INDEX IF NOT EXISTS idx_problems_pdf_page ON problems(pdf_id, page_index);
+CREATE INDEX IF NOT EXISTS idx_choices_problem ON choices(problem_id);
+CREATE INDEX IF NOT EXISTS idx_figures_problem ON figures(problem_id);
+CREATE TABLE IF NOT EXISTS crop_tiles (
+    problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+    zoom REAL NOT NULL,
+    format TEXT NOT NULL,
+    byte_offset INTEGER NOT NULL,
+    byte_length INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    PRIMARY KEY (problem_id, zoom, format)
+) WITHOUT ROWID;
+""" + "".join(stmt + ";\n" for stmt in FTS_STATEMENTS + DEDUP_STATEMENTS)
+
+def connect(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=check_same_thread)
+    # WAL lets readers run alongside the writer; NORMAL skips the fsync on every commit
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
 
 @contextmanager
 def get_conn(db_path: str):
-    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path)
     try:
         yield conn
         conn.commit()
     finally:
         conn.close()
 
-def init_db(db_path: str):
-    with get_conn(db_path) as conn:
-        conn.executescript(SCHEMA)
 
-# Helper serialization for normalized boxes: (x0,y0,x1,y1)
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _migrate_1(conn):
+    # Incremental-ingestion state: file fingerprint on pdfs plus per-page status
+    have = _columns(conn, "pdfs")
+    for name, decl in (
+        ("file_hash", "TEXT"),
+        ("mtime", "REAL"),
+        ("size", "INTEGER"),
+        ("status", "TEXT NOT NULL DEFAULT 'pending'"),
+    ):
+        if name not in have:
+            conn.execute(f"ALTER TABLE pdfs ADD COLUMN {name} {decl}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_pages (
+            pdf_id INTEGER NOT NULL REFERENCES pdfs(id) ON DELETE CASCADE,
+            page_index INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            updated_at TEXT,
+            PRIMARY KEY (pdf_id, page_index)
+        )""")
+
+
+def _migrate_2(conn):
+    # Text bboxes -> four REAL columns, pdf_path -> pdfs.id, plus lookup indexes.
+    # Tables are rebuilt (SQLite can't change column types in place) and renamed over the old ones.
+    conn.execute("INSERT OR IGNORE INTO pdfs(path) SELECT DISTINCT pdf_path FROM problems")
+    conn.execute("""
+        CREATE TABLE problems_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pdf_id INTEGER NOT NULL REFERENCES pdfs(id) ON DELETE CASCADE,
+            page_index INTEGER NOT NULL,
+            x0 REAL NOT NULL, y0 REAL NOT NULL, x1 REAL NOT NULL, y1 REAL NOT NULL,
+            header_text TEXT,
+            sample_text TEXT,
+            needs_review INTEGER NOT NULL DEFAULT 0
+        )""")
+    rows = conn.execute(
+        "SELECT p.id, f.id, p.page_index, p.bbox_norm, p.header_text, p.sample_text, p.needs_review "
+        "FROM problems p JOIN pdfs f ON f.path = p.pdf_path"
+    )
+    conn.executemany(
+        "INSERT INTO problems_v2 VALUES (?,?,?,?,?,?,?,?,?,?)",
+        ((pid, fid, page, *deserialize_bbox(bb), h, smp, nr) for pid, fid, page, bb, h, smp, nr in rows),
+    )
+    conn.execute("""
+        CREATE TABLE choices_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+            label TEXT NOT NULL,
+            text TEXT,
+            x0 REAL NOT NULL, y0 REAL NOT NULL, x1 REAL NOT NULL, y1 REAL NOT NULL
+        )""")
+    rows = conn.execute("SELECT id, problem_id, label, text, bbox_norm FROM choices")
+    conn.executemany(
+        "INSERT INTO choices_v2 VALUES (?,?,?,?,?,?,?,?)",
+        ((cid, pid, lbl, txt, *deserialize_bbox(bb)) for cid, pid, lbl, txt, bb in rows),
+    )
+    conn.execute("""
+        CREATE TABLE figures_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+            x0 REAL NOT NULL, y0 REAL NOT NULL, x1 REAL NOT NULL, y1 REAL NOT NULL,
+            caption_text TEXT
+        )""")
+    rows = conn.execute("SELECT id, problem_id, bbox_norm, caption_text FROM figures")
+    conn.executemany(
+        "INSERT INTO figures_v2 VALUES (?,?,?,?,?,?,?)",
+        ((fid, pid, *deserialize_bbox(bb), cap) for fid, pid, bb, cap in rows),
+    )
+    # AUTOINCREMENT high-water marks: the rebuilt tables only know their largest surviving
+    # id, and IDs of deleted rows must never be handed out again (see BulkWriter)
+    for table in ("problems", "choices", "figures"):
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+        if row is None:
+            continue
+        if conn.execute("SELECT 1 FROM sqlite_sequence WHERE name=?", (f"{table}_v2",)).fetchone():
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name=?", (row[0], f"{table}_v2"))
+        else:
+            conn.execute("INSERT INTO sqlite_sequence(name, seq) VALUES (?, ?)", (f"{table}_v2", row[0]))
+    for table in ("figures", "choices", "problems"):
+        conn.execute(f"DROP TABLE {table}")
+    for table in ("problems", "choices", "figures"):
+        conn.execute(f"ALTER TABLE {table}_v2 RENAME TO {table}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_problems_pdf_page ON problems(pdf_id, page_index)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_choices_problem ON choices(problem_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_figures_problem ON figures(problem_id)")
+
+
+def _migrate_3(conn):
+    # Offset index into the packed crop tile file (see tiles.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crop_tiles (
+            problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+            zoom REAL NOT NULL,
+            format TEXT NOT NULL,
+            byte_offset INTEGER NOT NULL,
+            byte_length INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            PRIMARY KEY (problem_id, zoom, format)
+        ) WITHOUT ROWID""")
+
+
+def _migrate_4(conn):
+    # Full body/choice text plus the FTS5 index. Older rows only kept sample_text,
+    # which stands in for the body until the PDF is processed again.
+    have = _columns(conn, "problems")
+    for name in ("body_text", "choices_text"):
+        if name not in have:
+            conn.execute(f"ALTER TABLE problems ADD COLUMN {name} TEXT")
+    conn.execute("UPDATE problems SET body_text = sample_text WHERE body_text IS NULL")
+    conn.execute("""
+        UPDATE problems SET choices_text = (
+            SELECT group_concat(t, ' ') FROM (SELECT DISTINCT c.text AS t FROM choices c WHERE c.problem_id = problems.id)
+        ) WHERE choices_text IS NULL""")
+    for stmt in FTS_STATEMENTS:
+        conn.execute(stmt)
+    conn.execute("INSERT INTO problems_fts(problems_fts) VALUES ('rebuild')")
+
+
+def _migrate_5(conn):
+    # Duplicate links and LSH tables; existing problems are fingerprinted by `treecare dedup --rebuild`
+    if "canonical_id" not in _columns(conn, "problems"):
+        conn.execute("ALTER TABLE problems ADD COLUMN canonical_id INTEGER REFERENCES problems(id) ON DELETE SET NULL")
+    for stmt in DEDUP_STATEMENTS:
+        conn.execute(stmt)
+
+
+def _migrate_6(conn):
+    # Per-page column layout (1/2), its confidence and where it came from: auto, forced or exception.
+    # Pages processed before this version keep NULLs.
+    have = _columns(conn, "pdf_pages")
+    for name, decl in (("layout_columns", "INTEGER"), ("layout_confidence", "REAL"), ("layout_source", "TEXT")):
+        if name not in have:
+            conn.execute(f"ALTER TABLE pdf_pages ADD COLUMN {name} {decl}")
+
+
+# (version, upgrade) pairs; each upgrade takes the DB from version-1 to version
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _migrate_1),
+    (2, _migrate_2),
+    (3, _migrate_3),
+    (4, _migrate_4),
+    (5, _migrate_5),
+    (6, _migrate_6),
+]
 
-def serialize_bbox(b: Tuple[float, float, float, float]) -> str:
-    return ",".join(f"{v:.6f}" for v in b)
+
+def init_db(db_path: str):
+    conn = connect(db_path)
+    try:
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        fresh = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='problems'").fetchone()[0] == 0
+        if fresh:
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+            return
+        pending = [(v, up) for v, up in MIGRATIONS if v > version]
+        if not pending:
+            return
+        # Table rebuilds need FK enforcement off; it can only be toggled outside a transaction
+        conn.execute("PRAGMA foreign_keys = OFF")
+        conn.isolation_level = None
+        for v, up in pending:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                up(conn)
+                bad = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if bad:
+                    raise sqlite3.IntegrityError(f"Migration to schema v{v} left dangling references: {bad[:5]}")
+                conn.execute(f"PRAGMA user_version = {v}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+
+# Helper parsing of the pre-v2 text boxes: "x0,y0,x1,y1"
 
 def deserialize_bbox(s: str) -> Tuple[float, float, float, float]:
     x0, y0, x1, y1 = map(float, s.split(","))
     return x0, y0, x1, y1
+
+
+class BulkWriter:
+    # Buffers problem/choice/figure rows and writes them with executemany.
+    # IDs are assigned up front, which is safe because there is only ever one writer;
+    # children can reference a problem before it is flushed. Like AUTOINCREMENT, IDs of
+    # deleted rows are never handed out again: numbering continues after the larger of
+    # MAX(id) and sqlite_sequence, and inserting an explicit id advances sqlite_sequence.
+
+    def __init__(self, db_path: str, check_same_thread: bool = True):
+        self.conn = connect(db_path, check_same_thread=check_same_thread)
+        self._next: Dict[str, int] = {}
+        for table in ("problems", "choices", "figures"):
+            (max_id,) = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+            self._next[table] = max(max_id, row[0] if row else 0) + 1
+        self.problems: List[tuple] = []
+        self.choices: List[tuple] = []
+        self.figures: List[tuple] = []
+
+    def _take_id(self, table: str) -> int:
+        i = self._next[table]
+        self._next[table] = i + 1
+        return i
+
+    def add_problem(self, pdf_id: int, page_index: int, bbox: Tuple[float, float, float, float], header_text: str,
+                    sample_text: str, needs_review: int, body_text: str = "") -> int:
+        pid = self._take_id("problems")
+        self.problems.append((pid, pdf_id, page_index, *bbox, header_text, sample_text, needs_review, body_text))
+        return pid
+
+    def add_choice(self, problem_id: int, label: str, text: str, bbox: Tuple[float, float, float, float]):
+        self.choices.append((self._take_id("choices"), problem_id, label, text, *bbox))
+
+    def add_figure(self, problem_id: int, bbox: Tuple[float, float, float, float], caption_text: str):
+        self.figures.append((self._take_id("figures"), problem_id, *bbox, caption_text))
+
+    def flush(self):
+        cur = self.conn.cursor()
+        # Distinct choice texts per problem for the FTS index (segment.py may attach a choice twice)
+        choice_texts: Dict[int, Dict[str, None]] = {}
+        for c in self.choices:
+            if c[3]:
+                choice_texts.setdefault(c[1], {})[c[3]] = None
+        if self.problems:
+            cur.executemany(
+                "INSERT INTO problems(id, pdf_id, page_index, x0, y0, x1, y1, header_text, sample_text, needs_review, body_text, choices_text) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                [p + (" ".join(choice_texts.get(p[0], ())),) for p in self.problems],
+            )
+        if self.choices:
+            cur.executemany("INSERT INTO choices(id, problem_id, label, text, x0, y0, x1, y1) VALUES (?,?,?,?,?,?,?,?)", self.choices)
+        if self.figures:
+            cur.executemany("INSERT INTO figures(id, problem_id, x0, y0, x1, y1, caption_text) VALUES (?,?,?,?,?,?,?)", self.figures)
+        self.problems, self.choices, self.figures = [], [], []
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+
+    def rollback(self):
+        self.problems, self.choices, self.figures = [], [], []
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class WriterThread:
+    # Serializes all DB writes onto one thread so any number of producer threads
+    # can hand over results without contending for the SQLite write lock.
+
+    def __init__(self, db_path: str, maxsize: int = 64):
+        self._queue: "queue.Queue[Optional[Callable[[BulkWriter], None]]]" = queue.Queue(maxsize=maxsize)
+        self._error: Optional[BaseException] = None
+        self._db_path = db_path
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="treecare-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        try:
+            writer = BulkWriter(self._db_path)
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                if self._error is not None:
+                    continue  # drain after a failure
+                try:
+                    job(writer)
+                    writer.commit()
+                except BaseException as e:
+                    writer.rollback()
+                    self._error = e
+        finally:
+            writer.close()
+
+    def submit(self, job: Callable[[BulkWriter], None]):
+        # job runs on the writer thread and is committed as one transaction
+        if self._error is not None:
+            raise self._error
+        self._queue.put(job)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,174 @@
+from __future__ import annotations
+import hashlib
+import re
+import sqlite3
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# MinHash over character shingles of the normalized problem text, banded for LSH.
+# 16 bands x 8 rows put the 50%-collision point at Jaccard ~0.71; candidates are then
+# confirmed against DEFAULT_THRESHOLD on the full signature.
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 5
+MIN_SHINGLES = 20  # shorter bodies (empty, stray labels) are never linked
+DEFAULT_THRESHOLD = 0.8
+
+# Fixed seed: signatures are stored, so the permutations must never change
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_rng = np.random.default_rng(20250817)
+_A = _rng.integers(1, 2**32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint64)
+_MASK = np.uint64(0xFFFFFFFF)
+
+
+def normalize(text: str) -> str:
+    # Case, accents, punctuation and spacing differ between OCR runs of the same question
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    norm = normalize(text)
+    if len(norm) < SHINGLE:
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.fromiter(
+        (zlib.crc32(norm[i:i + SHINGLE].encode("utf-8")) for i in range(len(norm) - SHINGLE + 1)),
+        dtype=np.uint64,
+    ))
+
+
+def minhash(hashes: np.ndarray) -> np.ndarray:
+    # a*h + b < 2**64 for 32-bit a, b and h, so the uint64 arithmetic never wraps
+    perm = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return (perm & _MASK).min(axis=1).astype(np.uint32)
+
+
+def band_keys(sig: np.ndarray) -> List[int]:
+    # One signed 64-bit bucket per band (fits an SQLite INTEGER)
+    return [
+        int.from_bytes(hashlib.blake2b(sig[b * ROWS:(b + 1) * ROWS].tobytes(), digest_size=8).digest(), "little", signed=True)
+        for b in range(BANDS)
+    ]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def problem_text(body_text: Optional[str], choices: Iterable[str] = ()) -> str:
+    # Only the body identifies a question. Headers are left out ("Pregunta 12" vs "Pregunta 31"
+    # is the same question) and so are choices: stock answer lists ("A) Solo I B) Solo II ...")
+    # repeat across unrelated questions and would link body-less fragments to each other.
+    # segment.py keeps choice blocks in the body region, so their text is cut out here (the
+    # last whole-word occurrence: choices follow the question, which may repeat a short one).
+    text = f" {normalize(body_text or '')} "
+    for choice in choices:
+        norm = normalize(choice)
+        at = text.rfind(f" {norm} ") if norm else -1
+        if at >= 0:
+            text = text[:at] + text[at + len(norm) + 1:]
+    return text.strip()
+
+
+def _root(conn: sqlite3.Connection, problem_id: int) -> int:
+    row = conn.execute("SELECT canonical_id FROM problems WHERE id=?", (problem_id,)).fetchone()
+    return row[0] if row and row[0] is not None else problem_id
+
+
+def link_duplicates(conn: sqlite3.Connection, problem_ids: Iterable[int], threshold: float = DEFAULT_THRESHOLD) -> Dict[int, int]:
+    # Fingerprints the given problems and links each near-duplicate to the canonical
+    # (first seen) problem. Candidates come from LSH buckets, so the cost per problem
+    # doesn't grow with the corpus. Returns {problem_id: canonical_id} for new links.
+    ids = list(problem_ids)
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT id, body_text FROM problems WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+    ).fetchall()
+    choices: Dict[int, List[str]] = {}
+    for pid, text in conn.execute(
+        f"SELECT problem_id, text FROM choices WHERE problem_id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+    ):
+        choices.setdefault(pid, []).append(text or "")
+    links: Dict[int, int] = {}
+    for pid, body in rows:
+        hashes = shingle_hashes(problem_text(body, choices.get(pid, ())))
+        if hashes.size < MIN_SHINGLES:
+            continue
+        sig = minhash(hashes)
+        keys = band_keys(sig)
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(r[0] for r in conn.execute(
+                "SELECT problem_id FROM problem_lsh WHERE band=? AND bucket=?", (band, key)
+            ))
+        candidates.discard(pid)
+        best, best_sim = None, threshold
+        for cid in sorted(candidates):
+            (blob,) = conn.execute("SELECT signature FROM problem_minhash WHERE problem_id=?", (cid,)).fetchone()
+            sim = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if sim >= best_sim:
+                best, best_sim = cid, sim
+        conn.execute("INSERT OR REPLACE INTO problem_minhash(problem_id, signature) VALUES (?, ?)", (pid, sig.tobytes()))
+        conn.executemany(
+            "INSERT OR IGNORE INTO problem_lsh(band, bucket, problem_id) VALUES (?,?,?)",
+            [(band, key, pid) for band, key in enumerate(keys)],
+        )
+        if best is not None:
+            canonical = _root(conn, best)
+            conn.execute("UPDATE problems SET canonical_id=? WHERE id=?", (canonical, pid))
+            links[pid] = canonical
+    return links
+
+
+def release_canonicals(conn: sqlite3.Connection, problem_ids: Iterable[int]):
+    # Call before deleting problem_ids. A deleted canonical would leave its duplicates as
+    # unlinked roots (ON DELETE SET NULL); instead its lowest surviving member takes over
+    # the cluster, so re-ingesting a PDF never splits clusters that span other PDFs.
+    ids = list(problem_ids)
+    if not ids:
+        return
+    doomed = set(ids)
+    members: Dict[int, List[int]] = {}
+    for pid, root in conn.execute(
+        f"SELECT id, canonical_id FROM problems WHERE canonical_id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+    ):
+        if pid not in doomed:
+            members.setdefault(root, []).append(pid)
+    for root, pids in members.items():
+        new_root = pids[0]
+        conn.execute("UPDATE problems SET canonical_id = NULL WHERE id=?", (new_root,))
+        conn.executemany("UPDATE problems SET canonical_id=? WHERE id=?", [(new_root, pid) for pid in pids[1:]])
+
+
+def rebuild(conn: sqlite3.Connection, threshold: float = DEFAULT_THRESHOLD, batch: int = 1000) -> int:
+    # Recomputes every fingerprint and link in ID order (the oldest problem stays canonical)
+    conn.execute("DELETE FROM problem_lsh")
+    conn.execute("DELETE FROM problem_minhash")
+    conn.execute("UPDATE problems SET canonical_id = NULL WHERE canonical_id IS NOT NULL")
+    ids = [r[0] for r in conn.execute("SELECT id FROM problems ORDER BY id")]
+    linked = 0
+    for i in range(0, len(ids), batch):
+        linked += len(link_duplicates(conn, ids[i:i + batch], threshold))
+    return linked
+
+
+def duplicate_clusters(conn: sqlite3.Connection, min_size: int = 2) -> List[Tuple[int, List[tuple]]]:
+    # [(canonical_id, [(problem_id, pdf_path, page_index, header_text), ...])], largest first
+    rows = conn.execute(
+        "SELECT COALESCE(p.canonical_id, p.id) AS root, p.id, d.path, p.page_index, p.header_text "
+        "FROM problems p JOIN pdfs d ON d.id = p.pdf_id "
+        "WHERE p.canonical_id IS NOT NULL OR EXISTS (SELECT 1 FROM problems q WHERE q.canonical_id = p.id) "
+        "ORDER BY root, p.id"
+    ).fetchall()
+    clusters: Dict[int, List[tuple]] = {}
+    for root, pid, path, page, header in rows:
+        clusters.setdefault(root, []).append((pid, path, page, header))
+    out = [(root, members) for root, members in clusters.items() if len(members) >= min_size]
+    out.sort(key=lambda c: (-len(c[1]), c[0]))
+    return out
@@ -1,54 +1,180 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
+from typing import Dict, Callable, TypeVar, Tuple
 from dataclasses import dataclass
+import random
+import threading
+import time
+from google.api_core import exceptions as gexc
 from google.cloud import documentai_v1 as documentai
+from .cache import DocumentCache, cache_key
+from .config import settings
 
-@dataclass
-class PageBlock:
+T = TypeVar("T")
+
+# 429 and 503 are transient: quota exhaustion and backend overload
+RETRYABLE = (gexc.ResourceExhausted, gexc.ServiceUnavailable, gexc.TooManyRequests)
+
+PARAGRAPH, LINE, TABLE, FIGURE = "paragraph", "line", "table", "figure"
+
+
+@dataclass(frozen=True, slots=True)
+class Block:
+    # One layout element of a page. Text is a slice of the shared document text,
+    # not a copy; bbox is normalized (x0, y0, x1, y1).
     page_index: int
-    text: str
-    bbox: List[Dict[str, float]]  # normalized vertices x,y in [0,1]
-    type: str | None = None
+    bbox: Tuple[float, float, float, float]
+    type: str
+    source: str = ""
+    start: int = 0
+    end: int = 0
+
+    @property
+    def text(self) -> str:
+        return self.source[self.start:self.end]
+
+
+_client: documentai.DocumentProcessorServiceClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> documentai.DocumentProcessorServiceClient:
+    # One client (and gRPC channel) per process; the client is thread-safe
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = documentai.DocumentProcessorServiceClient()
+        return _client
+
+
+class RateLimiter:
+    # Spaces calls evenly so that at most `qpm` requests start per minute
+
+    def __init__(self, qpm: int):
+        self.interval = 60.0 / qpm if qpm > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self) -> None:
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
 
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
 
-def process_pdf(project_id: str, location: str, processor_id: str, file_path: str) -> documentai.Document:
-    client = documentai.DocumentProcessorServiceClient()
-    name = client.processor_path(project_id, location, processor_id)
-    with open(file_path, "rb") as f:
-        raw_document = documentai.RawDocument(content=f.read(), mime_type="application/pdf")
-    request = documentai.ProcessRequest(name=name, raw_document=raw_document)
-    result = client.process_document(request=request)
-    return result.document
 
+def rate_limiter(processor_id: str, qpm: int) -> RateLimiter:
+    with _limiters_lock:
+        lim = _limiters.get(processor_id)
+        if lim is None:
+            lim = _limiters[processor_id] = RateLimiter(qpm)
+        return lim
 
-def normalized_bbox_from_layout(layout: documentai.Document.Page.Layout) -> List[Dict[str, float]]:
-    # Document AI provides normalizedBoundingPoly for layout bounds
+
+def call_with_retry(fn: Callable[[], T], attempts: int, base_delay: float = 1.0, max_delay: float = 60.0) -> T:
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except RETRYABLE:
+            if attempt == attempts - 1:
+                raise
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+    raise RuntimeError("unreachable")
+
+
+class DocAIBackend:
+    # Live Document AI processor. Every backend has this shape: cache_id/version namespace
+    # the response cache, qpm feeds the shared rate limiter (0: unlimited), cacheable says
+    # whether responses are worth caching, and process() may raise RETRYABLE errors.
+    name = "docai"
+    cacheable = True
+
+    def __init__(self, project_id: str, location: str, processor_id: str, processor_version: str = "", qpm: int | None = None):
+        self.project_id = project_id
+        self.location = location
+        self.cache_id = processor_id
+        self.version = processor_version
+        self.qpm = settings.docai_qpm if qpm is None else qpm
+
+    def process(self, content: bytes) -> documentai.Document:
+        client = get_client()
+        if self.version:
+            name = client.processor_version_path(self.project_id, self.location, self.cache_id, self.version)
+        else:
+            name = client.processor_path(self.project_id, self.location, self.cache_id)
+        raw_document = documentai.RawDocument(content=content, mime_type="application/pdf")
+        return client.process_document(request=documentai.ProcessRequest(name=name, raw_document=raw_document)).document
+
+    def check(self) -> str:
+        client = get_client()
+        proc = client.get_processor(name=client.processor_path(self.project_id, self.location, self.cache_id))
+        return f"Processor OK: {proc.display_name} (state={proc.state.name})"
+
+
+def process_pdf(
+    project_id: str,
+    location: str,
+    processor_id: str,
+    source: str | bytes,
+    cache: DocumentCache | None = None,
+    refresh: bool = False,
+    processor_version: str = "",
+    backend=None,
+) -> documentai.Document:
+    # source is either a path to a PDF or the PDF bytes themselves. backend replaces the
+    # Document AI processor named by project/location/processor (see backends.make_backend).
+    if isinstance(source, (bytes, bytearray)):
+        content = bytes(source)
+    else:
+        with open(source, "rb") as f:
+            content = f.read()
+    if backend is None:
+        backend = DocAIBackend(project_id, location, processor_id, processor_version)
+    use_cache = cache is not None and backend.cacheable
+    key = cache_key(content, backend.cache_id, backend.version) if use_cache else None
+    if key is not None and not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    limiter = rate_limiter(backend.cache_id, backend.qpm)
+
+    def call():
+        limiter.acquire()
+        return backend.process(content)
+
+    document = call_with_retry(call, attempts=settings.docai_max_attempts)
+    if key is not None:
+        cache.put(key, document)
+    return document
+
+
+def xyxy_from_layout(layout: documentai.Document.Page.Layout) -> Tuple[float, float, float, float]:
+    # Accepts proto-plus or raw protobuf layouts; the pipeline passes raw ones (see extract_blocks)
     poly = layout.bounding_poly
-    if poly is None or poly.normalized_vertices is None or len(poly.normalized_vertices) == 0:
-        # Fallback to non-normalized
-        vertices = poly.vertices if poly else []
-        # Convert by assuming page size 1x1
-        return [{"x": v.x or 0.0, "y": v.y or 0.0} for v in vertices]
-    return [{"x": v.x or 0.0, "y": v.y or 0.0} for v in poly.normalized_vertices]
-
-
-def to_xyxy(bbox: List[Dict[str, float]]):
-    xs = [v["x"] for v in bbox]
-    ys = [v["y"] for v in bbox]
-    return min(xs), min(ys), max(xs), max(ys)
-
-
-def text_from_anchor(doc: documentai.Document, text_anchor: Optional[documentai.Document.TextAnchor]) -> str:
-    if not text_anchor or not text_anchor.text_segments:
-        return ""
-    # Concatenate segments from the global doc.text
-    chunks: List[str] = []
-    for seg in text_anchor.text_segments:
-        start = int(seg.start_index) if seg.start_index is not None else 0
-        end = int(seg.end_index) if seg.end_index is not None else start
-        chunks.append(doc.text[start:end])
-    return "".join(chunks)
-
-
-def layout_to_text(doc: documentai.Document, layout: documentai.Document.Page.Layout) -> str:
-    return text_from_anchor(doc, layout.text_anchor)
+    vertices = poly.normalized_vertices or poly.vertices
+    if not vertices:
+        return (0.0, 0.0, 0.0, 0.0)
+    xs = [v.x for v in vertices]
+    ys = [v.y for v in vertices]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def anchor_block(text: str, layout: documentai.Document.Page.Layout, page_index: int, type: str) -> Block:
+    # text must be the document text fetched once per document: every access returns a fresh
+    # copy, and blocks are only cheap if they all share one string. A single-segment anchor
+    # (the usual case) is kept as offsets into it, so no text is sliced here.
+    segs = layout.text_anchor.text_segments
+    bbox = xyxy_from_layout(layout)
+    if len(segs) == 1:
+        seg = segs[0]
+        return Block(page_index, bbox, type, text, seg.start_index, seg.end_index)
+    # Empty or multi-segment anchors: materialize the joined text
+    joined = "".join(text[sg.start_index:sg.end_index] for sg in segs)
+    return Block(page_index, bbox, type, joined, 0, len(joined))
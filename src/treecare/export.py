@@ -1,36 +1,155 @@
 from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
 from pathlib import Path
+from typing import List, Tuple
+import os
 import sqlite3
 import fitz  # PyMuPDF
-from .db import deserialize_bbox
+from tqdm import tqdm
+from .db import init_db, connect
+from .crops import DocPool, encode, normalize_format
+from .tiles import Tile, TileWriter, tile_zoom
 
+# (pdf_path, page_index, [(problem_id, x0, y0, x1, y1), ...])
+PageTask = Tuple[str, int, List[Tuple[int, float, float, float, float]]]
 
-def export_crops(db_path: str, out_dir: str, zoom: float = 2.0):
-    out = Path(out_dir)
-    out.mkdir(parents=True, exist_ok=True)
+# Open documents kept per worker process (PyMuPDF handles can't be shared across processes)
+MAX_OPEN_DOCS = 4
+_docs = DocPool(MAX_OPEN_DOCS)
+
+
+def render_crops(page: fitz.Page, boxes: List[Tuple[float, float, float, float]], zoom: float,
+                 full_page_min: int = 0) -> List[fitz.Pixmap]:
+    # Crops for normalized boxes on one page. With full_page_min > 0 and at least that many
+    # boxes, the page is rasterized once and each crop is copied out of that pixmap.
+    # Clip rendering is usually faster (MuPDF only rasterizes the clip and caches decoded
+    # images), so whole-page reuse is opt-in for pages where it measures better.
+    mat = fitz.Matrix(zoom, zoom)
+    w, h = page.rect.width, page.rect.height
+    rects = [fitz.Rect(x0*w, y0*h, x1*w, y1*h) for x0, y0, x1, y1 in boxes]
+    if full_page_min <= 0 or len(rects) < full_page_min:
+        return [page.get_pixmap(matrix=mat, clip=rect, alpha=False) for rect in rects]
+    full = page.get_pixmap(matrix=mat, alpha=False)
+    out = []
+    for rect in rects:
+        irect = (rect * mat).irect & full.irect
+        if irect.is_empty:
+            out.append(page.get_pixmap(matrix=mat, clip=rect, alpha=False))
+            continue
+        pix = fitz.Pixmap(full.colorspace, irect, False)
+        pix.copy(full, irect)
+        out.append(pix)
+    return out
+
+
+def _export_page(task: PageTask, out_dir: str, zoom: float, full_page_min: int) -> int:
+    pdf_path, page_index, problems = task
+    page = _docs.get(pdf_path)[page_index]
+    pixes = render_crops(page, [p[1:] for p in problems], zoom, full_page_min)
+    base = Path(pdf_path).stem
+    for (pid, *_), pix in zip(problems, pixes):
+        fname = f"{base}_p{page_index:03d}_prob{pid:06d}.png"
+        pix.save(str(Path(out_dir) / fname))
+    return len(problems)
+
+
+def _export_pages(tasks: List[PageTask], out_dir: str, zoom: float, full_page_min: int) -> int:
+    try:
+        return sum(_export_page(t, out_dir, zoom, full_page_min) for t in tasks)
+    finally:
+        _docs.close_all()
+
+
+def _render_tiles(tasks: List[PageTask], zoom: float, fmt: str, full_page_min: int) -> List[Tile]:
+    # Worker side of export_tiles: encoded crops go back to the parent, which owns the tile file
+    out: List[Tile] = []
+    try:
+        for pdf_path, page_index, problems in tasks:
+            page = _docs.get(pdf_path)[page_index]
+            pixes = render_crops(page, [p[1:] for p in problems], zoom, full_page_min)
+            out.extend((pid, pix.width, pix.height, encode(pix, fmt)) for (pid, *_), pix in zip(problems, pixes))
+    finally:
+        _docs.close_all()
+    return out
+
+
+def load_page_tasks(db_path: str, missing_tiles: Tuple[float, str] | None = None) -> List[PageTask]:
+    # missing_tiles=(zoom, format) keeps only problems without that tile yet
     conn = sqlite3.connect(db_path)
     try:
         cur = conn.cursor()
-        cur.execute("SELECT id, pdf_path, page_index, bbox_norm FROM problems ORDER BY pdf_path, page_index, id")
+        # Linked duplicates are left out; their canonical problem's crop stands for them
+        sql = ("SELECT p.id, f.path, p.page_index, p.x0, p.y0, p.x1, p.y1 FROM problems p "
+               "JOIN pdfs f ON f.id = p.pdf_id WHERE p.canonical_id IS NULL")
+        params: tuple = ()
+        if missing_tiles is not None:
+            sql += (" AND NOT EXISTS (SELECT 1 FROM crop_tiles t "
+                    "WHERE t.problem_id = p.id AND t.zoom = ? AND t.format = ?)")
+            params = (tile_zoom(missing_tiles[0]), missing_tiles[1])
+        # Walks idx_problems_pdf_page, so rows arrive grouped by PDF and page without a sort
+        cur.execute(sql + " ORDER BY p.pdf_id, p.page_index, p.id", params)
         rows = cur.fetchall()
-        current_pdf = None
-        doc = None
-        for pid, pdf_path, page_index, bbox_norm in rows:
-            if current_pdf != pdf_path:
-                if doc is not None:
-                    doc.close()
-                doc = fitz.open(pdf_path)
-                current_pdf = pdf_path
-            page = doc[page_index]
-            x0,y0,x1,y1 = deserialize_bbox(bbox_norm)
-            # rasterize and crop
-            mat = fitz.Matrix(zoom, zoom)
-            rect = fitz.Rect(x0*page.rect.width, y0*page.rect.height, x1*page.rect.width, y1*page.rect.height)
-            pix = page.get_pixmap(matrix=mat, clip=rect, alpha=False)
-            base = Path(pdf_path).stem
-            fname = f"{base}_p{page_index:03d}_prob{pid:06d}.png"
-            pix.save(str(out / fname))
-        if doc is not None:
-            doc.close()
     finally:
         conn.close()
+    tasks: List[PageTask] = []
+    for (pdf_path, page_index), grp in groupby(rows, key=lambda r: (r[1], r[2])):
+        tasks.append((pdf_path, page_index, [(pid, x0, y0, x1, y1) for pid, _, _, x0, y0, x1, y1 in grp]))
+    return tasks
+
+
+def shard_tasks(tasks: List[PageTask], jobs: int) -> List[List[PageTask]]:
+    # Shard by PDF first so each worker opens a document once, then split big PDFs by page
+    shards: List[List[PageTask]] = []
+    per_shard = max(1, -(-len(tasks) // (jobs * 4)))
+    for _, grp in groupby(tasks, key=lambda t: t[0]):
+        pages = list(grp)
+        for i in range(0, len(pages), per_shard):
+            shards.append(pages[i:i + per_shard])
+    return shards
+
+
+def export_crops(db_path: str, out_dir: str, zoom: float = 2.0, jobs: int | None = None, full_page_min: int = 0):
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    init_db(db_path)  # upgrades older databases in place
+    tasks = load_page_tasks(db_path)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(tasks) <= 1:
+        return _export_pages(tasks, str(out), zoom, full_page_min)
+    total = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_export_pages, shard, str(out), zoom, full_page_min) for shard in shard_tasks(tasks, jobs)]
+        for fut in tqdm(futures, desc="Exporting crops"):
+            total += fut.result()
+    return total
+
+
+def export_tiles(db_path: str, tiles_path: str, zoom: float = 2.0, fmt: str = "png",
+                 jobs: int | None = None, full_page_min: int = 0) -> int:
+    # Appends crops that aren't in the tile file yet (for this zoom/format) and indexes them.
+    # Each shard is committed as it lands, so an interrupted export resumes where it stopped.
+    init_db(db_path)
+    fmt = normalize_format(fmt)
+    tasks = load_page_tasks(db_path, missing_tiles=(zoom, fmt))
+    jobs = jobs or os.cpu_count() or 1
+    shards = shard_tasks(tasks, jobs)
+    writer = TileWriter(tiles_path, connect(db_path))
+    total = 0
+    try:
+        if jobs <= 1 or len(shards) <= 1:
+            for shard in tqdm(shards, desc="Exporting tiles"):
+                tiles = _render_tiles(shard, zoom, fmt, full_page_min)
+                writer.add(tiles, zoom, fmt)
+                total += len(tiles)
+            return total
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_render_tiles, shard, zoom, fmt, full_page_min) for shard in shards]
+            for fut in tqdm(futures, desc="Exporting tiles"):
+                tiles = fut.result()
+                writer.add(tiles, zoom, fmt)
+                total += len(tiles)
+        return total
+    finally:
+        writer.close()
+        writer.conn.close()
@@ -0,0 +1,128 @@
+from __future__ import annotations
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from .config import settings
+from .dedup import release_canonicals
+
+# Incremental ingestion state: a PDF is re-OCR'd only if its content changed,
+# and within a PDF only pages not yet committed are processed again.
+
+# New content of a changed PDF: (file_hash, mtime, size, pages). Planning only detects the
+# change; the first chunk committed from the new content adopts it (adopt_revision).
+Revision = Tuple[str, float, int, int]
+
+
+def file_sha256(path: Path, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(bufsize)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def plan_pdf(conn, pdf_path: Path, total_pages: int) -> Tuple[int, Set[int], Optional[Revision]]:
+    # Returns (pdf_id, page indices still to process, revision to adopt if the content
+    # changed). Call inside one transaction.
+    st = os.stat(pdf_path)
+    row = conn.execute(
+        "SELECT id, file_hash, mtime, size, status FROM pdfs WHERE path=?", (str(pdf_path),)
+    ).fetchone()
+    if row is not None:
+        pdf_id, old_hash, old_mtime, old_size, status = row
+        # Cheap check first: untouched files aren't even re-hashed
+        if status == "done" and old_mtime == st.st_mtime and old_size == st.st_size:
+            return pdf_id, set(), None
+        file_hash = file_sha256(pdf_path)
+        if file_hash == old_hash:
+            conn.execute("UPDATE pdfs SET mtime=?, size=? WHERE id=?", (st.st_mtime, st.st_size, pdf_id))
+            return pdf_id, pending_pages(conn, pdf_id), None
+        # Content changed: every page is redone, but the stale problems stay until new
+        # results replace them, so a failed OCR run doesn't leave the PDF empty
+        return pdf_id, set(range(total_pages)), (file_hash, st.st_mtime, st.st_size, total_pages)
+    else:
+        file_hash = file_sha256(pdf_path)
+        cur = conn.execute(
+            "INSERT INTO pdfs(path, pages, processor_id, file_hash, mtime, size, status) VALUES (?,?,?,?,?,?,'pending')",
+            (str(pdf_path), total_pages, settings.processor_id, file_hash, st.st_mtime, st.st_size),
+        )
+        pdf_id = cur.lastrowid
+    conn.executemany(
+        "INSERT OR IGNORE INTO pdf_pages(pdf_id, page_index, status) VALUES (?,?,'pending')",
+        [(pdf_id, i) for i in range(total_pages)],
+    )
+    return pdf_id, pending_pages(conn, pdf_id), None
+
+
+def adopt_revision(conn, pdf_id: int, revision: Revision):
+    # Runs in the transaction of the first chunk committed from a changed PDF: all page
+    # checkpoints go back to pending, and pages past the new end lose their problems. Pages
+    # not in this chunk keep their old problems until their own chunk clears them.
+    file_hash, mtime, size, total_pages = revision
+    row = conn.execute("SELECT file_hash FROM pdfs WHERE id=?", (pdf_id,)).fetchone()
+    if row is not None and row[0] == file_hash:
+        return
+    delete_problems(conn, "pdf_id=? AND page_index>=?", (pdf_id, total_pages))
+    conn.execute("DELETE FROM pdf_pages WHERE pdf_id=? AND page_index>=?", (pdf_id, total_pages))
+    conn.execute(
+        "UPDATE pdf_pages SET status='pending', updated_at=NULL, layout_columns=NULL, layout_confidence=NULL, layout_source=NULL WHERE pdf_id=?",
+        (pdf_id,),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO pdf_pages(pdf_id, page_index, status) VALUES (?,?,'pending')",
+        [(pdf_id, i) for i in range(total_pages)],
+    )
+    conn.execute(
+        "UPDATE pdfs SET pages=?, file_hash=?, mtime=?, size=?, status='pending', processed_at=NULL, processor_id=? WHERE id=?",
+        (total_pages, file_hash, mtime, size, settings.processor_id, pdf_id),
+    )
+
+
+def pending_pages(conn, pdf_id: int) -> Set[int]:
+    rows = conn.execute(
+        "SELECT page_index FROM pdf_pages WHERE pdf_id=? AND status!='done'", (pdf_id,)
+    ).fetchall()
+    return {r[0] for r in rows}
+
+
+def delete_problems(conn, where: str, params: tuple):
+    # Every problem deletion goes through here, so duplicate clusters survive it
+    ids = [r[0] for r in conn.execute(f"SELECT id FROM problems WHERE {where}", params)]
+    if ids:
+        release_canonicals(conn, ids)
+        conn.execute(f"DELETE FROM problems WHERE {where}", params)
+
+
+def clear_pages(conn, pdf_id: int, pages: Iterable[int]):
+    # Stale problems of these pages: leftovers from an interrupted run (can't normally exist,
+    # each page commits atomically with its status) or the previous version of a changed PDF
+    pages = list(pages)
+    if pages:
+        delete_problems(conn, f"pdf_id=? AND page_index IN ({','.join('?' * len(pages))})", (pdf_id, *pages))
+
+
+def mark_pages_done(conn, pdf_id: int, pages: Iterable[int]):
+    conn.executemany(
+        "UPDATE pdf_pages SET status='done', updated_at=datetime('now') WHERE pdf_id=? AND page_index=?",
+        [(pdf_id, p) for p in pages],
+    )
+
+
+def record_layouts(conn, pdf_id: int, layouts: Dict[int, Tuple[int, float, str]]):
+    # page_index -> (columns, confidence, source) as decided by the pipeline
+    conn.executemany(
+        "UPDATE pdf_pages SET layout_columns=?, layout_confidence=?, layout_source=? WHERE pdf_id=? AND page_index=?",
+        [(cols, round(conf, 4), source, pdf_id, p) for p, (cols, conf, source) in layouts.items()],
+    )
+
+
+def finish_pdf_if_complete(conn, pdf_id: int) -> bool:
+    if pending_pages(conn, pdf_id):
+        return False
+    conn.execute("UPDATE pdfs SET status='done', processed_at=datetime('now') WHERE id=?", (pdf_id,))
+    return True
@@ -0,0 +1,84 @@
+from __future__ import annotations
+import json
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Any, List, Optional
+
+# Headless layout configuration for `treecare process --manifest`, e.g. (YAML or JSON):
+#
+#   columns: auto              # default for PDFs not listed: auto, s or d
+#   pdfs:
+#     - pdf: EX_Adm_UNI_2025_2_AAH.pdf
+#       columns: d
+#       exceptions: "1,41"     # 1-based pages with the opposite layout
+#     - pdf: "*_MAT.pdf"       # name, stem or glob
+#       columns: s
+#
+# The first matching entry wins. Exceptions only apply to forced layouts; auto
+# decides every page on its own.
+
+COLUMN_VALUES = {"s": 1, "single": 1, "1": 1, "d": 2, "double": 2, "2": 2, "auto": None, "a": None, "": None}
+
+
+def parse_columns(value: Any) -> Optional[int]:
+    # "s"/"d"/"auto" (also 1, 2, single, double) -> 1, 2 or None for automatic detection
+    key = "" if value is None else str(value).strip().lower()
+    if key not in COLUMN_VALUES:
+        raise ValueError(f"Unknown columns value {value!r}; expected s, d or auto")
+    return COLUMN_VALUES[key]
+
+
+def parse_exceptions(value: Any) -> set[int]:
+    # "3,4", [3, 4] or 3 -> 1-based page numbers
+    if value is None or value == "":
+        return set()
+    if isinstance(value, (list, tuple)):
+        return {int(v) for v in value}
+    return {int(p) for p in str(value).split(",") if p.strip()}
+
+
+@dataclass
+class LayoutRule:
+    columns: Optional[int] = None  # 1, 2 or None (auto)
+    exceptions: set[int] = field(default_factory=set)
+
+
+@dataclass
+class Manifest:
+    default: LayoutRule = field(default_factory=LayoutRule)
+    rules: List[tuple[str, LayoutRule]] = field(default_factory=list)
+
+    def rule_for(self, pdf_path: Path) -> LayoutRule:
+        for pattern, rule in self.rules:
+            if pdf_path.stem == pattern or fnmatch(pdf_path.name, pattern) or fnmatch(pdf_path.as_posix(), pattern):
+                return rule
+        return self.default
+
+
+def read_structured(path: str) -> Any:
+    # JSON, or YAML for .yaml/.yml (PyYAML is optional)
+    text = Path(path).read_text(encoding="utf-8")
+    if Path(path).suffix.lower() in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError as e:
+            raise RuntimeError("YAML manifests need PyYAML: pip install pyyaml (or use a .json manifest)") from e
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def rule_from(entry: dict) -> LayoutRule:
+    return LayoutRule(parse_columns(entry.get("columns")), parse_exceptions(entry.get("exceptions")))
+
+
+def load_manifest(path: str) -> Manifest:
+    data = read_structured(path) or {}
+    if isinstance(data, list):
+        data = {"pdfs": data}
+    rules = []
+    for entry in data.get("pdfs") or []:
+        if "pdf" not in entry:
+            raise ValueError(f"Manifest entry without a 'pdf' name: {entry!r}")
+        rules.append((str(entry["pdf"]), rule_from(entry)))
+    return Manifest(rule_from(data), rules)
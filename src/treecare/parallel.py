@@ -0,0 +1,121 @@
+from __future__ import annotations
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from .docai import Block
+from .segment import TYPE_CODES, decide_columns, segment_page
+
+# Page segmentation on a process pool. A page travels as one record array plus the
+# slices of document text its blocks point into (not the whole document text), and
+# comes back as block indices, which are mapped onto the original Block objects. Pages
+# are gathered in page order, so results don't depend on the number of workers.
+
+PACKED_DTYPE = np.dtype([
+    ("x0", "f8"), ("y0", "f8"), ("x1", "f8"), ("y1", "f8"),
+    ("type", "u1"), ("source", "u2"), ("start", "i4"), ("end", "i4"),
+])
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# (page_index, forced columns, 1-based exception pages, text slices, packed blocks)
+PagePayload = Tuple[int, Optional[int], frozenset, Tuple[str, ...], np.ndarray]
+# (page_index, (columns, confidence, source), problems with blocks as indices)
+PageResult = Tuple[int, Tuple[int, float, str], List[Dict[str, Any]]]
+
+
+def pack_page(page_index: int, blocks: List[Block], forced_columns: int | None, ex_pages: set[int]) -> PagePayload:
+    slices: Dict[int, List[int]] = {}  # id(source) -> [slice number, lo, hi]
+    for b in blocks:
+        sl = slices.setdefault(id(b.source), [len(slices), b.start, b.end])
+        sl[1], sl[2] = min(sl[1], b.start), max(sl[2], b.end)
+    sources = {id(b.source): b.source for b in blocks}
+    texts = tuple(sources[key][lo:hi] for key, (_, lo, hi) in sorted(slices.items(), key=lambda kv: kv[1][0]))
+    arr = np.empty(len(blocks), dtype=PACKED_DTYPE)
+    for i, b in enumerate(blocks):
+        n, lo, _ = slices[id(b.source)]
+        arr[i] = (*b.bbox, TYPE_CODES[b.type], n, b.start - lo, b.end - lo)
+    return page_index, forced_columns, frozenset(ex_pages), texts, arr
+
+
+def unpack_page(payload: PagePayload) -> List[Block]:
+    page_index, _, _, texts, arr = payload
+    return [
+        Block(page_index, (x0, y0, x1, y1), TYPE_NAMES[t], texts[src], start, end)
+        for x0, y0, x1, y1, t, src, start, end in arr.tolist()
+    ]
+
+
+def _encode(problems: List[Dict[str, Any]], blocks: List[Block]) -> List[Dict[str, Any]]:
+    # Blocks -> positions in the page's block list; merged headers are new blocks and travel as-is
+    pos = {id(b): i for i, b in enumerate(blocks)}
+    out = []
+    for pb in problems:
+        header = pb["header"]
+        out.append({
+            **pb,
+            "header": pos.get(id(header), header) if header is not None else None,
+            "body": [pos[id(b)] for b in pb["body"]],
+            "choices": [pos[id(b)] for b in pb["choices"]],
+            "figures": [pos[id(b)] for b in pb["figures"]],
+        })
+    return out
+
+
+def _decode(problems: List[Dict[str, Any]], blocks: List[Block]) -> List[Dict[str, Any]]:
+    out = []
+    for pb in problems:
+        header = pb["header"]
+        out.append({
+            **pb,
+            "header": blocks[header] if isinstance(header, int) else header,
+            "body": [blocks[i] for i in pb["body"]],
+            "choices": [blocks[i] for i in pb["choices"]],
+            "figures": [blocks[i] for i in pb["figures"]],
+        })
+    return out
+
+
+def _segment_packed(payloads: List[PagePayload]) -> List[PageResult]:
+    # Worker side: rebuild the page, decide its layout and segment it
+    out = []
+    for payload in payloads:
+        page_index, forced_columns, ex_pages = payload[:3]
+        blocks = unpack_page(payload)
+        layout = decide_columns(blocks, page_index, forced_columns, ex_pages)
+        out.append((page_index, layout, _encode(segment_page(blocks, page_index=page_index, forced_columns=layout[0]), blocks)))
+    return out
+
+
+class SegmentPool:
+    # jobs <= 1 segments on the calling thread, without pickling
+
+    def __init__(self, jobs: int | None = None):
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self._pool = ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+
+    def segment(self, pages: Dict[int, List[Block]], forced_columns: int | None, ex_pages: set[int]
+                ) -> Tuple[List[tuple[int, List[Dict[str, Any]]]], Dict[int, tuple[int, float, str]]]:
+        # (segmented pages in page order, page_index -> (columns, confidence, source))
+        order = sorted(pages)
+        if self._pool is None or len(order) <= 1:
+            layouts = {p: decide_columns(pages[p], p, forced_columns, ex_pages) for p in order}
+            return [(p, segment_page(pages[p], page_index=p, forced_columns=layouts[p][0])) for p in order], layouts
+        # Contiguous shards, a couple per worker so one slow page doesn't hold the chunk back
+        per_shard = max(1, -(-len(order) // (self.jobs * 2)))
+        shards = [order[i:i + per_shard] for i in range(0, len(order), per_shard)]
+        futures = [
+            self._pool.submit(_segment_packed, [pack_page(p, pages[p], forced_columns, ex_pages) for p in shard])
+            for shard in shards
+        ]
+        segmented, layouts = [], {}
+        for fut in futures:
+            for p, layout, problems in fut.result():
+                layouts[p] = layout
+                segmented.append((p, _decode(problems, pages[p])))
+        return segmented, layouts
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
@@ -1,162 +1,336 @@
 from __future__ import annotations
 import json
 from pathlib import Path
-from typing import Dict, Any, List
+from dataclasses import dataclass, field
+from typing import Dict, Any, Iterator, List
 from tqdm import tqdm
 from .config import settings
-from .db import init_db, get_conn, serialize_bbox
-from .docai import process_pdf, normalized_bbox_from_layout, to_xyxy, layout_to_text
-from .segment import segment_page
+from .db import init_db, get_conn, BulkWriter, WriterThread
+from .docai import process_pdf, Block, anchor_block, xyxy_from_layout, PARAGRAPH, LINE, TABLE, FIGURE
+from .cache import DocumentCache
+from .chunks import range_bytes, MAX_SYNC_PAGES
+from .ingest import Revision, plan_pdf, adopt_revision, clear_pages, mark_pages_done, record_layouts, finish_pdf_if_complete
+from .batch import GcsStore, LocalStore, DocAIBatchRunner, LocalBatchRunner, run_batch
+from .segment import segment_page, decide_columns
+from .dedup import link_duplicates
+from .backends import make_backend
+from .textlayer import local_pages
+from .manifest import LayoutRule, Manifest
+from .parallel import SegmentPool
+from .stages import StagedPipeline
 import fitz  # PyMuPDF
 import tempfile
-import os
 
 
-def extract_blocks(doc) -> List[Dict[str, Any]]:
-    blocks: List[Dict[str, Any]] = []
-    for p_idx, page in enumerate(doc.pages):
+def extract_blocks(doc, offset: int = 0) -> List[Block]:
+    # offset maps chunk/shard page numbers back to the original PDF's page_index.
+    # Walks the raw protobuf: proto-plus wraps every nested message and vertex on access,
+    # which made extraction ~15x slower (python -m benchmarks.extract).
+    pb = getattr(doc, "_pb", doc)
+    blocks: List[Block] = []
+    add = blocks.append
+    text = pb.text
+    for p_idx, page in enumerate(pb.pages, start=offset):
         # Use detected blocks: paragraphs, tables, figures
         # Gather: paragraphs
         for para in page.paragraphs:
-            text = layout_to_text(doc, para.layout)
-            blocks.append({
-                "page_index": p_idx,
-                "text": text or "",
-                "bbox": normalized_bbox_from_layout(para.layout),
-                "type": "paragraph"
-            })
+            add(anchor_block(text, para.layout, p_idx, PARAGRAPH))
         # Lines (useful to catch A) .. E) when paragraphs are fragmented)
-        for line in getattr(page, 'lines', []):
-            text = layout_to_text(doc, line.layout)
-            blocks.append({
-                "page_index": p_idx,
-                "text": text or "",
-                "bbox": normalized_bbox_from_layout(line.layout),
-                "type": "line"
-            })
-        # Tables
-        for table in getattr(page, 'tables', []):
-            blocks.append({
-                "page_index": p_idx,
-                "text": "",  # structure not needed here
-                "bbox": normalized_bbox_from_layout(table.layout),
-                "type": "table"
-            })
+        for line in page.lines:
+            add(anchor_block(text, line.layout, p_idx, LINE))
+        # Tables (structure not needed here)
+        for table in page.tables:
+            add(Block(p_idx, xyxy_from_layout(table.layout), TABLE))
         # Figures (detected images)
-        for figure in getattr(page, 'figures', []):
-            blocks.append({
-                "page_index": p_idx,
-                "text": "",
-                "bbox": normalized_bbox_from_layout(figure.layout),
-                "type": "figure"
-            })
+        for figure in getattr(page, 'figures', ()):
+            add(Block(p_idx, xyxy_from_layout(figure.layout), FIGURE))
     return blocks
 
 
-def run_pipeline(input_dir: str, db_path: str, forced_columns: int | None = None, exception_pages: str | None = None):
+def parse_pages(spec: str | None) -> set[int]:
+    # Comma-separated 1-based page numbers, e.g. "1,2,3"
+    pages = set()
+    if spec:
+        for part in spec.split(','):
+            p = part.strip()
+            if p.isdigit():
+                pages.add(int(p))
+    return pages
+
+
+def page_layouts(pages: Dict[int, List[Block]], forced_columns: int | None, ex_pages: set[int]) -> Dict[int, tuple[int, float, str]]:
+    # page_index -> (columns, confidence, source)
+    return {page_idx: decide_columns(page_blocks, page_idx, forced_columns, ex_pages) for page_idx, page_blocks in pages.items()}
+
+
+def segment_pages(pages: Dict[int, List[Block]], forced_columns: int | None, ex_pages: set[int],
+                  layouts: Dict[int, tuple[int, float, str]] | None = None) -> List[tuple[int, List[Dict[str, Any]]]]:
+    layouts = layouts if layouts is not None else page_layouts(pages, forced_columns, ex_pages)
+    return [
+        (page_idx, segment_page(page_blocks, page_index=page_idx, forced_columns=layouts[page_idx][0]))
+        for page_idx, page_blocks in sorted(pages.items())
+    ]
+
+
+def blocks_text(blocks: List[Block]) -> str:
+    # Paragraph blocks and the line blocks inside them cover the same document text, so
+    # spans are merged per source string and each character is emitted once, in block order
+    spans: List[list] = []  # [first block position, source, start, end]
+    order = sorted(range(len(blocks)), key=lambda i: (id(blocks[i].source), blocks[i].start, -blocks[i].end))
+    for i in order:
+        b = blocks[i]
+        last = spans[-1] if spans else None
+        if last is not None and last[1] is b.source and b.start <= last[3]:
+            last[0] = min(last[0], i)
+            last[3] = max(last[3], b.end)
+        else:
+            spans.append([i, b.source, b.start, b.end])
+    spans.sort(key=lambda sp: sp[0])
+    return "\n".join(t for t in (src[start:end].strip() for _, src, start, end in spans) if t)
+
+
+def write_problems(writer: BulkWriter, pdf_id: int, segmented: List[tuple[int, List[Dict[str, Any]]]]) -> List[int]:
+    ids = []
+    for page_idx, problems in segmented:
+        for pb in problems:
+            bbox_xyxy = pb["bbox"]
+            header_text = pb["header"].text.strip() if pb["header"] else ""
+            body_text_first = pb["body"][0].text.strip() if pb.get("body") else ""
+            choice_text_first = pb["choices"][0].text.strip() if pb.get("choices") else ""
+            sample_text = (body_text_first + " " + choice_text_first).strip()
+            needs_review = 1 if pb.get("needs_review") else 0
+            body_text = blocks_text(pb.get("body") or [])
+            problem_id = writer.add_problem(pdf_id, page_idx, bbox_xyxy, header_text, sample_text, needs_review, body_text)
+            ids.append(problem_id)
+            # choices
+            for ch in pb["choices"]:
+                txt = ch.text.strip()
+                label = txt[:1] if txt else ""
+                writer.add_choice(problem_id, label, txt, ch.bbox)
+            # figures
+            for fg in pb["figures"]:
+                writer.add_figure(problem_id, fg.bbox, fg.text.strip())
+    return ids
+
+
+def pages_from_doc(doc, offset: int) -> Dict[int, List[Block]]:
+    pages: Dict[int, List[Block]] = {}
+    for b in extract_blocks(doc, offset):
+        pages.setdefault(b.page_index, []).append(b)
+    return pages
+
+
+def plan(db_path: str, pdf_path: Path, total_pages: int) -> tuple[int, set[int], Revision | None]:
+    with get_conn(db_path) as conn:
+        return plan_pdf(conn, pdf_path, total_pages)
+
+
+def commit_job(pdf_id: int, todo: List[int], segmented: List[tuple[int, List[Dict[str, Any]]]],
+               layouts: Dict[int, tuple[int, float, str]] | None = None, revision: Revision | None = None):
+    # Runs on the writer thread as one transaction per chunk:
+    # problems and page checkpoints land together or not at all
+    def job(writer: BulkWriter):
+        if revision is not None:
+            adopt_revision(writer.conn, pdf_id, revision)
+        clear_pages(writer.conn, pdf_id, todo)
+        ids = write_problems(writer, pdf_id, segmented)
+        writer.flush()
+        if settings.dedup_threshold > 0:
+            # Repeats of a question seen in any earlier exam get linked to it
+            link_duplicates(writer.conn, ids, settings.dedup_threshold)
+        mark_pages_done(writer.conn, pdf_id, todo)
+        if layouts:
+            record_layouts(writer.conn, pdf_id, layouts)
+        finish_pdf_if_complete(writer.conn, pdf_id)
+    return job
+
+
+def store_chunk(writer: WriterThread, segmenter: SegmentPool, pdf_id: int, todo: List[int],
+                pages: Dict[int, List[Block]], forced_columns: int | None, ex_pages: set[int],
+                revision: Revision | None = None):
+    # Pages are segmented on the pool; the writer only gets the finished rows
+    segmented, layouts = segmenter.segment({p: pages[p] for p in todo if pages.get(p)}, forced_columns, ex_pages)
+    writer.submit(commit_job(pdf_id, todo, segmented, layouts, revision))
+
+
+def split_local(src: fitz.Document, pending: set[int], text_layer: str) -> tuple[Dict[int, List[Block]], set[int]]:
+    # Born-digital pages are read from the PDF's own text layer; only the rest need OCR
+    if text_layer == "off" or not pending:
+        return {}, pending
+    local = local_pages(src, sorted(pending))
+    return local, pending - set(local)
+
+
+def run_batch_pipeline(pdf_paths: List[Path], db_path: str, layout: Manifest,
+                       cache: DocumentCache | None, refresh: bool, batch_local_dir: str | None, text_layer: str, backend,
+                       jobs: int | None = None):
+    # Whole PDFs go through batch_process_documents; no 30-page chunking on our side.
+    # Offline backends always run the emulated LRO; without --local-gcs it runs in a scratch
+    # directory (uploaded PDFs plus output shards) that is removed afterwards.
+    if batch_local_dir or backend.name == "docai":
+        return _run_batch_pipeline(pdf_paths, db_path, layout, cache, refresh, batch_local_dir, text_layer, backend, jobs)
+    with tempfile.TemporaryDirectory(prefix="treecare-batch-") as scratch:
+        return _run_batch_pipeline(pdf_paths, db_path, layout, cache, refresh, scratch, text_layer, backend, jobs)
+
+
+def _run_batch_pipeline(pdf_paths: List[Path], db_path: str, layout: Manifest,
+                        cache: DocumentCache | None, refresh: bool, batch_local_dir: str | None, text_layer: str, backend,
+                        jobs: int | None):
+    if batch_local_dir:
+        store = LocalStore(batch_local_dir)
+        runner = LocalBatchRunner(store, lambda content: process_pdf(
+            settings.project_id, settings.location, settings.processor_id, content,
+            cache=cache, refresh=refresh, processor_version=settings.processor_version, backend=backend,
+        ))
+        poll = 0.0
+    else:
+        store = GcsStore()
+        runner = DocAIBatchRunner()
+        poll = settings.batch_poll_seconds
+    todo: Dict[Path, tuple[int, set[int], Revision | None]] = {}
+    local: List[tuple[int, Dict[int, List[Block]], LayoutRule, Revision | None]] = []
+    for pdf_path in pdf_paths:
+        with fitz.open(str(pdf_path)) as src:
+            pdf_id, pending, revision = plan(db_path, pdf_path, len(src))
+            text_pages, pending = split_local(src, pending, text_layer)
+        if text_pages:
+            local.append((pdf_id, text_pages, layout.rule_for(pdf_path), revision))
+        if pending:
+            todo[pdf_path] = (pdf_id, pending, revision)
+    if not todo and not local:
+        print("Nothing to do: all PDFs are up to date")
+        return
+    # Only PDFs that still have scanned pages are uploaded
+    results = run_batch(store, runner, list(todo), settings.batch_input_uri, settings.batch_output_uri, poll_interval=poll) if todo else {}
+    writer = WriterThread(db_path)
+    segmenter = SegmentPool(jobs)
+    try:
+        for pdf_id, pages, rule, revision in local:
+            store_chunk(writer, segmenter, pdf_id, sorted(pages), pages, rule.columns, rule.exceptions, revision)
+        for pdf_path, (pdf_id, pending, revision) in tqdm(todo.items(), desc="Storing PDFs"):
+            rule = layout.rule_for(pdf_path)
+            for shard, offset in results.get(pdf_path, []):
+                # Shard page offsets map back to page_index exactly like chunk offsets
+                pages = pages_from_doc(shard, offset)
+                shard_pages = sorted(p for p in pending if offset <= p < offset + len(shard.pages))
+                store_chunk(writer, segmenter, pdf_id, shard_pages, pages, rule.columns, rule.exceptions, revision)
+    finally:
+        segmenter.close()
+        writer.close()
+
+
+def run_pipeline(
+    input_dir: str,
+    db_path: str,
+    forced_columns: int | None = None,
+    exception_pages: str | None = None,
+    cache: DocumentCache | None = None,
+    refresh: bool = False,
+    concurrency: int = 1,
+    mode: str = "sync",
+    batch_local_dir: str | None = None,
+    text_layer: str | None = None,
+    backend=None,
+    manifest: Manifest | None = None,
+    jobs: int | None = None,
+):
     init_db(db_path)
     pdf_paths = sorted(Path(input_dir).glob('**/*.pdf'))
     if not pdf_paths:
         print(f"No PDFs found in {input_dir}")
         return
-    for pdf_path in tqdm(pdf_paths, desc="Processing PDFs"):
-        # Determine total pages
-        with fitz.open(str(pdf_path)) as src_doc:
-            total_pages = len(src_doc)
-        # Upsert into pdfs table (once per original)
-        with get_conn(db_path) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT OR IGNORE INTO pdfs(path, pages, processed_at, processor_id) VALUES (?,?,datetime('now'),?)",
-                (str(pdf_path), total_pages, settings.processor_id)
+    # Per-PDF layouts come from the manifest; otherwise one rule (forced or auto) for every PDF
+    layout = manifest or Manifest(LayoutRule(forced_columns, parse_pages(exception_pages)))
+    text_layer = text_layer or settings.text_layer
+    backend = backend or make_backend()
+    if mode == "batch":
+        run_batch_pipeline(pdf_paths, db_path, layout, cache, refresh, batch_local_dir, text_layer, backend, jobs)
+        return
+
+    def ocr(job: ChunkJob) -> ChunkJob:
+        if job.content is not None:
+            job.doc = process_pdf(
+                settings.project_id, settings.location, settings.processor_id, job.content,
+                cache=cache, refresh=refresh, processor_version=settings.processor_version, backend=backend,
             )
+            job.content = None
+        return job
+
+    def extract(job: ChunkJob) -> ChunkJob:
+        if job.doc is not None:
+            job.pages = pages_from_doc(job.doc, job.offset)
+            job.doc = None
+        return job
+
+    # chunker -> OCR (`concurrency` requests in flight) -> block extraction -> segmentation on
+    # `jobs` worker processes (this thread) -> the writer thread, which owns the SQLite connection.
+    # Every hand-over is a bounded queue, so memory stays flat however many PDFs there are.
+    # Chunks reach the writer in (PDF, page) order whatever order OCR finishes in, so problem
+    # IDs (and with them canonical duplicates, exports and tiles) don't depend on --concurrency.
+    writer = WriterThread(db_path, maxsize=settings.queue_size)
+    segmenter = SegmentPool(jobs)
+    stages = StagedPipeline()
+    counts = {"planned": 0, "local": 0, "ocr": 0}
+    # PDFs are planned as the chunker reaches them, so the total grows during the run
+    progress = tqdm(total=0, desc="Processing pages", unit="page")
+    try:
+        # The window covers every queue and worker, so reordering never stalls a full pipeline
+        window = 2 * max(1, concurrency) + 2 * settings.queue_size + 2
+        stages.source(chunk_jobs(pdf_paths, db_path, layout, text_layer, counts), "ocr", max(1, concurrency), window=window)
+        stages.stage("ocr", ocr, "extract", settings.queue_size, workers=max(1, concurrency))
+        stages.stage("extract", extract, "segment", settings.queue_size)
+        stages.gauge("write", writer.depth)
+        for job in stages.results("segment", ordered=True):
+            store_chunk(writer, segmenter, job.pdf_id, job.todo, job.pages, job.rule.columns, job.rule.exceptions, job.revision)
+            progress.total = counts["planned"]
+            progress.update(len(job.todo))
+            progress.set_postfix(stages.depths())
+    finally:
+        # Already-queued chunks still commit, so a rerun resumes after them
+        stages.close()
+        progress.close()
+        segmenter.close()
+        writer.close()
+    if not counts["planned"]:
+        print("Nothing to do: all PDFs are up to date")
+        return
+    if counts["local"]:
+        print(f"Text layer: {counts['local']} pages read locally, {counts['ocr']} sent to OCR")
+    print("Queue peaks: " + ", ".join(f"{name} {peak}" for name, peak in stages.peaks.items()))
+
+
+@dataclass
+class ChunkJob:
+    # One window of pages moving through the stages; each stage drops what it consumed
+    pdf_id: int
+    rule: LayoutRule
+    todo: List[int]
+    offset: int = 0
+    content: bytes | None = None  # chunk PDF bytes, until OCR
+    doc: Any = None  # Document, until blocks are extracted
+    pages: Dict[int, List[Block]] = field(default_factory=dict)
+    revision: Revision | None = None  # new content of a changed PDF, adopted on commit
+
 
-        # Prepare chunks (<=30 pages) due to Document AI sync page limit
-        max_pages = 30
-        chunks: List[tuple[str, int, int]] = []  # (chunk_path, start_idx, count)
+def chunk_jobs(pdf_paths: List[Path], db_path: str, layout: Manifest, text_layer: str, counts: Dict[str, int]) -> Iterator[ChunkJob]:
+    # Chunks are <=30 pages due to the Document AI sync page limit and are serialized in memory.
+    # Boundaries stay fixed even when only some pages are pending, so a resumed chunk has the
+    # same bytes as before and its OCR comes from the response cache. Pages with a usable
+    # text layer never reach Document AI; a chunk is only sent when some of its pending
+    # pages still need OCR. Each PDF is opened once, for planning and chunking alike.
+    for pdf_path in pdf_paths:
         with fitz.open(str(pdf_path)) as src:
-            start = 0
-            while start < total_pages:
-                end = min(start + max_pages, total_pages)
-                chunk_doc = fitz.open()
-                chunk_doc.insert_pdf(src, from_page=start, to_page=end - 1)
-                tmp_dir = Path(tempfile.mkdtemp(prefix="treecare_chunks_"))
-                chunk_path = tmp_dir / f"{Path(pdf_path).stem}_p{start:03d}-{end-1:03d}.pdf"
-                chunk_doc.save(str(chunk_path))
-                chunk_doc.close()
-                chunks.append((str(chunk_path), start, end - start))
-
-        # Process each chunk and map page indices back to original
-        try:
-            for chunk_path, offset, count in chunks:
-                doc = process_pdf(settings.project_id, settings.location, settings.processor_id, chunk_path)
-                pages: Dict[int, List[Dict[str, Any]]] = {}
-                blocks = extract_blocks(doc)
-                for b in blocks:
-                    # Remap page index with offset
-                    b_idx = b["page_index"] + offset
-                    b["page_index"] = b_idx
-                    pages.setdefault(b_idx, []).append(b)
-                # Segment per page
-                with get_conn(db_path) as conn:
-                    # Parse exceptions into a set of 1-based pages for this PDF
-                    ex_pages = set()
-                    if exception_pages:
-                        for part in exception_pages.split(','):
-                            p = part.strip()
-                            if p.isdigit():
-                                ex_pages.add(int(p))
-                    for page_idx, page_blocks in pages.items():
-                        # Decide columns for this page
-                        page_num_1b = page_idx + 1
-                        fc = forced_columns
-                        if forced_columns in (1,2) and page_num_1b in ex_pages:
-                            fc = 2 if forced_columns == 1 else 1
-                        problems = segment_page(page_blocks, page_index=page_idx, forced_columns=fc)
-                        for pb in problems:
-                            bbox_xyxy = pb["bbox"]
-                            bbox_norm = serialize_bbox(bbox_xyxy)
-                            header_text = (pb["header"].get("text") or "").strip()
-                            body_text_first = (pb["body"][0].get("text") or "").strip() if pb.get("body") else ""
-                            choice_text_first = (pb["choices"][0].get("text") or "").strip() if pb.get("choices") else ""
-                            sample_text = (body_text_first + " " + choice_text_first).strip()
-                            needs_review = 1 if pb.get("needs_review") else 0
-                            cur = conn.cursor()
-                            cur.execute(
-                                "INSERT INTO problems(pdf_path, page_index, bbox_norm, header_text, sample_text, needs_review) VALUES (?,?,?,?,?,?)",
-                                (str(pdf_path), page_idx, bbox_norm, header_text, sample_text, needs_review)
-                            )
-                            problem_id = cur.lastrowid
-                            # choices
-                            for ch in pb["choices"]:
-                                txt = (ch.get("text") or "").strip()
-                                label = txt[:1] if txt else ""
-                                ch_bbox = from_bbox(ch["bbox"])  # xyxy
-                                cur.execute(
-                                    "INSERT INTO choices(problem_id, label, text, bbox_norm) VALUES (?,?,?,?)",
-                                    (problem_id, label, txt, serialize_bbox(ch_bbox))
-                                )
-                            # figures
-                            for fg in pb["figures"]:
-                                fg_bbox = from_bbox(fg["bbox"])  # xyxy
-                                cur.execute(
-                                    "INSERT INTO figures(problem_id, bbox_norm, caption_text) VALUES (?,?,?)",
-                                    (problem_id, serialize_bbox(fg_bbox), (fg.get("text") or "").strip())
-                                )
-        finally:
-            # Cleanup chunk files and directories
-            for chunk_path, _, _ in chunks:
-                try:
-                    os.remove(chunk_path)
-                    # Remove temp dir if empty
-                    tmp_dir = Path(chunk_path).parent
-                    tmp_dir.rmdir()
-                except Exception:
-                    pass
-
-# helpers to convert list of points to xyxy tuple
-
-def from_bbox(b):
-    xs = [v["x"] for v in b]
-    ys = [v["y"] for v in b]
-    return (min(xs), min(ys), max(xs), max(ys))
+            pdf_id, pending, revision = plan(db_path, pdf_path, len(src))
+            if not pending:
+                continue
+            counts["planned"] += len(pending)
+            rule = layout.rule_for(pdf_path)
+            for start in range(0, len(src), MAX_SYNC_PAGES):
+                end = min(start + MAX_SYNC_PAGES, len(src))
+                text_pages, todo = split_local(src, {p for p in pending if start <= p < end}, text_layer)
+                if text_pages:
+                    counts["local"] += len(text_pages)
+                    yield ChunkJob(pdf_id, rule, sorted(text_pages), pages=text_pages, revision=revision)
+                if todo:
+                    counts["ocr"] += len(todo)
+                    yield ChunkJob(pdf_id, rule, sorted(todo), start, range_bytes(src, start, end, garbage=settings.chunk_garbage), revision=revision)
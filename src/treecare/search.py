@@ -0,0 +1,44 @@
+from __future__ import annotations
+import re
+import sqlite3
+from typing import Any, Dict, List
+
+# bm25 column weights for problems_fts(header, body, choices)
+WEIGHTS = (2.0, 1.0, 0.5)
+SNIPPET_TOKENS = 12
+
+
+def fts_query(text: str) -> str:
+    # Free text -> quoted FTS5 terms (implicitly ANDed), so punctuation such as "x^2+1"
+    # can't break the MATCH syntax. The last term is a prefix for search-as-you-type.
+    terms = re.findall(r"\w+", text)
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_problems(conn: sqlite3.Connection, query: str, limit: int = 20, raw: bool = False,
+                    mark: tuple[str, str] = ("[", "]"), duplicates: bool = False) -> List[Dict[str, Any]]:
+    # Ranked problems matching `query`; raw=True passes FTS5 syntax (OR, NEAR, column:term) through.
+    # Linked duplicates are hidden unless duplicates=True.
+    match = query if raw else fts_query(query)
+    if not match:
+        return []
+    rows = conn.execute(
+        f"""SELECT s.rowid, bm25(problems_fts, {", ".join(map(str, WEIGHTS))}) AS score,
+                   snippet(problems_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}),
+                   d.path, p.page_index, p.header_text
+            FROM problems_fts s
+            JOIN problems p ON p.id = s.rowid
+            JOIN pdfs d ON d.id = p.pdf_id
+            WHERE problems_fts MATCH ? AND (? OR p.canonical_id IS NULL)
+            ORDER BY score
+            LIMIT ?""",
+        (mark[0], mark[1], match, int(duplicates), limit),
+    ).fetchall()
+    return [
+        {"id": pid, "score": round(-score, 4), "snippet": snip, "pdf_path": path, "page_index": page, "header": header}
+        for pid, score, snip, path, page, header in rows
+    ]
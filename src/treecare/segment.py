@@ -1,6 +1,8 @@
 from __future__ import annotations
 import re
 from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+from .docai import Block
 
 # Only accept headers like 'Pregunta 05', 'PREGUNTA Nº 12.' per new spec
 HEADER_RE = re.compile(r"^\s*pregunta\s*(n[ºo]\s*)?\d+\s*[)\.]?\s*", re.IGNORECASE)
@@ -9,12 +11,6 @@ CHOICE_RE = re.compile(r"^[A-E]\s*\)\s*")
 SOLUTION_RE = re.compile(r"(\bResoluci[óo]n\b|\bRpta\.?\b)", re.IGNORECASE)
 
 
-def xyxy(i):
-    xs = [v["x"] for v in i]
-    ys = [v["y"] for v in i]
-    return min(xs), min(ys), max(xs), max(ys)
-
-
 def overlap_y(b1, b2) -> float:
     _, y0a, _, y1a = b1
     _, y0b, _, y1b = b2
@@ -23,153 +19,254 @@ def overlap_y(b1, b2) -> float:
     return inter / den
 
 
-def resolve_columns(blocks: List[Dict[str, Any]], forced_columns: Optional[int] = None) -> List[Dict[str, Any]]:
-    # Prefer using text paragraphs to infer columns
-    candidates = [
-        (xyxy(b["bbox"]), idx)
-        for idx, b in enumerate(blocks)
-        if (b.get("type") in {"paragraph", "line"}) and (b.get("text") or "").strip()
+# Block geometry is packed once per page into a structured array so sort keys,
+# column tests and overlap checks don't re-parse vertex dicts.
+TYPE_CODES = {"paragraph": 1, "line": 2, "table": 3, "figure": 4, "image": 5}
+FIGURE_CODES = (3, 4, 5)
+F_TEXT, F_HEADER, F_CHOICE, F_SOLUTION = 1, 2, 4, 8
+BLOCK_DTYPE = np.dtype([
+    ("x0", "f8"), ("y0", "f8"), ("x1", "f8"), ("y1", "f8"),
+    ("type", "u1"), ("flags", "u1"),
+])
+
+
+def _prepare(blocks: List[Block]) -> Tuple[np.ndarray, List[str]]:
+    texts = [b.text.strip() for b in blocks]
+    rows = []
+    for b, t in zip(blocks, texts):
+        flags = 0
+        if t:
+            flags |= F_TEXT
+            if HEADER_RE.match(t):
+                flags |= F_HEADER
+            if CHOICE_RE.match(t):
+                flags |= F_CHOICE
+            if SOLUTION_RE.search(t):
+                flags |= F_SOLUTION
+        rows.append(b.bbox + (TYPE_CODES.get(b.type, 0), flags))
+    return np.array(rows, dtype=BLOCK_DTYPE), texts
+
+
+def block_array(blocks: List[Block]) -> np.ndarray:
+    return _prepare(blocks)[0]
+
+
+def overlap_y_many(span, arr: np.ndarray) -> np.ndarray:
+    # overlap_y(span, b) for every row of arr
+    _, y0a, _, y1a = span
+    inter = np.maximum(0.0, np.minimum(y1a, arr["y1"]) - np.maximum(y0a, arr["y0"]))
+    den = np.maximum(1e-6, np.maximum(y1a - y0a, arr["y1"] - arr["y0"]))
+    return inter / den
+
+
+def _column(blocks, arr: np.ndarray, idx: np.ndarray, xrange) -> Dict[str, Any]:
+    # Order a column's blocks top to bottom (stable, like sorted() on y0)
+    idx = idx[np.argsort(arr["y0"][idx], kind="stable")]
+    return {"blocks": [blocks[j] for j in idx.tolist()], "xrange": xrange, "index": idx}
+
+
+def _col_range(arr: np.ndarray, idx: np.ndarray):
+    if idx.size == 0:
+        return (0.0, 1.0)
+    # Add a tiny margin
+    return (max(0.0, float(arr["x0"][idx].min()) - 0.01), min(1.0, float(arr["x1"][idx].max()) + 0.01))
+
+
+def _split(blocks, arr: np.ndarray, left: np.ndarray) -> List[Dict[str, Any]]:
+    mask = np.zeros(len(blocks), dtype=bool)
+    mask[left] = True
+    idx1 = np.flatnonzero(mask)
+    idx2 = np.flatnonzero(~mask)
+    return [
+        _column(blocks, arr, idx1, _col_range(arr, idx1)),
+        _column(blocks, arr, idx2, _col_range(arr, idx2)),
     ]
-    if not candidates:
-        candidates = [(xyxy(b["bbox"]), idx) for idx, b in enumerate(blocks)]
-    if not candidates:
-        return [{"blocks": blocks, "xrange": (0.0, 1.0)}]
-
-    # Sort by left x and find largest gap
-    lefts = sorted((bb[0], idx) for bb, idx in candidates)
-    xs = [x for x, _ in lefts]
-    gaps = [(xs[i+1] - xs[i], i) for i in range(len(xs)-1)]
-    if not gaps:
-        col_blocks = sorted(blocks, key=lambda b: xyxy(b["bbox"])[1])
-        xr = (min(xyxy(b["bbox"])[0] for b in col_blocks), max(xyxy(b["bbox"])[2] for b in col_blocks))
-        return [{"blocks": col_blocks, "xrange": xr}]
-    gap, gi = max(gaps)
+
+
+def resolve_columns(blocks: List[Block], forced_columns: Optional[int] = None, arr: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    if arr is None:
+        arr = block_array(blocks)
+    if not len(blocks):
+        return [{"blocks": blocks, "xrange": (0.0, 1.0), "index": np.arange(0)}]
+    # Prefer using text paragraphs to infer columns
+    is_text = (arr["flags"] & F_TEXT) != 0
+    cand = np.flatnonzero(((arr["type"] == TYPE_CODES["paragraph"]) | (arr["type"] == TYPE_CODES["line"])) & is_text)
+    if cand.size == 0:
+        cand = np.arange(len(blocks))
+
+    def single():
+        everything = np.arange(len(blocks))
+        return [_column(blocks, arr, everything, (float(arr["x0"].min()), float(arr["x1"].max())))]
+
+    # Sort by left x and find largest gap (ties go to the rightmost gap)
+    lefts = cand[np.argsort(arr["x0"][cand], kind="stable")]
+    if lefts.size < 2:
+        return single()
+    gaps = np.diff(arr["x0"][lefts])
+    gap = gaps.max()
+    gi = int(np.flatnonzero(gaps == gap)[-1])
     # Forced single-column
     if forced_columns == 1:
-        col_blocks = sorted(blocks, key=lambda b: xyxy(b["bbox"])[1])
-        xr = (min(xyxy(b["bbox"])[0] for b in col_blocks), max(xyxy(b["bbox"])[2] for b in col_blocks))
-        return [{"blocks": col_blocks, "xrange": xr}]
-    # Forced double-column: choose best split by minimizing within-cluster variance of center-x
+        return single()
+    # Forced double-column: choose best split by minimizing within-cluster variance of center-x.
+    # Prefix sums give every split's sum of squares in one pass instead of O(n) per split.
     if forced_columns == 2:
-        centers = sorted(((bb[0]+bb[2])/2.0, idx) for bb, idx in candidates)
-        best_i = None
-        best_ss = None
-        xs_only = [c[0] for c in centers]
-        # try all split points
-        for i in range(1, len(centers)):
-            left = xs_only[:i]
-            right = xs_only[i:]
-            if not left or not right:
-                continue
-            ml = sum(left)/len(left)
-            mr = sum(right)/len(right)
-            ssl = sum((x-ml)**2 for x in left)
-            ssr = sum((x-mr)**2 for x in right)
-            ss = ssl + ssr
-            if best_ss is None or ss < best_ss:
-                best_ss = ss
-                best_i = i
-        if best_i is None:
-            best_i = len(centers)//2
-        left_idxs = {centers[j][1] for j in range(best_i)}
-        col1 = [blocks[j] for j in sorted(left_idxs)]
-        col2 = [blocks[j] for j in range(len(blocks)) if j not in left_idxs]
-        def col_range(col):
-            x0s = [xyxy(b["bbox"])[0] for b in col]
-            x1s = [xyxy(b["bbox"])[2] for b in col]
-            if not x0s:
-                return (0.0, 1.0)
-            return (max(0.0, min(x0s) - 0.01), min(1.0, max(x1s) + 0.01))
-        col1.sort(key=lambda b: xyxy(b["bbox"])[1])
-        col2.sort(key=lambda b: xyxy(b["bbox"])[1])
-        return [
-            {"blocks": col1, "xrange": col_range(col1)},
-            {"blocks": col2, "xrange": col_range(col2)},
-        ]
+        cx = (arr["x0"][cand] + arr["x1"][cand]) / 2.0
+        order = np.argsort(cx, kind="stable")
+        c = cx[order]
+        c = c - c.mean()  # shift-invariant; keeps the prefix sums well conditioned
+        n = c.size
+        s1 = np.cumsum(c)
+        s2 = np.cumsum(c * c)
+        k = np.arange(1, n)
+        sl, sl2 = s1[k - 1], s2[k - 1]
+        sr, sr2 = s1[-1] - sl, s2[-1] - sl2
+        ss = (sl2 - sl * sl / k) + (sr2 - sr * sr / (n - k))
+        best_i = int(np.argmin(ss)) + 1
+        return _split(blocks, arr, cand[order[:best_i]])
     elif gap < 0.15:
-        col_blocks = sorted(blocks, key=lambda b: xyxy(b["bbox"])[1])
-        xr = (min(xyxy(b["bbox"])[0] for b in col_blocks), max(xyxy(b["bbox"])[2] for b in col_blocks))
-        return [{"blocks": col_blocks, "xrange": xr}]
+        return single()
     # Two columns: split indices by gap index
-    left_idxs = {lefts[j][1] for j in range(gi+1)}
-    col1 = [blocks[j] for j in sorted(left_idxs)]
-    col2 = [blocks[j] for j in range(len(blocks)) if j not in left_idxs]
-    # Compute xrange for each
-    def col_range(col):
-        x0s = [xyxy(b["bbox"])[0] for b in col]
-        x1s = [xyxy(b["bbox"])[2] for b in col]
-        if not x0s:
-            return (0.0, 1.0)
-        # Add a tiny margin
-        return (max(0.0, min(x0s) - 0.01), min(1.0, max(x1s) + 0.01))
-    col1.sort(key=lambda b: xyxy(b["bbox"])[1])
-    col2.sort(key=lambda b: xyxy(b["bbox"])[1])
-    return [
-        {"blocks": col1, "xrange": col_range(col1)},
-        {"blocks": col2, "xrange": col_range(col2)},
-    ]
+    return _split(blocks, arr, lefts[:gi + 1])
+
+
+# Automatic single/double-column decision from the x-distribution of text lines.
+# Features: share of lines crossing the best gutter candidate, the vertical extent of
+# the thinner side, and the share of lines on the smaller side. Weights were fitted on
+# the sample exams (every page separated with margin); lines centred in the top/bottom
+# LAYOUT_MARGIN (running headers, page numbers) are ignored.
+LAYOUT_MARGIN = 0.06
+LAYOUT_WEIGHTS = (-80.0, 12.0, 4.0, -3.25)  # crossing, coverage, balance, bias
+MIN_LAYOUT_LINES = 6
+_GUTTER_STEPS = np.linspace(0.3, 0.7, 41)  # gutter candidates, as fractions of the text width
+
+
+def _covered(y0: np.ndarray, y1: np.ndarray) -> float:
+    # Total length of the union of [y0, y1] intervals
+    if y0.size == 0:
+        return 0.0
+    order = np.argsort(y0, kind="stable")
+    total, start, end = 0.0, y0[order[0]], y1[order[0]]
+    for a, b in zip(y0[order[1:]].tolist(), y1[order[1:]].tolist()):
+        if a > end:
+            total += end - start
+            start, end = a, b
+        else:
+            end = max(end, b)
+    return float(total + end - start)
 
 
-def segment_page(blocks: List[Dict[str, Any]], page_index: Optional[int] = None, forced_columns: Optional[int] = None) -> List[Dict[str, Any]]:
-    # blocks: [{text, bbox, type}]
+def classify_columns(blocks: List[Block], arr: Optional[np.ndarray] = None) -> Tuple[int, float]:
+    # (1 or 2 columns, confidence in [0.5, 1]). Pages with too few lines default to one column.
+    if arr is None:
+        arr = block_array(blocks)
+    is_text = (arr["flags"] & F_TEXT) != 0
+    sel = is_text & (arr["type"] == TYPE_CODES["line"])
+    if not sel.any():
+        sel = is_text & (arr["type"] == TYPE_CODES["paragraph"])
+    cy = (arr["y0"] + arr["y1"]) / 2.0
+    a = arr[sel & (cy > LAYOUT_MARGIN) & (cy < 1.0 - LAYOUT_MARGIN)]
+    if len(a) < MIN_LAYOUT_LINES:
+        return 1, 0.5
+    x0, x1, y0, y1 = a["x0"], a["x1"], a["y0"], a["y1"]
+    lo, hi = float(x0.min()), float(x1.max())
+    height = max(1e-6, float(y1.max() - y0.min()))
+    # Gutter: the candidate crossed by the fewest lines, nearest the centre on ties
+    xs = lo + _GUTTER_STEPS * (hi - lo)
+    crossing = ((x0[None, :] < xs[:, None]) & (x1[None, :] > xs[:, None])).sum(axis=1)
+    best = int(np.lexsort((np.abs(_GUTTER_STEPS - 0.5), crossing))[0])
+    left, right = x1 <= xs[best], x0 >= xs[best]
+    coverage = min(_covered(y0[left], y1[left]), _covered(y0[right], y1[right])) / height
+    balance = min(int(left.sum()), int(right.sum())) / len(a)
+    wc, wv, wb, bias = LAYOUT_WEIGHTS
+    z = wc * crossing[best] / len(a) + wv * coverage + wb * balance + bias
+    p = 1.0 / (1.0 + np.exp(-2.0 * z))
+    return (2, float(p)) if p >= 0.5 else (1, float(1.0 - p))
+
+
+def decide_columns(blocks: List[Block], page_index: int, forced_columns: Optional[int], ex_pages: set[int]) -> Tuple[int, float, str]:
+    # (columns, confidence, source). Forced layouts flip on exception pages (1-based);
+    # without one the page is classified on its own and exceptions don't apply.
+    if forced_columns in (1, 2):
+        if page_index + 1 in ex_pages:
+            return (2 if forced_columns == 1 else 1), 1.0, "exception"
+        return forced_columns, 1.0, "forced"
+    columns, confidence = classify_columns(blocks)
+    return columns, confidence, "auto"
+
+
+def segment_page(blocks: List[Block], page_index: Optional[int] = None, forced_columns: Optional[int] = None) -> List[Dict[str, Any]]:
+    arr, texts = _prepare(blocks)
     # Split into columns first
-    columns = resolve_columns(blocks, forced_columns=forced_columns)
+    columns = resolve_columns(blocks, forced_columns=forced_columns, arr=arr)
     problems: List[Dict[str, Any]] = []
+    # Indices (into blocks) of everything attached to a problem so far
+    covered = set()
 
     for col in columns:
         col_blocks = col["blocks"]
+        idx = col["index"]
+        gidx = idx.tolist()
+        ca = arr[idx]
+        x0l, y0l, x1l, y1l = (ca[f].tolist() for f in ("x0", "y0", "x1", "y1"))
+        flags = ca["flags"].tolist()
         x0c, x1c = col["xrange"]
+        # Constrain to this column by center-x
+        cx = (ca["x0"] + ca["x1"]) / 2.0
+        in_col = ((cx >= x0c) & (cx <= x1c)).tolist()
+        m = len(col_blocks)
         i = 0
-        while i < len(col_blocks):
+        while i < m:
             b = col_blocks[i]
-            text = (b.get("text") or "").strip()
-            if not (HEADER_RE.match(text)):
+            if not flags[i] & F_HEADER:
                 i += 1
                 continue
+            text = texts[gidx[i]]
             # Start a new problem. Some PDFs split 'Pregunta' and the number in adjacent blocks.
             header_block = b
+            body_bbox = (x0l[i], y0l[i], x1l[i], y1l[i])  # start with header box
+            merged = False
             # Try to merge with next block if together they form a header
-            if i + 1 < len(col_blocks):
-                nxt = col_blocks[i+1]
-                merged_text = (text + " " + (nxt.get("text") or "").strip()).strip()
+            if i + 1 < m:
+                merged_text = (text + " " + texts[gidx[i+1]]).strip()
                 if HEADER_RE.match(merged_text):
                     # expand header bbox
-                    x0,y0,x1,y1 = xyxy(b["bbox"])
-                    nx0,ny0,nx1,ny1 = xyxy(nxt["bbox"])
-                    hx0,hy0,hx1,hy1 = (min(x0,nx0), min(y0,ny0), max(x1,nx1), max(y1,ny1))
-                    header_block = {"text": merged_text, "bbox": [{"x":hx0,"y":hy0},{"x":hx1,"y":hy0},{"x":hx1,"y":hy1},{"x":hx0,"y":hy1}], "type": b.get("type")}
+                    hx0, hy0 = min(x0l[i], x0l[i+1]), min(y0l[i], y0l[i+1])
+                    hx1, hy1 = max(x1l[i], x1l[i+1]), max(y1l[i], y1l[i+1])
+                    body_bbox = (hx0, hy0, hx1, hy1)
+                    header_block = Block(b.page_index, body_bbox, b.type, merged_text, 0, len(merged_text))
+                    merged = True
                     i += 1  # consume next as part of header
+            if not merged:
+                covered.add(gidx[i])
             pb = {"header": header_block, "body": [], "choices": [], "figures": []}
-            body_bbox = xyxy(header_block["bbox"])  # start with header box
+            choice_pos: List[int] = []
             i += 1
             # Accumulate until next header
             # Scan ahead to collect blocks until we find E) or we hit next header/solution
             seen_labels = set()
             scan_idx = i
             end_idx = i
-            while scan_idx < len(col_blocks):
-                cur = col_blocks[scan_idx]
-                tcur = (cur.get("text") or "").strip()
-                # Constrain to this column by center-x
-                cx = (xyxy(cur["bbox"])[0] + xyxy(cur["bbox"])[2]) / 2.0
-                if cx < x0c or cx > x1c:
+            body_pos: List[int] = []
+            while scan_idx < m:
+                if not in_col[scan_idx]:
                     scan_idx += 1
                     continue
-                if HEADER_RE.match(tcur):
-                    break
-                if SOLUTION_RE.search(tcur):
+                f = flags[scan_idx]
+                if f & (F_HEADER | F_SOLUTION):
                     break
+                cur = col_blocks[scan_idx]
                 # Capture choices if present
-                if CHOICE_RE.match(tcur):
-                    lbl = tcur[:1]
-                    seen_labels.add(lbl)
+                if f & F_CHOICE:
+                    seen_labels.add(texts[gidx[scan_idx]][:1])
                     pb["choices"].append(cur)
+                    choice_pos.append(scan_idx)
                 # Always consider it part of the body region (even if it's a line), to compute the envelope
                 pb["body"].append(cur)
+                body_pos.append(scan_idx)
                 # Expand bbox envelope
                 x0,y0,x1,y1 = body_bbox
-                cx0,cy0,cx1,cy1 = xyxy(cur["bbox"]) 
-                body_bbox = (min(x0,cx0), min(y0,cy0), max(x1,cx1), max(y1,cy1))
+                body_bbox = (min(x0,x0l[scan_idx]), min(y0,y0l[scan_idx]), max(x1,x1l[scan_idx]), max(y1,y1l[scan_idx]))
                 end_idx = scan_idx
                 # Stop only when we've seen both A) and E) in this column (reduces bias from stray C))
                 if 'A' in seen_labels and 'E' in seen_labels:
@@ -179,92 +276,82 @@ def segment_page(blocks: List[Dict[str, Any]], page_index: Optional[int] = None,
             # Advance i to end of the scanned region
             i = max(i, end_idx + 1)
             # Within collected blocks, detect choices and figures
-            for blk in list(pb["body"]):
-                t = (blk.get("text") or "").strip()
-                if CHOICE_RE.match(t):
-                    pb["choices"].append(blk)
+            for k in body_pos:
+                if flags[k] & F_CHOICE:
+                    pb["choices"].append(col_blocks[k])
+                    choice_pos.append(k)
             # Ignore figures per new requirement; do not attach figures
             pb["figures"] = []
             # Needs review if <4 choices or header missing
             # Require A–E presence explicitly como recomendado
-            labels = { (ch.get("text") or "").strip()[:1] for ch in pb["choices"] }
+            labels = {texts[gidx[k]][:1] for k in choice_pos}
             if not {'A','B','C','D','E'}.issubset(labels):
                 # Attempt to pull choices that might be just below the body (first few following blocks)
                 lookahead = 5
                 k = i
-                while k < len(col_blocks) and lookahead > 0 and not (HEADER_RE.match((col_blocks[k].get("text") or ""))):
-                    t = (col_blocks[k].get("text") or "").strip()
-                    if CHOICE_RE.match(t):
+                while k < m and lookahead > 0 and not (flags[k] & F_HEADER):
+                    if flags[k] & F_CHOICE:
                         pb["choices"].append(col_blocks[k])
+                        choice_pos.append(k)
                     lookahead -= 1
                     k += 1
-                labels = { (ch.get("text") or "").strip()[:1] for ch in pb["choices"] }
+                labels = {texts[gidx[k]][:1] for k in choice_pos}
                 pb["needs_review"] = not {'A','B','C','D','E'}.issubset(labels)
             else:
                 pb["needs_review"] = False
             # Tighten bottom to last choice if present to avoid including solution text below
-            if pb["choices"]:
-                bottoms = [xyxy(ch["bbox"])[3] for ch in pb["choices"]]
+            if choice_pos:
                 x0,y0,x1,y1 = body_bbox
-                y1 = max(bottoms)
+                y1 = max(y1l[k] for k in choice_pos)
                 body_bbox = (x0,y0,x1,y1)
             pb["bbox"] = body_bbox
+            covered.update(gidx[k] for k in body_pos)
+            covered.update(gidx[k] for k in choice_pos)
             problems.append(pb)
         # Post-pass: clusters of choices without headers -> create needs_review problems
-        covered = set()
-        for pb in problems:
-            for blk in ([pb["header"]] if pb.get("header") else []) + pb.get("body", []) + pb.get("choices", []) + pb.get("figures", []):
-                covered.add(id(blk))
-        # Collect choice blocks not covered
-        remain_choices = [blk for blk in col_blocks if id(blk) not in covered and CHOICE_RE.match((blk.get("text") or "").strip())]
-        # Sort by top y
-        remain_choices.sort(key=lambda b: xyxy(b["bbox"])[1])
+        free = np.array([g not in covered for g in gidx], dtype=bool)
+        # Collect choice blocks not covered, sorted by top y
+        remain = [k for k in range(m) if free[k] and flags[k] & F_CHOICE]
+        remain.sort(key=lambda k: y0l[k])
         # Cluster by small vertical gaps
         clusters = []
         cur = []
         last_y1 = None
-        for blk in remain_choices:
-            y0 = xyxy(blk["bbox"])[1]
-            if last_y1 is None or y0 - last_y1 < 0.08:
-                cur.append(blk)
+        for k in remain:
+            if last_y1 is None or y0l[k] - last_y1 < 0.08:
+                cur.append(k)
             else:
                 if cur:
                     clusters.append(cur)
-                cur = [blk]
-            last_y1 = xyxy(blk["bbox"])[3]
+                cur = [k]
+            last_y1 = y1l[k]
         if cur:
             clusters.append(cur)
+        is_figure = np.isin(ca["type"], FIGURE_CODES)
         for cluster in clusters:
             if len(cluster) < 4:
                 continue
             # Determine vertical span
-            xs = []
-            ys = []
-            for blk in cluster:
-                x0,y0,x1,y1 = xyxy(blk["bbox"])
-                xs += [x0,x1]
-                ys += [y0,y1]
-            span = (min(xs), min(ys), max(xs), max(ys))
-            pb = {"header": {}, "body": [], "choices": list(cluster), "figures": [], "needs_review": True}
-            # Attach body blocks that overlap vertically >= 20%
-            for blk in col_blocks:
-                if id(blk) in covered or blk in cluster:
-                    continue
-                if overlap_y(span, xyxy(blk["bbox"])) >= 0.2:
-                    pb["body"].append(blk)
-            # Figures similarly
-            for blk in col_blocks:
-                if id(blk) in covered or blk in cluster:
-                    continue
-                t = (blk.get("text") or "").strip()
-                if blk.get("type") in {"figure","table","image"} and overlap_y(span, xyxy(blk["bbox"])) >= 0.2:
-                    pb["figures"].append(blk)
+            span = (
+                min(x0l[k] for k in cluster), min(y0l[k] for k in cluster),
+                max(x1l[k] for k in cluster), max(y1l[k] for k in cluster),
+            )
+            pb = {"header": None, "body": [], "choices": [col_blocks[k] for k in cluster], "figures": [], "needs_review": True}
+            # Attach body blocks that overlap vertically >= 20%, figures similarly
+            eligible = free.copy()
+            eligible[cluster] = False
+            hits = eligible & (overlap_y_many(span, ca) >= 0.2)
+            body_pos = np.flatnonzero(hits)
+            fig_pos = np.flatnonzero(hits & is_figure)
+            pb["body"] = [col_blocks[k] for k in body_pos.tolist()]
+            pb["figures"] = [col_blocks[k] for k in fig_pos.tolist()]
             # Compute bbox
-            allb = [span] + [xyxy(blk["bbox"]) for blk in pb["body"]] + [xyxy(blk["bbox"]) for blk in pb["figures"]]
-            x0 = min(b[0] for b in allb)
-            y0 = min(b[1] for b in allb)
-            x1 = max(b[2] for b in allb)
-            y1 = max(b[3] for b in allb)
+            x0, y0, x1, y1 = span
+            if body_pos.size:
+                x0 = min(x0, float(ca["x0"][body_pos].min()))
+                y0 = min(y0, float(ca["y0"][body_pos].min()))
+                x1 = max(x1, float(ca["x1"][body_pos].max()))
+                y1 = max(y1, float(ca["y1"][body_pos].max()))
             pb["bbox"] = (x0,y0,x1,y1)
             problems.append(pb)
     return problems
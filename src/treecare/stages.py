@@ -0,0 +1,159 @@
+from __future__ import annotations
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+# Threads joined by bounded queues. A full queue blocks the stage feeding it, so a slow
+# stage holds everything upstream back and at most `maxsize` items wait between any two
+# stages, however large the input. Each queue is named after the stage that consumes it;
+# depths() shows where work piles up (a queue that stays full sits in front of the bottleneck).
+# Items carry their position in the source, so results() can hand them out in source order
+# however the worker threads interleave.
+
+_DONE = object()
+_POLL = 0.1  # seconds between stop checks while blocked on a queue
+
+
+class StagedPipeline:
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+        self._threads: List[threading.Thread] = []
+        self._queues: Dict[str, queue.Queue] = {}
+        self._gauges: Dict[str, Callable[[], int]] = {}
+        self._window: threading.Semaphore | None = None
+        self.peaks: Dict[str, int] = {}
+
+    def source(self, items: Iterable[Any], name: str, maxsize: int, window: int = 0) -> str:
+        # Feeds `items` (consumed on its own thread) into queue `name`. window > 0 caps the
+        # items fed but not yet handed out by results(), which bounds its reordering buffer.
+        out = self._queue(name, maxsize)
+        self._window = threading.Semaphore(window) if window > 0 else None
+
+        def run():
+            for seq, item in enumerate(items):
+                if not self._acquire() or not self._put(name, out, (seq, item)):
+                    return
+            self._put(name, out, _DONE)
+
+        self._spawn(f"{name}-source", run)
+        return name
+
+    def stage(self, inbox: str, fn: Callable[[Any], Any], name: str, maxsize: int, workers: int = 1) -> str:
+        # `workers` threads apply fn to each item of `inbox` and put results (None drops) into `name`
+        src, out = self._queues[inbox], self._queue(name, maxsize)
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def run():
+            while True:
+                item = self._get(src)
+                if item is _DONE:
+                    src.put(_DONE)  # let the other workers of this stage see it too
+                    break
+                if item is None:
+                    return  # stopped
+                seq, payload = item
+                # Dropped items still travel (as None) so ordered results() can skip past them
+                result = fn(payload) if payload is not None else None
+                if not self._put(name, out, (seq, result)):
+                    return
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._put(name, out, _DONE)
+
+        for i in range(workers):
+            self._spawn(f"{inbox}-{i}", run)
+        return name
+
+    def gauge(self, name: str, depth: Callable[[], int]):
+        # A queue owned elsewhere (e.g. the DB writer's), reported alongside the stage queues
+        self._gauges[name] = depth
+
+    def results(self, name: str, ordered: bool = False) -> Iterator[Any]:
+        # Items of queue `name`, on the calling thread, in source order if `ordered`;
+        # re-raises the first stage error
+        q = self._queues[name]
+        early: Dict[int, Any] = {}  # ordered: items that overtook an earlier one
+        nxt = 0
+        while True:
+            item = self._get(q)
+            if item is _DONE or item is None:
+                break
+            seq, payload = item
+            if not ordered:
+                ready = [payload]
+            else:
+                early[seq] = payload
+                ready = []
+                while nxt in early:
+                    ready.append(early.pop(nxt))
+                    nxt += 1
+            for payload in ready:
+                if payload is not None:
+                    yield payload
+                if self._window is not None:
+                    self._window.release()
+        if self._errors:
+            raise self._errors[0]
+
+    def depths(self) -> Dict[str, int]:
+        out = {name: q.qsize() for name, q in self._queues.items()}
+        for name, depth in self._gauges.items():
+            out[name] = depth()
+            self.peaks[name] = max(self.peaks.get(name, 0), out[name])
+        return out
+
+    def close(self):
+        # Stops every stage (items in flight are dropped) and waits for the threads;
+        # stage errors surface through results()
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+
+    def _queue(self, name: str, maxsize: int) -> queue.Queue:
+        q: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self._queues[name] = q
+        self.peaks[name] = 0
+        return q
+
+    def _spawn(self, name: str, target: Callable[[], None]):
+        def guarded():
+            try:
+                target()
+            except BaseException as e:
+                self._errors.append(e)
+                self._stop.set()
+
+        t = threading.Thread(target=guarded, name=f"treecare-{name}", daemon=True)
+        self._threads.append(t)
+        t.start()
+
+    def _put(self, name: str, q: queue.Queue, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+            except queue.Full:
+                continue
+            self.peaks[name] = max(self.peaks[name], q.qsize())
+            return True
+        return False
+
+    def _acquire(self) -> bool:
+        # A slot in the source window, unless the pipeline is stopped first
+        while not self._stop.is_set():
+            if self._window is None or self._window.acquire(timeout=_POLL):
+                return True
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        # The next item, or None once the pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return None
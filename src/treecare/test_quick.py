@@ -2,12 +2,14 @@ from __future__ import annotations
 from pathlib import Path
 import sys
 import json
-import tempfile
 import fitz  # PyMuPDF
 from google.protobuf.json_format import MessageToDict
 
 from .config import settings
 from .docai import process_pdf
+from .backends import make_backend
+from .cache import default_cache
+from .chunks import range_bytes
 
 
 def find_first_pdf(dir_path: str) -> Path:
@@ -19,18 +21,11 @@ def find_first_pdf(dir_path: str) -> Path:
     raise FileNotFoundError(f"No PDFs found in {dir_path}")
 
 
-def make_3page_temp(pdf_path: Path) -> Path:
-    with fitz.open(str(pdf_path)) as src:
-        n = min(3, len(src))
-        doc = fitz.open()
-        if n == 0:
-            raise ValueError("PDF has 0 pages")
-        doc.insert_pdf(src, from_page=0, to_page=n - 1)
-        tmp_dir = Path(tempfile.mkdtemp(prefix="treecare_test_"))
-        out = tmp_dir / f"{pdf_path.stem}_first3.pdf"
-        doc.save(str(out))
-        doc.close()
-        return out
+def make_3page_bytes(src: fitz.Document) -> bytes:
+    n = min(3, len(src))
+    if n == 0:
+        raise ValueError("PDF has 0 pages")
+    return range_bytes(src, 0, n)
 
 
 def count_norm_boxes(doc) -> tuple[int, int]:
@@ -55,11 +50,17 @@ def count_norm_boxes(doc) -> tuple[int, int]:
 def main():
     try:
         pdf_path = find_first_pdf("pdfs/raw")
-        test_pdf = make_3page_temp(pdf_path)
-        doc = process_pdf(settings.project_id, settings.location, settings.processor_id, str(test_pdf))
-        # Write JSON output
+        with fitz.open(str(pdf_path)) as src:
+            test_pdf = make_3page_bytes(src)
+        backend = make_backend()
+        doc = process_pdf(
+            settings.project_id, settings.location, settings.processor_id, test_pdf,
+            cache=default_cache(), processor_version=settings.processor_version, backend=backend,
+        )
+        # Write JSON output; only live Document AI output replaces the recorded test_output.json
         data = MessageToDict(doc._pb, preserving_proto_field_name=True)
-        Path("test_output.json").write_text(json.dumps(data, ensure_ascii=False))
+        out = "test_output.json" if backend.name == "docai" else f"test_output.{backend.name}.json"
+        Path(out).write_text(json.dumps(data, ensure_ascii=False))
         # Check normalized boxes
         boxes, pages = count_norm_boxes(doc)
         if boxes > 0:
@@ -0,0 +1,132 @@
+from __future__ import annotations
+from typing import Dict, List
+import fitz  # PyMuPDF
+from google.cloud import documentai_v1 as documentai
+
+from .config import settings
+from .docai import Block, PARAGRAPH, LINE
+
+# Local extraction for born-digital pages: PyMuPDF's text layer already has the words
+# and exact geometry, so these pages can skip Document AI entirely.
+
+REPLACEMENT_CHARS = {"�", "\x00"}
+
+
+def page_kind(page: fitz.Page, min_chars: int | None = None, max_bad_ratio: float = 0.05,
+              max_image_cover: float = 0.6) -> str:
+    # "text" when the page's own text layer is usable, otherwise "ocr".
+    # Scans show up as little or no text under a page-sized image; fonts without a
+    # Unicode map show up as replacement characters.
+    min_chars = settings.textlayer_min_chars if min_chars is None else min_chars
+    text = page.get_text("text")
+    chars = [ch for ch in text if not ch.isspace()]
+    if len(chars) < min_chars:
+        return "ocr"
+    bad = sum(1 for ch in chars if ch in REPLACEMENT_CHARS or 0xE000 <= ord(ch) <= 0xF8FF)
+    if bad / len(chars) > max_bad_ratio:
+        return "ocr"
+    area = abs(page.rect) or 1.0
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    if covered / area > max_image_cover:
+        return "ocr"
+    return "text"
+
+
+def page_blocks(page: fitz.Page, page_index: int) -> List[Block]:
+    # Same shape as pipeline.extract_blocks: one PARAGRAPH per text block and one LINE per
+    # line, all slicing a single page string (paragraph text = its lines joined by newlines)
+    w, h = page.rect.width or 1.0, page.rect.height or 1.0
+    x_off, y_off = page.rect.x0, page.rect.y0
+    parts: List[str] = []
+    pos = 0
+    spans = []  # (type, bbox, start, end)
+
+    def norm(bbox) -> tuple:
+        x0, y0, x1, y1 = bbox
+        return (
+            max(0.0, min(1.0, (x0 - x_off) / w)),
+            max(0.0, min(1.0, (y0 - y_off) / h)),
+            max(0.0, min(1.0, (x1 - x_off) / w)),
+            max(0.0, min(1.0, (y1 - y_off) / h)),
+        )
+
+    for block in page.get_text("dict", flags=fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP)["blocks"]:
+        if block.get("type") != 0:
+            continue
+        para_start = pos
+        lines = []
+        for line in block["lines"]:
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if not text:
+                continue
+            lines.append((norm(line["bbox"]), pos, pos + len(text)))
+            parts.append(text + "\n")
+            pos += len(text) + 1
+        if not lines:
+            continue
+        spans.append((PARAGRAPH, norm(block["bbox"]), para_start, pos))
+        spans.extend((LINE, bbox, start, end) for bbox, start, end in lines)
+    source = "".join(parts)
+    # Paragraphs first, then lines, mirroring the Document AI extraction order
+    paras = [Block(page_index, bbox, t, source, s, e) for t, bbox, s, e in spans if t == PARAGRAPH]
+    lines = [Block(page_index, bbox, t, source, s, e) for t, bbox, s, e in spans if t == LINE]
+    return paras + lines
+
+
+def local_pages(src: fitz.Document, pages: List[int]) -> Dict[int, List[Block]]:
+    # Blocks for the pages whose text layer is usable; the rest are left for OCR
+    out: Dict[int, List[Block]] = {}
+    for p in pages:
+        page = src[p]
+        if page_kind(page) == "text":
+            out[p] = page_blocks(page, p)
+    return out
+
+
+def _layout(block: Block, offset: int) -> documentai.Document.Page.Layout:
+    x0, y0, x1, y1 = block.bbox
+    return documentai.Document.Page.Layout(
+        text_anchor=documentai.Document.TextAnchor(text_segments=[
+            documentai.Document.TextAnchor.TextSegment(start_index=offset + block.start, end_index=offset + block.end)
+        ]),
+        bounding_poly=documentai.BoundingPoly(normalized_vertices=[
+            documentai.NormalizedVertex(x=x0, y=y0), documentai.NormalizedVertex(x=x1, y=y0),
+            documentai.NormalizedVertex(x=x1, y=y1), documentai.NormalizedVertex(x=x0, y=y1),
+        ]),
+    )
+
+
+def text_document(content: bytes) -> documentai.Document:
+    # The text layer of every page, shaped like a Document AI response (one text string,
+    # paragraphs and lines anchored into it), so it can stand in for OCR anywhere
+    texts: List[str] = []
+    pages = []
+    offset = 0
+    with fitz.open(stream=content, filetype="pdf") as src:
+        for p, page in enumerate(src):
+            blocks = page_blocks(page, p)
+            source = blocks[0].source if blocks else ""
+            pages.append(documentai.Document.Page(
+                page_number=p + 1,
+                dimension=documentai.Document.Page.Dimension(width=page.rect.width, height=page.rect.height, unit="points"),
+                paragraphs=[documentai.Document.Page.Paragraph(layout=_layout(b, offset)) for b in blocks if b.type == PARAGRAPH],
+                lines=[documentai.Document.Page.Line(layout=_layout(b, offset)) for b in blocks if b.type == LINE],
+            ))
+            texts.append(source)
+            offset += len(source)
+    return documentai.Document(text="".join(texts), pages=pages)
+
+
+class TextLayerBackend:
+    # OCR backend that never leaves the machine; scanned pages come back empty
+    name = "textlayer"
+    cache_id = "textlayer"
+    version = ""
+    qpm = 0
+    cacheable = False  # re-reading the PDF is as cheap as parsing a cached response
+
+    def process(self, content: bytes) -> documentai.Document:
+        return text_document(content)
+
+    def check(self) -> str:
+        return "Text-layer backend: no credentials needed (scanned pages yield no text)"
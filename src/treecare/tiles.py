@@ -0,0 +1,91 @@
+from __future__ import annotations
+import mmap
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Packed crop store: encoded images are appended back to back to one file and located
+# through crop_tiles(problem_id, zoom, format) -> (byte_offset, byte_length, width, height).
+# The file is only ever appended to, so an offset stays valid for the life of the file.
+
+# (problem_id, width, height, encoded bytes)
+Tile = Tuple[int, int, int, bytes]
+
+
+def tile_zoom(zoom: float) -> float:
+    # Zoom is part of the key; rounding keeps 2.0 and 2.00000001 the same tile
+    return round(zoom, 4)
+
+
+class TileWriter:
+    # Appends tiles and records them in crop_tiles. Data is fsynced before the index rows
+    # commit, so an interrupted export leaves unreferenced bytes at worst, never a bad offset.
+
+    def __init__(self, path: str, conn: sqlite3.Connection):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(path, "ab")
+        self.conn = conn
+
+    def add(self, tiles: List[Tile], zoom: float, fmt: str):
+        rows = []
+        for pid, width, height, data in tiles:
+            offset = self.f.tell()
+            self.f.write(data)
+            rows.append((pid, tile_zoom(zoom), fmt, offset, len(data), width, height))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO crop_tiles(problem_id, zoom, format, byte_offset, byte_length, width, height) "
+            "VALUES (?,?,?,?,?,?,?)",
+            rows,
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.f.close()
+
+
+class TileReader:
+    # Serves tiles from a read-only mmap of the packed file. The map is redone when an
+    # offset lies past its end (the file grew since it was mapped).
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mm: Optional[mmap.mmap] = None
+
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            pass
+
+    def read(self, offset: int, length: int) -> Optional[bytes]:
+        end = offset + length
+        with self._lock:
+            if self._mm is None or end > len(self._mm):
+                self._remap()
+            if self._mm is None or end > len(self._mm):
+                return None
+            return self._mm[offset:end]
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+
+
+def find_tile(conn: sqlite3.Connection, problem_id: int, zoom: float, fmt: str):
+    # (byte_offset, byte_length, width, height) or None
+    return conn.execute(
+        "SELECT byte_offset, byte_length, width, height FROM crop_tiles WHERE problem_id=? AND zoom=? AND format=?",
+        (problem_id, tile_zoom(zoom), fmt),
+    ).fetchone()
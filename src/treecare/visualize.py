@@ -0,0 +1,156 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+import fitz  # PyMuPDF
+from tqdm import tqdm
+
+from .config import settings
+from .docai import process_pdf, Block
+from .cache import DocumentCache
+from .chunks import range_bytes, MAX_SYNC_PAGES
+from .export import render_crops
+from .pipeline import pages_from_doc, parse_pages, split_local
+from .segment import segment_page, classify_columns
+from .manifest import parse_columns, read_structured
+
+
+@dataclass
+class VisualizeItem:
+    pdf: Path
+    columns: int | None  # 1, 2 or None to detect each page's layout
+    pages: str = ""  # 1-based ranges, e.g. "1-10,12"; empty for every page
+    exceptions: str = ""  # 1-based pages that use the opposite layout
+
+
+def find_pdf(name: str, root: str = "pdfs/raw") -> Path:
+    p = Path(name)
+    if p.exists():
+        return p
+    for cand in Path(root).glob("**/*.pdf"):
+        if cand.name == name or cand.stem == Path(name).stem:
+            return cand
+    raise FileNotFoundError(f"PDF not found: {name}")
+
+
+def parse_item(spec: str) -> VisualizeItem:
+    # "<pdf>:<s|d|a>[:<pages>[:<exceptions>]]", the batch_visualize.sh item format
+    parts = spec.split(":")
+    if len(parts) < 2 or parts[1] not in ("s", "d", "a"):
+        raise ValueError(f"Expected <pdf>:<s|d|a>[:<pages>[:<exceptions>]], got {spec!r}")
+    return VisualizeItem(find_pdf(parts[0]), parse_columns(parts[1]), *parts[2:4])
+
+
+def load_items(path: str) -> List[VisualizeItem]:
+    # JSON/YAML list of {"pdf", "columns": "s"|"d"|"auto", "pages", "exceptions"}, or one item per line
+    if Path(path).suffix.lower() in (".json", ".yaml", ".yml"):
+        return [
+            VisualizeItem(find_pdf(e["pdf"]), parse_columns(e.get("columns", "s")), str(e.get("pages", "")), str(e.get("exceptions", "")))
+            for e in read_structured(path)
+        ]
+    text = Path(path).read_text(encoding="utf-8")
+    return [parse_item(line.strip()) for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+
+
+def page_range(spec: str, total: int) -> List[int]:
+    # 1-based ranges -> sorted 0-based page indices
+    if not spec.strip() or spec.strip() == "all":
+        return list(range(total))
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        first, last = int(lo), int(hi or lo)
+        if first < 1 or last > total or first > last:
+            raise ValueError(f"Page range {part} outside 1-{total}")
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+
+def crop_name(stem: str, page_index: int, columns: int | None, i: int) -> str:
+    # Page (1-based), the layout the page was segmented with (s, d or a for auto) and the
+    # problem's position on the page, so single- and double-column runs never overwrite each other
+    layout = {1: "s", 2: "d"}.get(columns, "a")
+    return f"{stem}_p{page_index + 1:03d}_{layout}_prob{i:02d}.png"
+
+
+def page_columns(item: VisualizeItem, page_index: int, ex_pages: set[int], blocks: List[Block]) -> int:
+    if item.columns is None:
+        return classify_columns(blocks)[0]
+    if page_index + 1 in ex_pages:
+        return 2 if item.columns == 1 else 1
+    return item.columns
+
+
+def visualize(items: List[VisualizeItem], out_dir: str, cache: DocumentCache | None = None, refresh: bool = False,
+              concurrency: int = 4, backend=None, text_layer: str | None = None, zoom: float = 2.0) -> int:
+    # Crops for every selected page, in one process. Each PDF is OCR'd in the pipeline's fixed
+    # MAX_SYNC_PAGES windows (the same bytes as `process`, so the response cache is shared);
+    # only windows containing selected pages are sent. Returns the number of crops written.
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    text_layer = text_layer or settings.text_layer
+    docs = [fitz.open(str(item.pdf)) for item in items]
+    selected = [page_range(item.pages, len(src)) for item, src in zip(items, docs)]
+    local: List[tuple[int, Dict[int, List[Block]]]] = []
+    windows: List[tuple[int, int, bytes, List[int]]] = []  # (item index, start page, chunk bytes, pages)
+    for n, (item, src) in enumerate(zip(items, docs)):
+        text_pages, pending = split_local(src, set(selected[n]), text_layer)
+        if text_pages:
+            local.append((n, text_pages))
+        for start in range(0, len(src), MAX_SYNC_PAGES):
+            end = min(start + MAX_SYNC_PAGES, len(src))
+            todo = sorted(p for p in pending if start <= p < end)
+            if todo:
+                windows.append((n, start, range_bytes(src, start, end, garbage=settings.chunk_garbage), todo))
+    print(f"{sum(len(s) for s in selected)} pages from {len(items)} PDFs: {len(windows)} OCR requests")
+
+    progress = tqdm(total=sum(len(s) for s in selected), desc="Visualizing", unit="page")
+    total = 0
+
+    def save(n: int, pages: Dict[int, List[Block]], todo: List[int]) -> int:
+        item, src = items[n], docs[n]
+        ex_pages = parse_pages(item.exceptions)
+        count = 0
+        for p in todo:
+            blocks = pages.get(p, [])
+            cols = page_columns(item, p, ex_pages, blocks)
+            problems = segment_page(blocks, page_index=p, forced_columns=cols)
+            pixes = render_crops(src[p], [pb["bbox"] for pb in problems], zoom)
+            for i, pix in enumerate(pixes, start=1):
+                pix.save(str(out / crop_name(item.pdf.stem, p, cols, i)))
+            count += len(pixes)
+            progress.set_postfix_str(f"{item.pdf.stem} p{p + 1}")
+            progress.update(1)
+        return count
+
+    def ocr(content: bytes):
+        return process_pdf(
+            settings.project_id, settings.location, settings.processor_id, content,
+            cache=cache, refresh=refresh, processor_version=settings.processor_version, backend=backend,
+        )
+
+    try:
+        for n, pages in local:
+            total += save(n, pages, sorted(pages))
+        # OCR runs on the pool; segmentation and rendering stay on this thread
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = {pool.submit(ocr, content): (n, start, todo) for n, start, content, todo in windows}
+            del windows
+            try:
+                for fut in as_completed(futures):
+                    n, start, todo = futures[fut]
+                    total += save(n, pages_from_doc(fut.result(), start), todo)
+            except BaseException:
+                for f in futures:
+                    f.cancel()
+                raise
+    finally:
+        progress.close()
+        for src in docs:
+            src.close()
+    print(f"Saved {total} crops to {out}")
+    return total
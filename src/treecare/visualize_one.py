@@ -1,13 +1,16 @@
 from __future__ import annotations
 import argparse
 from pathlib import Path
-import tempfile
 import fitz  # PyMuPDF
 
 from .config import settings
 from .docai import process_pdf
+from .backends import make_backend, BACKENDS
+from .cache import default_cache
+from .chunks import range_bytes
 from .pipeline import extract_blocks
 from .segment import segment_page
+from .visualize import crop_name
 
 
 def find_pdf(input_path: str) -> Path:
@@ -22,18 +25,11 @@ def find_pdf(input_path: str) -> Path:
     raise FileNotFoundError(f"PDF not found: {input_path}")
 
 
-def make_single_page(pdf_path: Path, page_index_1b: int) -> Path:
-    with fitz.open(str(pdf_path)) as src:
-        idx0 = page_index_1b - 1
-        if idx0 < 0 or idx0 >= len(src):
-            raise ValueError(f"Page out of range: {page_index_1b}")
-        doc = fitz.open()
-        doc.insert_pdf(src, from_page=idx0, to_page=idx0)
-        tmp_dir = Path(tempfile.mkdtemp(prefix="treecare_one_"))
-        out = tmp_dir / f"{pdf_path.stem}_p{page_index_1b:03d}.pdf"
-        doc.save(str(out))
-        doc.close()
-        return out
+def make_single_page(src: fitz.Document, page_index_1b: int) -> bytes:
+    idx0 = page_index_1b - 1
+    if idx0 < 0 or idx0 >= len(src):
+        raise ValueError(f"Page out of range: {page_index_1b}")
+    return range_bytes(src, idx0, idx0 + 1)
 
 
 def main():
@@ -42,30 +38,38 @@ def main():
     ap.add_argument("--page", type=int, required=True, help="1-based page number")
     ap.add_argument("--columns", choices=["s","d"], required=True, help="Force single (s) or double (d) column")
     ap.add_argument("--out", default="data/crops_quick", help="Output directory for PNG crops")
+    ap.add_argument("--no-cache", action="store_true", help="Do not read or write the Document AI response cache")
+    ap.add_argument("--refresh", action="store_true", help="Ignore cached responses and re-OCR")
+    ap.add_argument("--backend", choices=BACKENDS, default=settings.ocr_backend, help="OCR backend")
     args = ap.parse_args()
 
     pdf_path = find_pdf(args.pdf)
-    one_pdf = make_single_page(pdf_path, args.page)
+    src = fitz.open(str(pdf_path))
+    one_pdf = make_single_page(src, args.page)
 
     # Process via Document AI
-    doc = process_pdf(settings.project_id, settings.location, settings.processor_id, str(one_pdf))
+    doc = process_pdf(
+        settings.project_id, settings.location, settings.processor_id, one_pdf,
+        cache=default_cache(not args.no_cache), refresh=args.refresh,
+        processor_version=settings.processor_version, backend=make_backend(args.backend),
+    )
 
     # Extract blocks and segment
     blocks = extract_blocks(doc)
     pages = {}
     for b in blocks:
-        pages.setdefault(b["page_index"], []).append(b)
+        pages.setdefault(b.page_index, []).append(b)
 
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
 
     fc = 1 if args.columns == 's' else 2
 
-    # Open original page image (for correct geometry)
-    with fitz.open(str(one_pdf)) as src:
+    # Render from the original page (same geometry as the single-page request)
+    with src:
         for page_idx, page_blocks in pages.items():
             problems = segment_page(page_blocks, page_index=page_idx, forced_columns=fc)
-            page = src[page_idx]
+            page = src[args.page - 1 + page_idx]
             for i, pb in enumerate(problems, start=1):
                 x0n, y0n, x1n, y1n = pb["bbox"]
                 rect = fitz.Rect(
@@ -75,7 +79,7 @@ def main():
                     y1n * page.rect.height,
                 )
                 pix = page.get_pixmap(matrix=fitz.Matrix(2,2), clip=rect, alpha=False)
-                fname = f"{pdf_path.stem}_p{args.page:03d}_prob{i:02d}.png"
+                fname = crop_name(pdf_path.stem, args.page - 1 + page_idx, fc, i)
                 pix.save(str(out_dir / fname))
             print(f"Saved {len(problems)} crops to {out_dir}")
 
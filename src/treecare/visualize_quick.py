@@ -1,11 +1,14 @@
 from __future__ import annotations
 from pathlib import Path
-import tempfile
 import fitz  # PyMuPDF
 from .config import settings
 from .docai import process_pdf
+from .backends import make_backend
+from .cache import default_cache
+from .chunks import range_bytes
 from .pipeline import extract_blocks
 from .segment import segment_page
+from .visualize import crop_name
 
 
 def find_first_pdf(dir_path: str) -> Path:
@@ -17,18 +20,11 @@ def find_first_pdf(dir_path: str) -> Path:
     raise FileNotFoundError(f"No PDFs found in {dir_path}")
 
 
-def make_3page_temp(pdf_path: Path) -> Path:
-    with fitz.open(str(pdf_path)) as src:
-        n = min(3, len(src))
-        if n == 0:
-            raise ValueError("PDF has 0 pages")
-        doc = fitz.open()
-        doc.insert_pdf(src, from_page=0, to_page=n - 1)
-        tmp_dir = Path(tempfile.mkdtemp(prefix="treecare_quickviz_"))
-        out = tmp_dir / f"{pdf_path.stem}_first3.pdf"
-        doc.save(str(out))
-        doc.close()
-        return out
+def make_3page_bytes(src: fitz.Document) -> bytes:
+    n = min(3, len(src))
+    if n == 0:
+        raise ValueError("PDF has 0 pages")
+    return range_bytes(src, 0, n)
 
 
 def to_xyxy(norm_bbox):
@@ -42,19 +38,24 @@ def to_xyxy(norm_bbox):
 
 def main():
     pdf_path = find_first_pdf("pdfs/raw")
-    sample_pdf = make_3page_temp(pdf_path)
+    src = fitz.open(str(pdf_path))
+    sample_pdf = make_3page_bytes(src)
     # Process with Document AI
-    doc = process_pdf(settings.project_id, settings.location, settings.processor_id, str(sample_pdf))
+    doc = process_pdf(
+        settings.project_id, settings.location, settings.processor_id, sample_pdf,
+        cache=default_cache(), processor_version=settings.processor_version, backend=make_backend(),
+    )
     # Extract blocks and segment per page
     blocks = extract_blocks(doc)
     pages = {}
     for b in blocks:
-        pages.setdefault(b["page_index"], []).append(b)
+        pages.setdefault(b.page_index, []).append(b)
 
     out_dir = Path("data/crops_quick")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    with fitz.open(str(sample_pdf)) as src:
+    # The sample is the first pages of the source, so render straight from it
+    with src:
         total = 0
         for page_idx, page_blocks in sorted(pages.items()):
             problems = segment_page(page_blocks)
@@ -68,7 +69,7 @@ def main():
                     y1n * page.rect.height,
                 )
                 pix = page.get_pixmap(matrix=fitz.Matrix(2,2), clip=rect, alpha=False)
-                fname = f"{Path(pdf_path).stem}_p{page_idx+1:03d}_prob{i:02d}.png"
+                fname = crop_name(Path(pdf_path).stem, page_idx, None, i)
                 pix.save(str(out_dir / fname))
                 total += 1
         print(f"Saved {total} problem crops to {out_dir}")
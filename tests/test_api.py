@@ -0,0 +1,116 @@
+import io
+import json
+import sqlite3
+import zipfile
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from treecare import api
+from treecare.config import settings
+from treecare.db import BulkWriter, get_conn, init_db
+from test_db import V0_SCHEMA
+from treecare.crops import CropSpec, render_in_worker, render_pages_in_worker
+
+SAMPLE = sorted((Path(__file__).resolve().parents[1] / "pdfs" / "raw").glob("*.pdf"))[0]
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # Startup runs init_db; keep it away from the checked-in database
+    saved = settings.db_path
+    settings.db_path = str(tmp_path_factory.mktemp("db") / "t.sqlite")
+    try:
+        with TestClient(api.app) as c:
+            yield c
+    finally:
+        settings.db_path = saved
+
+
+def crop(client, pdf_path, **extra):
+    return client.post("/crop", json={"pdf_path": str(pdf_path), "page_index": 0, "bbox_norm": [0, 0, 0.5, 0.5], **extra})
+
+
+def test_crop_renders(client):
+    r = crop(client, SAMPLE, scale=1)
+    assert r.status_code == 200 and r.headers["content-type"] == "image/png"
+
+
+def test_scale_above_cap_is_rejected(client):
+    assert crop(client, SAMPLE, scale=500).status_code == 400
+
+
+def test_unreadable_file_is_a_bad_request(client, tmp_path):
+    bogus = tmp_path / "not_a.pdf"
+    bogus.write_bytes(b"this is not a pdf")
+    assert crop(client, bogus).status_code == 400
+
+
+def test_mupdf_errors_become_value_errors(tmp_path):
+    bogus = tmp_path / "not_a.pdf"
+    bogus.write_bytes(b"this is not a pdf")
+    with pytest.raises(ValueError):
+        render_in_worker(str(bogus), 0, CropSpec(bbox=(0, 0, 1, 1)))
+
+
+def test_bad_page_is_skipped_in_batches(tmp_path):
+    bogus = tmp_path / "not_a.pdf"
+    bogus.write_bytes(b"this is not a pdf")
+    spec = CropSpec(bbox=(0, 0, 0.5, 0.5), scale=1)
+    out = render_pages_in_worker([(str(bogus), 0, [("bad", spec)]), (str(SAMPLE), 0, [("good", spec)])])
+    assert [key for key, _ in out] == ["good"]
+
+
+def test_missing_pdf_is_not_found(client, tmp_path):
+    assert crop(client, tmp_path / "gone.pdf").status_code == 404
+
+
+def test_batch_reports_missing_pdfs(client, tmp_path, monkeypatch):
+    db = str(tmp_path / "t.sqlite")
+    init_db(db)
+    monkeypatch.setattr(settings, "db_path", db)
+    writer = BulkWriter(db)
+    ids = []
+    for path in (SAMPLE, tmp_path / "gone.pdf"):
+        with get_conn(db) as conn:
+            pdf_id = conn.execute("INSERT INTO pdfs(path) VALUES (?)", (str(path),)).lastrowid
+        ids.append(writer.add_problem(pdf_id, 0, (0.0, 0.0, 0.5, 0.5), "Pregunta 1", "", 0, "body"))
+    writer.commit()
+    writer.close()
+    r = client.post("/problems/images:batch", json={"ids": ids + [ids[-1] + 1], "scale": 1})
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        assert [item["id"] for item in manifest["items"]] == ids[:1]
+        assert [item["id"] for item in manifest["missing"]] == [ids[1], ids[1] + 1]
+
+
+@pytest.mark.parametrize("accept,legacy", [
+    ("application/json", True),
+    ("application/json; charset=utf-8", True),
+    ("application/json, text/plain, */*", False),
+    ("*/*", False),
+    (None, False),
+])
+def test_only_explicit_json_gets_base64(client, accept, legacy):
+    headers = {"Accept": accept} if accept else {}
+    r = client.post("/crop", json={"pdf_path": str(SAMPLE), "page_index": 0, "bbox_norm": [0, 0, 0.5, 0.5]}, headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/json" if legacy else "image/png")
+
+
+def test_startup_migrates_an_old_database(tmp_path, monkeypatch):
+    db = tmp_path / "old.sqlite"
+    conn = sqlite3.connect(db)
+    conn.executescript(V0_SCHEMA)
+    conn.close()
+    monkeypatch.setattr(settings, "db_path", str(db))
+    with TestClient(api.app) as c:
+        assert c.get("/search", params={"q": "conjunto"}).status_code == 200
+        assert c.get("/crop/1").status_code == 404
+
+
+def test_read_connection_is_reused_per_thread(client):
+    assert api.db() is api.db()
+    assert client.get("/search", params={"q": "conjunto"}).status_code == 200
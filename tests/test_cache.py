@@ -0,0 +1,50 @@
+import asyncio
+import os
+from pathlib import Path
+
+from treecare.cache import DiskLRU
+from treecare.crops import Crop, CropCache
+
+
+def keys_on_disk(root):
+    return sorted(p.stem for p in Path(root).glob("*/*.bin"))
+
+
+def test_disk_lru_evicts_least_recently_used(tmp_path, monkeypatch):
+    lru = DiskLRU(str(tmp_path), max_bytes=30)
+    for key in ("aa1", "bb2", "cc3"):
+        lru.put_bytes(key, b"x" * 10)
+    assert lru.get_bytes("aa1") == b"x" * 10
+    # The directory is scanned once; later writes evict from the in-memory index
+    monkeypatch.setattr(Path, "glob", lambda *a, **k: (_ for _ in ()).throw(AssertionError("rescanned")))
+    lru.put_bytes("dd4", b"x" * 10)
+    monkeypatch.undo()
+    assert keys_on_disk(tmp_path) == ["aa1", "cc3", "dd4"]
+
+
+def test_disk_lru_index_follows_mtime_order(tmp_path):
+    old = DiskLRU(str(tmp_path), max_bytes=100)
+    for i, key in enumerate(("aa1", "bb2", "cc3")):
+        old.put_bytes(key, b"x" * 10)
+        os.utime(old._path(key), (1000 - i, 1000 - i))  # cc3 is the oldest
+    fresh = DiskLRU(str(tmp_path), max_bytes=30)
+    fresh.put_bytes("dd4", b"x" * 10)
+    assert keys_on_disk(tmp_path) == ["aa1", "bb2", "dd4"]
+
+
+def test_crop_cache_disk_tier_from_event_loop(tmp_path):
+    crop = Crop(b"png-bytes", 3, 2, "png")
+
+    async def roundtrip():
+        cache = CropCache(1024, DiskLRU(str(tmp_path), 1024, suffix=".img"))
+        cache.store("ab12", crop)
+        await asyncio.sleep(0)
+        # A second process (empty memory tier) reads it back through a thread
+        for _ in range(100):
+            if list(tmp_path.glob("*/*.img")):
+                break
+            await asyncio.sleep(0.01)
+        other = CropCache(1024, DiskLRU(str(tmp_path), 1024, suffix=".img"))
+        return await other.fetch_many(["ab12", "cd34"])
+
+    assert asyncio.run(roundtrip()) == {"ab12": crop}
@@ -0,0 +1,35 @@
+import fitz
+from google.cloud import documentai_v1 as documentai
+
+from treecare.cache import DocumentCache
+from treecare.chunks import range_bytes
+from treecare.docai import process_pdf
+
+
+class CountingBackend:
+    name = "counting"
+    cacheable = True
+    cache_id = "test-processor"
+    version = ""
+    qpm = 0
+
+    def __init__(self):
+        self.calls = 0
+
+    def process(self, content: bytes) -> documentai.Document:
+        self.calls += 1
+        return documentai.Document(text=f"call {self.calls}")
+
+
+def test_same_chunk_hits_the_response_cache(tmp_path):
+    # A fresh random /ID per save would change the bytes, and with them the cache key
+    with fitz.open() as src:
+        for i in range(3):
+            src.new_page().insert_text((72, 72), f"page {i}")
+        first, second = range_bytes(src, 0, 2), range_bytes(src, 0, 2)
+    assert first == second
+    cache = DocumentCache(str(tmp_path), 1 << 20)
+    backend = CountingBackend()
+    docs = [process_pdf("", "", "", chunk, cache=cache, backend=backend) for chunk in (first, second)]
+    assert backend.calls == 1
+    assert docs[0].text == docs[1].text == "call 1"
@@ -0,0 +1,67 @@
+import sqlite3
+
+from treecare.db import BulkWriter, init_db, get_conn
+
+
+def add_problem(writer, pdf_id):
+    pid = writer.add_problem(pdf_id, 0, (0.0, 0.0, 1.0, 1.0), "Pregunta 1", "", 0, "body")
+    writer.add_choice(pid, "A", "A) 1", (0.0, 0.5, 0.5, 0.6))
+    writer.commit()
+    return pid
+
+
+def test_deleted_problem_ids_are_not_reused(tmp_path):
+    # /problems/{id}/image, zip manifests and canonical_id refer to problems by ID
+    db = str(tmp_path / "t.sqlite")
+    init_db(db)
+    with get_conn(db) as conn:
+        pdf_id = conn.execute("INSERT INTO pdfs(path) VALUES ('exam.pdf')").lastrowid
+    writer = BulkWriter(db)
+    first, last = add_problem(writer, pdf_id), add_problem(writer, pdf_id)
+    writer.close()
+    with get_conn(db) as conn:
+        conn.execute("DELETE FROM problems WHERE id=?", (last,))
+    writer = BulkWriter(db)
+    new = add_problem(writer, pdf_id)
+    writer.close()
+    assert new > last > first
+    with get_conn(db) as conn:
+        assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name='problems'").fetchone()[0] == new
+        assert conn.execute("SELECT MAX(id) FROM choices").fetchone()[0] == 3
+
+
+# Schema before versioning (user_version 0): text bboxes and problems.pdf_path
+V0_SCHEMA = """
+CREATE TABLE pdfs (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL UNIQUE, pages INTEGER,
+                   processed_at TEXT, processor_id TEXT);
+CREATE TABLE problems (id INTEGER PRIMARY KEY AUTOINCREMENT, pdf_path TEXT NOT NULL, page_index INTEGER NOT NULL,
+                       bbox_norm TEXT NOT NULL, header_text TEXT, sample_text TEXT, needs_review INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE choices (id INTEGER PRIMARY KEY AUTOINCREMENT, problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+                      label TEXT NOT NULL, text TEXT, bbox_norm TEXT NOT NULL);
+CREATE TABLE figures (id INTEGER PRIMARY KEY AUTOINCREMENT, problem_id INTEGER NOT NULL REFERENCES problems(id) ON DELETE CASCADE,
+                      bbox_norm TEXT NOT NULL, caption_text TEXT);
+"""
+
+
+def test_migration_keeps_autoincrement_high_water_marks(tmp_path):
+    db = str(tmp_path / "old.sqlite")
+    conn = sqlite3.connect(db)
+    conn.executescript(V0_SCHEMA)
+    for i in range(6):
+        pid = conn.execute(
+            "INSERT INTO problems(pdf_path, page_index, bbox_norm) VALUES ('exam.pdf', ?, '0,0,1,1')", (i,)
+        ).lastrowid
+        conn.execute("INSERT INTO choices(problem_id, label, bbox_norm) VALUES (?, 'A', '0,0,1,1')", (pid,))
+    conn.execute("DELETE FROM problems WHERE id=6")  # the last question was deleted
+    conn.execute("DELETE FROM choices WHERE id=6")
+    conn.commit()
+    conn.close()
+    init_db(db)
+    with get_conn(db) as conn:
+        seqs = dict(conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+        assert seqs["problems"] == 6 and seqs["choices"] == 6
+        assert not any(name.endswith("_v2") for name in seqs)
+    writer = BulkWriter(db)
+    (pdf_id,) = writer.conn.execute("SELECT id FROM pdfs").fetchone()
+    assert add_problem(writer, pdf_id) == 7
+    writer.close()
@@ -0,0 +1,59 @@
+import re
+
+from treecare.db import init_db, get_conn
+from treecare.dedup import link_duplicates
+from treecare.ingest import clear_pages
+
+# Body-less fragments from the sample corpus (AAH p14 and SCI p22) that share a stock answer list
+STOCK_A = "A) Solo I B) Solo II C) Solo III D) I y II E) II y III"
+STOCK_B = "A) Solo I B) Solo II C) Solo III D) I y II E) I, II y III"
+BODY = "Si el conjunto A tiene 5 elementos y el conjunto B tiene 3 elementos, ¿cuántas funciones de A en B existen?"
+
+
+def add_problems(db, rows, path="exam.pdf"):
+    # As written by the pipeline: choice blocks are part of body_text and have their own rows
+    ids = []
+    with get_conn(db) as conn:
+        pdf_id = conn.execute("INSERT INTO pdfs(path) VALUES (?)", (path,)).lastrowid
+        for page, (body, choices) in enumerate(rows):
+            pid = conn.execute(
+                "INSERT INTO problems(pdf_id, page_index, x0, y0, x1, y1, body_text, choices_text) VALUES (?,?,0,0,1,1,?,?)",
+                (pdf_id, page, f"{body}\n{choices}".strip(), choices),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO choices(problem_id, label, text, x0, y0, x1, y1) VALUES (?,?,?,0,0,1,1)",
+                [(pid, ch[0], ch.strip()) for ch in re.split(r"(?=[A-E]\) )", choices) if ch.strip()],
+            )
+            ids.append(pid)
+    return pdf_id, ids
+
+
+def test_shared_answer_list_without_body_is_not_linked(tmp_path):
+    db = str(tmp_path / "t.sqlite")
+    init_db(db)
+    _, ids = add_problems(db, [("", STOCK_A), ("", STOCK_B)])
+    with get_conn(db) as conn:
+        assert link_duplicates(conn, ids, 0.8) == {}
+        assert conn.execute("SELECT COUNT(*) FROM problems WHERE canonical_id IS NOT NULL").fetchone()[0] == 0
+
+
+def test_same_body_is_linked_to_first_seen(tmp_path):
+    db = str(tmp_path / "t.sqlite")
+    init_db(db)
+    _, ids = add_problems(db, [(BODY, STOCK_A), (BODY.upper(), STOCK_B)])
+    with get_conn(db) as conn:
+        assert link_duplicates(conn, ids, 0.8) == {ids[1]: ids[0]}
+
+
+def test_cluster_survives_deleting_its_canonical(tmp_path):
+    # Re-ingesting the PDF that holds the canonical must not split the other PDFs' copies
+    db = str(tmp_path / "t.sqlite")
+    init_db(db)
+    first_pdf, first = add_problems(db, [(BODY, STOCK_A)], "first.pdf")
+    _, second = add_problems(db, [(BODY, STOCK_A)], "second.pdf")
+    _, third = add_problems(db, [(BODY.lower(), STOCK_B)], "third.pdf")
+    with get_conn(db) as conn:
+        link_duplicates(conn, first + second + third, 0.8)
+        clear_pages(conn, first_pdf, [0])
+        rows = dict(conn.execute("SELECT id, canonical_id FROM problems").fetchall())
+    assert rows == {second[0]: None, third[0]: second[0]}
@@ -0,0 +1,77 @@
+import fitz
+
+from treecare.config import settings
+from treecare.db import BulkWriter, get_conn, init_db
+from treecare.docai import PARAGRAPH, Block
+from treecare.pipeline import commit_job, plan
+
+
+def make_pdf(path, label, pages=2):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"{label} page {i}")
+    doc.save(str(path))
+    doc.close()
+
+
+def problem(text):
+    body = Block(0, (0.1, 0.1, 0.9, 0.2), PARAGRAPH, text, 0, len(text))
+    return {"bbox": body.bbox, "header": None, "body": [body], "choices": [], "figures": []}
+
+
+def commit(db, pdf_id, todo, text, revision=None):
+    writer = BulkWriter(db)
+    try:
+        commit_job(pdf_id, todo, [(p, [problem(f"{text} {p}")]) for p in todo], revision=revision)(writer)
+        writer.commit()
+    finally:
+        writer.close()
+
+
+def bodies(db, pdf_id):
+    with get_conn(db) as conn:
+        return dict(conn.execute("SELECT page_index, body_text FROM problems WHERE pdf_id=?", (pdf_id,)).fetchall())
+
+
+def test_changed_pdf_keeps_old_problems_until_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "dedup_threshold", 0)
+    db, pdf = str(tmp_path / "t.sqlite"), tmp_path / "exam.pdf"
+    init_db(db)
+    make_pdf(pdf, "old")
+    pdf_id, pending, revision = plan(db, pdf, 2)
+    assert pending == {0, 1} and revision is None
+    commit(db, pdf_id, [0, 1], "old")
+
+    make_pdf(pdf, "new")
+    # Planning alone (e.g. OCR then fails) must not touch the old results
+    _, pending, revision = plan(db, pdf, 2)
+    assert pending == {0, 1} and revision is not None
+    assert bodies(db, pdf_id) == {0: "old 0", 1: "old 1"}
+
+    # The first chunk adopts the new content; the other page keeps its problems until redone
+    commit(db, pdf_id, [0], "new", revision)
+    assert bodies(db, pdf_id) == {0: "new 0", 1: "old 1"}
+    _, pending, revision = plan(db, pdf, 2)
+    assert pending == {1} and revision is None
+    commit(db, pdf_id, [1], "new")
+    assert bodies(db, pdf_id) == {0: "new 0", 1: "new 1"}
+    with get_conn(db) as conn:
+        assert conn.execute("SELECT status FROM pdfs WHERE id=?", (pdf_id,)).fetchone()[0] == "done"
+
+
+def test_page_layouts_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "dedup_threshold", 0)
+    db, pdf = str(tmp_path / "t.sqlite"), tmp_path / "exam.pdf"
+    init_db(db)
+    make_pdf(pdf, "old")
+    pdf_id, _, _ = plan(db, pdf, 2)
+    writer = BulkWriter(db)
+    commit_job(pdf_id, [0, 1], [], {0: (2, 0.987654, "auto"), 1: (1, 1.0, "exception")})(writer)
+    writer.commit()
+    writer.close()
+    with get_conn(db) as conn:
+        rows = conn.execute(
+            "SELECT page_index, layout_columns, layout_confidence, layout_source FROM pdf_pages WHERE pdf_id=? ORDER BY page_index",
+            (pdf_id,),
+        ).fetchall()
+    assert rows == [(0, 2, 0.9877, "auto"), (1, 1, 1.0, "exception")]
@@ -0,0 +1,48 @@
+import pytest
+from google.cloud import documentai_v1 as documentai
+
+from treecare.parallel import SegmentPool, pack_page, unpack_page
+from treecare.pipeline import pages_from_doc
+from test_segment import ROOT, summary
+
+
+@pytest.fixture(scope="module")
+def pages():
+    doc = documentai.Document.from_json((ROOT / "test_output.json").read_text(encoding="utf-8"), ignore_unknown_fields=True)
+    # The recorded pages twice over, so a pool of two gets several shards
+    recorded = pages_from_doc(doc, 0)
+    more = pages_from_doc(doc, len(recorded))
+    return {**recorded, **more}
+
+
+def run(pages, jobs, forced_columns=None, ex_pages=frozenset()):
+    pool = SegmentPool(jobs)
+    try:
+        segmented, layouts = pool.segment(pages, forced_columns, set(ex_pages))
+    finally:
+        pool.close()
+    return [(p, summary(problems)) for p, problems in segmented], layouts
+
+
+@pytest.mark.parametrize("forced_columns,ex_pages", [(None, ()), (2, (2, 5))])
+def test_results_do_not_depend_on_jobs(pages, forced_columns, ex_pages):
+    serial = run(pages, 1, forced_columns, ex_pages)
+    assert [p for p, _ in serial[0]] == sorted(pages)
+    assert run(pages, 2, forced_columns, ex_pages) == serial
+
+
+def test_pool_returns_the_callers_blocks(pages):
+    pool = SegmentPool(2)
+    try:
+        segmented, _ = pool.segment(pages, 2, set())
+    finally:
+        pool.close()
+    ids = {id(b) for blocks in pages.values() for b in blocks}
+    assert all(id(b) in ids for _, problems in segmented for pb in problems for b in pb["body"])
+
+
+def test_pack_roundtrip(pages):
+    # Blocks come back pointing into the shipped text slices, with the same text
+    def fields(blocks):
+        return [(b.page_index, b.bbox, b.type, b.text) for b in blocks]
+    assert fields(unpack_page(pack_page(0, pages[0], None, set()))) == fields(pages[0])
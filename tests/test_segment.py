@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+
+import pytest
+from google.cloud import documentai_v1 as documentai
+
+from treecare.docai import LINE, Block
+from treecare.pipeline import pages_from_doc
+from treecare.segment import classify_columns, decide_columns, segment_page
+
+ROOT = Path(__file__).resolve().parents[1]
+# Segmentation of the recorded test_output.json pages by segment.py as it was before the
+# NumPy rewrite (dict blocks), per forced layout. Regenerate only on intended behaviour changes.
+EXPECTED = json.loads((Path(__file__).parent / "data" / "segment_expected.json").read_text(encoding="utf-8"))
+
+
+@pytest.fixture(scope="module")
+def recorded_pages():
+    doc = documentai.Document.from_json((ROOT / "test_output.json").read_text(encoding="utf-8"), ignore_unknown_fields=True)
+    return pages_from_doc(doc, 0)
+
+
+def summary(problems):
+    def text(b):
+        return b.text.strip()
+    return [{
+        "header": text(pb["header"]) if pb["header"] else "",
+        "bbox": [round(v, 9) for v in pb["bbox"]],
+        "body": [text(b) for b in pb["body"]],
+        "choices": [text(b) for b in pb["choices"]],
+        "figures": len(pb["figures"]),
+        "needs_review": bool(pb.get("needs_review")),
+    } for pb in problems]
+
+
+@pytest.mark.parametrize("layout,columns", [("auto", None), ("1", 1), ("2", 2)])
+def test_segmentation_matches_pre_numpy_output(recorded_pages, layout, columns):
+    got = {str(p): summary(segment_page(blocks, page_index=p, forced_columns=columns)) for p, blocks in sorted(recorded_pages.items())}
+    assert got == EXPECTED[layout]
+
+
+def lines(x0, x1, n=20):
+    text = "texto de la pregunta"
+    return [Block(0, (x0, 0.1 + 0.04 * i, x1, 0.13 + 0.04 * i), LINE, text, 0, len(text)) for i in range(n)]
+
+
+def test_classify_single_and_double_columns():
+    cols, conf = classify_columns(lines(0.1, 0.9))
+    assert cols == 1 and conf > 0.9
+    cols, conf = classify_columns(lines(0.08, 0.46) + lines(0.54, 0.92))
+    assert cols == 2 and conf > 0.9
+
+
+def test_classify_sparse_page_defaults_to_one_column():
+    assert classify_columns(lines(0.08, 0.46, n=2) + lines(0.54, 0.92, n=2)) == (1, 0.5)
+
+
+def test_recorded_pages_are_double_column(recorded_pages):
+    for blocks in recorded_pages.values():
+        cols, conf = classify_columns(blocks)
+        assert cols == 2 and conf > 0.9
+
+
+def test_forced_layouts_flip_on_exception_pages():
+    double = lines(0.08, 0.46) + lines(0.54, 0.92)
+    assert decide_columns(double, 0, 1, set()) == (1, 1.0, "forced")
+    assert decide_columns(double, 2, 1, {3}) == (2, 1.0, "exception")
+    # Exceptions only apply to forced layouts
+    cols, _, source = decide_columns(double, 2, None, {3})
+    assert (cols, source) == (2, "auto")
@@ -0,0 +1,43 @@
+import random
+import time
+
+from treecare.stages import StagedPipeline
+
+
+def test_ordered_results_follow_source_order():
+    # Workers finish out of order; ordered results (and dropped items) must not care
+    rng = random.Random(0)
+    delays = [rng.uniform(0, 0.01) for _ in range(60)]
+
+    def slow(i):
+        time.sleep(delays[i])
+        return None if i % 7 == 0 else i
+
+    stages = StagedPipeline()
+    try:
+        stages.source(range(60), "work", 4, window=12)
+        stages.stage("work", slow, "done", 4, workers=4)
+        out = list(stages.results("done", ordered=True))
+    finally:
+        stages.close()
+    assert out == [i for i in range(60) if i % 7]
+
+
+def test_stage_error_is_raised():
+    def boom(i):
+        if i == 3:
+            raise ValueError("bad item")
+        return i
+
+    stages = StagedPipeline()
+    try:
+        stages.source(range(10), "work", 2)
+        stages.stage("work", boom, "done", 2, workers=2)
+        try:
+            list(stages.results("done", ordered=True))
+        except ValueError as e:
+            assert "bad item" in str(e)
+        else:
+            raise AssertionError("stage error was swallowed")
+    finally:
+        stages.close()
@@ -0,0 +1,60 @@
+import fitz
+import pytest
+
+from treecare.docai import LINE, PARAGRAPH
+from treecare.textlayer import local_pages, page_blocks, page_kind
+
+PARAGRAPH_TEXT = "Si el conjunto A tiene 5 elementos y el conjunto B tiene 3 elementos"
+
+
+@pytest.fixture
+def doc():
+    with fitz.open() as d:
+        yield d
+
+
+def add_text(page, lines=6):
+    for i in range(lines):
+        page.insert_text((72, 72 + 14 * i), PARAGRAPH_TEXT)
+
+
+def add_scan(page):
+    # A page-sized grey image, like a scanned sheet
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 60, 80), False)
+    pix.clear_with(200)
+    page.insert_image(page.rect, pixmap=pix)
+
+
+def test_born_digital_page_uses_its_text_layer(doc):
+    page = doc.new_page()
+    add_text(page)
+    assert page_kind(page) == "text"
+
+
+def test_sparse_or_scanned_pages_go_to_ocr(doc):
+    doc.new_page().insert_text((72, 72), "12")
+    add_scan(doc.new_page())
+    # Enough text, but under a page-sized image: a scan with an OCR'd or stamped layer
+    stamped = doc.new_page()
+    add_scan(stamped)
+    add_text(stamped)
+    assert [page_kind(p) for p in doc] == ["ocr", "ocr", "ocr"]
+
+
+def test_min_chars_threshold(doc):
+    page = doc.new_page()
+    add_text(page, lines=1)
+    assert page_kind(page, min_chars=10) == "text"
+    assert page_kind(page, min_chars=1000) == "ocr"
+
+
+def test_local_pages_only_returns_text_pages(doc):
+    add_text(doc.new_page())
+    add_scan(doc.new_page())
+    pages = local_pages(doc, [0, 1])
+    assert list(pages) == [0]
+    blocks = pages[0]
+    assert {b.type for b in blocks} == {PARAGRAPH, LINE}
+    assert [b.text for b in blocks if b.type == LINE] == [PARAGRAPH_TEXT] * 6
+    assert all(0.0 <= v <= 1.0 for b in blocks for v in b.bbox)
+    assert page_blocks(doc[0], 0)[0].text.splitlines() == [PARAGRAPH_TEXT] * 6
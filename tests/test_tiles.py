@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+
+from treecare import api
+from treecare.config import settings
+from treecare.db import get_conn, init_db
+from treecare.tiles import TileReader, TileWriter, find_tile
+
+
+def test_tiles_round_trip_and_grow(tmp_path):
+    db, path = str(tmp_path / "t.sqlite"), str(tmp_path / "tiles.bin")
+    init_db(db)
+    reader = TileReader(path)
+    assert reader.read(0, 1) is None  # no tile file yet
+    with get_conn(db) as conn:
+        conn.execute("INSERT INTO pdfs(path) VALUES ('exam.pdf')")
+        for pid in (1, 2):
+            conn.execute("INSERT INTO problems(id, pdf_id, page_index, x0, y0, x1, y1) VALUES (?,1,0,0,0,1,1)", (pid,))
+        writer = TileWriter(path, conn)
+        writer.add([(1, 10, 20, b"first"), (2, 30, 40, b"second")], 2.0, "png")
+        assert find_tile(conn, 2, 2.00000001, "png") == (5, 6, 30, 40)
+        assert find_tile(conn, 2, 2.0, "webp") is None
+        assert reader.read(5, 6) == b"second"
+        # Appends after the reader mapped the file are found by remapping
+        writer.add([(1, 11, 21, b"replaced")], 2.0, "png")
+        offset, length, width, height = find_tile(conn, 1, 2.0, "png")
+        assert (offset, width, height) == (11, 11, 21)
+        assert reader.read(offset, length) == b"replaced"
+        assert reader.read(offset, length + 1) is None  # past the end of the file
+        writer.close()
+    reader.close()
+
+
+def test_api_serves_tiles(tmp_path, monkeypatch):
+    db, path = str(tmp_path / "t.sqlite"), str(tmp_path / "tiles.bin")
+    monkeypatch.setattr(settings, "db_path", db)
+    init_db(db)
+    with get_conn(db) as conn:
+        conn.execute("INSERT INTO pdfs(path) VALUES ('exam.pdf')")
+        conn.execute("INSERT INTO problems(id, pdf_id, page_index, x0, y0, x1, y1) VALUES (1,1,0,0,0,1,1)")
+        conn.execute("INSERT INTO problems(id, pdf_id, page_index, x0, y0, x1, y1, canonical_id) VALUES (2,1,0,0,0,1,1,1)")
+        writer = TileWriter(path, conn)
+        writer.add([(1, 3, 2, b"tile-bytes")], api.DEFAULT_ZOOM, "png")
+        writer.close()
+    monkeypatch.setattr(api, "tiles", TileReader(path))
+    with TestClient(api.app) as client:
+        for pid in (1, 2):  # a linked duplicate is served from its canonical's tile
+            r = client.get(f"/crop/{pid}")
+            assert r.status_code == 200 and r.content == b"tile-bytes"
+            assert r.headers["X-Image-Width"] == "3" and r.headers["ETag"].startswith('"tile-')